@@ -1,17 +1,33 @@
 from constructs import Construct
 import os
 import json
+import hashlib
 import aws_cdk.aws_s3 as s3
 import aws_cdk.aws_s3_notifications as s3n
 import aws_cdk.aws_stepfunctions as sfn
 import aws_cdk.aws_stepfunctions_tasks as tasks
 import aws_cdk.aws_lambda as lambda_
 import aws_cdk.aws_iam as iam
+import aws_cdk.aws_logs as logs
 import aws_cdk.aws_dynamodb as dynamodb
+import aws_cdk.aws_sqs as sqs
+import aws_cdk.aws_lambda_event_sources as lambda_event_sources
 import aws_cdk.custom_resources as custom_resources
 from aws_cdk import (CfnOutput, RemovalPolicy, Stack, Duration, Aws, CustomResource)
 import amazon_textract_idp_cdk_constructs as tcdk
 
+LAMBDA_ROOT = os.path.join(os.path.dirname(__file__), '../lambda')
+
+
+def shared_image_code(name: str, *sources: str) -> lambda_.DockerImageCode:
+    # lambda/ is the build context so lambda/<name>/Dockerfile can COPY the modules in lambda/shared/ and of the
+    # Lambda directories in sources, the other ones are excluded, so an image only changes with its own code,
+    # shared/ or sources
+    return lambda_.DockerImageCode.from_image_asset(
+        LAMBDA_ROOT,
+        file=f"{name}/Dockerfile",
+        exclude=[d for d in os.listdir(LAMBDA_ROOT) if d not in (name, 'shared') + sources])
+
 
 class DocumentSplitterWorkflow(Stack):
 
@@ -23,8 +39,33 @@ class DocumentSplitterWorkflow(Stack):
         s3_output_prefix = "textract-output"
         s3_csv_output_prefix = "textract-csv-output"
         s3_joined_output_prefix = "textract-joined-output"
+        s3_claim_check_prefix = "claim-check"
         comprehend_classifier_endpoint = \
             "arn:aws:comprehend:<REGION>:<ACCOUNT_ID>:document-classifier-endpoint/<CLASSIFIER_NAME>"
+        # EVERY_PAGE classifies each page, BOUNDARIES only the pages boundary_detection takes for the
+        # start of a new document, the pages after it inherit its documentType
+        classification_mode = "EVERY_PAGE"
+        # True configures all pages in one invocation before ProcessPagesMapState (one read of the distinct
+        # document types), the list of configured pages has to stay below the 256 KB state payload limit
+        configure_pages_in_bulk = False
+        # S3 stores the per page results of ProcessPagesMapState and the path lists of large documents under
+        # s3_claim_check_prefix and passes references, for packets whose lists exceed the 256 KB state payload limit.
+        # The item arrays of the inline Map states ($.pages, ClassifyPagesMapState and enumerate_pages output)
+        # stay in the state, they limit a packet to roughly 600-1000 pages
+        claim_check_store = "NONE"
+        # PARQUET also writes the fields and table cells of every joined document as typed Parquet datasets,
+        # partitioned by classification and execution date, under s3_joined_output_prefix/parquet
+        columnar_output = "NONE"
+        # True sends the upload notifications to an SQS queue the start Lambda reads in batches, failed starts are
+        # retried per message, False invokes the start Lambda directly from the S3 notification
+        start_from_queue = False
+        # True starts single page uploads (JPEG, PNG, countable single page PDF and TIFF) on an Express state
+        # machine that classifies, configures, extracts, generates the CSV and joins without DocumentSplitter
+        # and Map states, with the same output layout
+        single_page_fast_path = False
+        # True runs configurator, textract_sync, generatecsv and map_classifications_lambda of a page in one
+        # process_page invocation, the Textract response is passed to the CSV generation in memory
+        fused_page_processor = False
 
         # BEWARE! This is a demo/POC setup, remove the auto_delete_objects=True
         # to make sure the data is not lost
@@ -40,23 +81,57 @@ class DocumentSplitterWorkflow(Stack):
 
         # DEFINE Lambda functions, policies, DynamoDB table, Provider, CustomResource
 
+        # per second request counters shared by all textract_sync and comprehend_sync invocations
+        rate_limit_table = dynamodb.Table(
+            self,
+            "RateLimitTable",
+            partition_key=dynamodb.Attribute(
+                name="RATE_LIMIT_KEY", type=dynamodb.AttributeType.STRING
+            ),
+            time_to_live_attribute="EXPIRES_AT",
+            removal_policy=RemovalPolicy.DESTROY,
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST)
+        # requests per second per API for RATE_LIMITER MEMORY or DYNAMODB, set to the account quotas (ClassifyDocument
+        # depends on the endpoint inference units)
+        rate_limits = json.dumps({"AnalyzeDocument": 10, "DetectDocumentText": 10, "ClassifyDocument": 10})
+
         lambda_comprehend_sync = lambda_.DockerImageFunction(
             self,
             'ComprehendSyncCall',
-            code=lambda_.DockerImageCode.from_image_asset(os.path.join(script_location,
-                                                                       '../lambda/comprehend_sync/')),
+            code=shared_image_code('comprehend_sync'),
             memory_size=256,
             timeout=Duration.seconds(60),
             environment={
                 "LOG_LEVEL": "DEBUG",
                 "COMPREHEND_CLASSIFIER_ARN": comprehend_classifier_endpoint,
+                # BYTES lets Comprehend read the page, OCR_ONCE reads it with Textract (OCR_ONCE_FEATURES) and
+                # stores the result, textract_sync reuses it for document types without QUERIES
                 "TEXT_OR_BYTES": "BYTES",
+                "OCR_ONCE_FEATURES": json.dumps(["FORMS", "TABLES", "SIGNATURES"]),
+                "S3_OUTPUT_BUCKET": s3_output_bucket,
+                "S3_OUTPUT_PREFIX": s3_output_prefix,
+                # JSON_INDENT | JSON | GZIP | ZSTD (opt-in), generatecsv and comprehend_sync decode all of them
+                "OUTPUT_ENCODING": "JSON_INDENT",
+                # CASCADE classifies the text (TEXT, OCR_ONCE) with the bundled local model first and only calls
+                # the endpoint below LOCAL_CLASSIFIER_THRESHOLD
+                "LOCAL_CLASSIFIER": "NONE",
+                "LOCAL_CLASSIFIER_THRESHOLD": "0.9",
+                # NONE | MEMORY | DYNAMODB (CLASSIFICATION_CACHE_TABLE, partition key BAND_KEY, sort key FINGERPRINT)
+                "CLASSIFICATION_CACHE": "MEMORY",
+                "CLASSIFICATION_CACHE_SIMILARITY": "0.95",
                 "DOCUMENT_READER_CONFIG": json.dumps({
                     "DocumentReadAction": "TEXTRACT_DETECT_DOCUMENT_TEXT",
                     "DocumentReadMode": "FORCE_DOCUMENT_READ_ACTION"
-                })
+                }),
+                # NONE | MEMORY | DYNAMODB (opt-in, set rate_limits to the account quotas first)
+                "RATE_LIMITER": "NONE",
+                "RATE_LIMITER_TABLE": rate_limit_table.table_name,
+                "RATE_LIMITS": rate_limits
             }
         )
+        lambda_comprehend_sync.add_to_role_policy(iam.PolicyStatement(
+            actions=['dynamodb:UpdateItem'], resources=[rate_limit_table.table_arn]
+        ))
         lambda_comprehend_sync.add_to_role_policy(iam.PolicyStatement(
             actions=['comprehend:ClassifyDocument'], resources=['*']
         ))
@@ -76,9 +151,7 @@ class DocumentSplitterWorkflow(Stack):
         lambda_textract_sync: lambda_.IFunction = lambda_.DockerImageFunction(
             self,
             "LambdaTextractSync",
-            code=lambda_.DockerImageCode.from_image_asset(
-                os.path.join(script_location,
-                             '../lambda/textract_sync/')),
+            code=shared_image_code('textract_sync'),
             memory_size=300,
             timeout=Duration.seconds(300),
             architecture=lambda_.Architecture.X86_64,
@@ -86,10 +159,22 @@ class DocumentSplitterWorkflow(Stack):
                 "LOG_LEVEL": "DEBUG",
                 "S3_OUTPUT_BUCKET": s3_output_bucket,
                 "S3_OUTPUT_PREFIX": s3_output_prefix,
-                "TEXTRACT_API": "GENERIC"})
+                "TEXTRACT_API": "GENERIC",
+                # JSON_INDENT | JSON | GZIP | ZSTD (opt-in), generatecsv and comprehend_sync decode all of them
+                "OUTPUT_ENCODING": "JSON_INDENT",
+                # NONE | MEMORY | S3 | DYNAMODB (with TEXTRACT_CACHE_TABLE, partition key CACHE_KEY)
+                "TEXTRACT_CACHE": "S3",
+                "TEXTRACT_CACHE_PREFIX": f"{s3_output_prefix}/textract-cache",
+                "RATE_LIMITER": "NONE",
+                "RATE_LIMITER_TABLE": rate_limit_table.table_name,
+                "RATE_LIMITS": rate_limits})
         lambda_textract_sync.add_to_role_policy(
             iam.PolicyStatement(
-                actions=["textract:Analyze*", "textract:Detect*"],
+                actions=['dynamodb:UpdateItem'],
+                resources=[rate_limit_table.table_arn]))
+        lambda_textract_sync.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["textract:Analyze*", "textract:Detect*", "textract:Start*", "textract:Get*"],
                 resources=["*"]))
         lambda_textract_sync.add_to_role_policy(
             iam.PolicyStatement(
@@ -103,9 +188,7 @@ class DocumentSplitterWorkflow(Stack):
         lambda_generate_csv: lambda_.IFunction = lambda_.DockerImageFunction(
             self,
             "LambdaGenerateCSV",
-            code=lambda_.DockerImageCode.from_image_asset(
-                os.path.join(script_location,
-                             '../lambda/generatecsv/')),
+            code=shared_image_code('generatecsv'),
             memory_size=1048,
             timeout=Duration.minutes(15),
             architecture=lambda_.Architecture.X86_64,
@@ -114,16 +197,38 @@ class DocumentSplitterWorkflow(Stack):
                 "CSV_S3_OUTPUT_BUCKET": s3_output_bucket,
                 "CSV_S3_OUTPUT_PREFIX": s3_csv_output_prefix,
                 "JOINED_S3_OUTPUT_PREFIX": s3_joined_output_prefix,
-                "OUTPUT_TYPE": "CSV"})
+                "OUTPUT_TYPE": "CSV",
+                # STREAMING parses the Textract JSON incrementally to bound memory on large results
+                "PARSE_MODE": "DOCUMENT",
+                "TABLE_UPLOAD_WORKERS": "16"})
         lambda_generate_csv.add_to_role_policy(
             iam.PolicyStatement(
-                actions=['s3:Get*', 's3:List*', 's3:PutObject'],
+                actions=['s3:Get*', 's3:List*', 's3:PutObject', 's3:AbortMultipartUpload'],
                 resources=[f"arn:aws:s3:::{s3_output_bucket}", f"arn:aws:s3:::{s3_output_bucket}/*"]))
         lambda_generate_csv.add_to_role_policy(
             iam.PolicyStatement(
                 actions=['states:SendTaskFailure', 'states:SendTaskSuccess'],
                 resources=["*"]))
 
+        if classification_mode == "BOUNDARIES":
+            lambda_boundary_detection: lambda_.IFunction = lambda_.DockerImageFunction(
+                self,
+                "LambdaBoundaryDetection",
+                code=shared_image_code('boundary_detection'),
+                memory_size=1024,
+                timeout=Duration.seconds(180),
+                architecture=lambda_.Architecture.X86_64,
+                environment={
+                    "LOG_LEVEL": "DEBUG",
+                    # minimum Jaccard similarity of the header/footer text (or image hash) of adjacent pages
+                    # to continue the document, a new document is classified at least every MAX_SEGMENT_PAGES
+                    "BOUNDARY_SIMILARITY": "0.5",
+                    "BOUNDARY_MAX_SEGMENT_PAGES": "25"})
+            lambda_boundary_detection.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=['s3:GetObject', 's3:ListBucket'],
+                    resources=[f"arn:aws:s3:::{s3_output_bucket}", f"arn:aws:s3:::{s3_output_bucket}/*"]))
+
         lambda_enumerate_pages: lambda_.IFunction = lambda_.DockerImageFunction(
             self,
             "LambdaEnumeratePages",
@@ -148,18 +253,18 @@ class DocumentSplitterWorkflow(Stack):
         lambda_config_prefill: lambda_.IFunction = lambda_.DockerImageFunction(
             self,
             "LambdaConfigurationPrefill",
-            code=lambda_.DockerImageCode.from_image_asset(
-                os.path.join(script_location,
-                             '../lambda/config_prefill/')),
+            code=shared_image_code('config_prefill'),
             memory_size=300,
             timeout=Duration.seconds(300),
             architecture=lambda_.Architecture.X86_64,
             environment={
                 "LOG_LEVEL": "DEBUG",
-                "CONFIGURATION_TABLE": configuration_table.table_name})
+                "CONFIGURATION_TABLE": configuration_table.table_name,
+                # threads sending BatchWriteItem requests of 25 configurations
+                "WRITE_WORKERS": "8"})
         lambda_config_prefill.add_to_role_policy(
             iam.PolicyStatement(
-                actions=['dynamodb:PutItem', 'dynamodb:GetItem'],
+                actions=['dynamodb:PutItem', 'dynamodb:GetItem', 'dynamodb:BatchWriteItem', 'dynamodb:Scan'],
                 resources=[configuration_table.table_arn]))
         lambda_config_prefill.node.add_dependency(configuration_table)
 
@@ -167,7 +272,24 @@ class DocumentSplitterWorkflow(Stack):
             self,
             "Provider",
             on_event_handler=lambda_config_prefill)
-        CustomResource(self, "Resource", service_token=provider.service_token)
+        # CSV (DOCUMENT_TYPE,CONFIG) or JSONL catalog of the document type configurations, a file in the
+        # config_prefill image or an s3://bucket/key; a changed catalog updates the resource, which writes the diff
+        # and deletes the document types an earlier catalog load wrote that are no longer listed
+        configuration_source = "default_config.csv"
+        if configuration_source.startswith("s3://"):
+            lambda_config_prefill.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=['s3:GetObject'],
+                    resources=[f"arn:aws:s3:::{configuration_source[len('s3://'):]}"]))
+        with open(os.path.join(script_location, '../lambda/config_prefill/app/default_config.csv'), 'rb') as f:
+            default_config_hash = hashlib.sha256(f.read()).hexdigest()
+        CustomResource(self,
+                       "Resource",
+                       service_token=provider.service_token,
+                       properties={
+                           "ConfigurationSource": configuration_source,
+                           "ConfigurationHash": default_config_hash
+                       })
 
         lambda_configurator: lambda_.IFunction = lambda_.DockerImageFunction(
             self,
@@ -180,52 +302,124 @@ class DocumentSplitterWorkflow(Stack):
             architecture=lambda_.Architecture.X86_64,
             environment={
                 "LOG_LEVEL": "DEBUG",
-                "CONFIGURATION_TABLE": configuration_table.table_name})
+                "CONFIGURATION_TABLE": configuration_table.table_name,
+                # parsed configurations are kept per container, after the TTL only changed ones are parsed again
+                "CONFIGURATION_CACHE_TTL_S": "300",
+                "CONFIGURATION_CACHE_MAX_ENTRIES": "128"})
         lambda_configurator.add_to_role_policy(
             iam.PolicyStatement(
-                actions=['dynamodb:PutItem', 'dynamodb:GetItem'],
+                actions=['dynamodb:PutItem', 'dynamodb:GetItem', 'dynamodb:BatchGetItem'],
                 resources=[configuration_table.table_arn]))
 
         lambda_generate_classification_mapping: lambda_.IFunction = lambda_.DockerImageFunction(
             self,
             "LambdaGenerateClassificationMapping",
-            code=lambda_.DockerImageCode.from_image_asset(
-                os.path.join(script_location,
-                             '../lambda/map_classifications_lambda/')),
+            code=shared_image_code('map_classifications_lambda'),
             memory_size=128,
-            architecture=lambda_.Architecture.X86_64)
+            architecture=lambda_.Architecture.X86_64,
+            environment={
+                "CLAIM_CHECK_STORE": claim_check_store,
+                "CLAIM_CHECK_BUCKET": s3_output_bucket,
+                "CLAIM_CHECK_PREFIX": s3_claim_check_prefix})
+        lambda_generate_classification_mapping.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=['s3:PutObject'],
+                resources=[f"arn:aws:s3:::{s3_output_bucket}/{s3_claim_check_prefix}/*"]))
 
         lambda_compile_paths: lambda_.IFunction = lambda_.DockerImageFunction(
             self,
             "LambdaCompilePaths",
-            code=lambda_.DockerImageCode.from_image_asset(
-                os.path.join(script_location,
-                             '../lambda/compile_paths/')),
+            code=shared_image_code('compile_paths'),
             memory_size=1024,
             timeout=Duration.seconds(180),
             architecture=lambda_.Architecture.X86_64,
             environment={
-                "LOG_LEVEL": "DEBUG"})
+                "LOG_LEVEL": "DEBUG",
+                "CLAIM_CHECK_STORE": claim_check_store,
+                "CLAIM_CHECK_BUCKET": s3_output_bucket,
+                "CLAIM_CHECK_PREFIX": s3_claim_check_prefix,
+                # path lists up to this JSON size stay in the state
+                "CLAIM_CHECK_THRESHOLD_BYTES": "8192"})
+        lambda_compile_paths.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=['s3:GetObject', 's3:PutObject'],
+                resources=[f"arn:aws:s3:::{s3_output_bucket}/{s3_claim_check_prefix}/*"]))
 
         lambda_join_csv: lambda_.IFunction = lambda_.DockerImageFunction(
             self,
             "LambdaJoinCSV",
-            code=lambda_.DockerImageCode.from_image_asset(
-                os.path.join(script_location,
-                             '../lambda/join_csv/')),
+            code=shared_image_code('join_csv'),
             memory_size=1024,
             architecture=lambda_.Architecture.X86_64,
             timeout=Duration.seconds(180),
             environment={
                 "LOG_LEVEL": "DEBUG",
                 "JOINED_S3_OUTPUT_BUCKET": s3_output_bucket,
-                "JOINED_S3_OUTPUT_PREFIX": s3_joined_output_prefix
+                "JOINED_S3_OUTPUT_PREFIX": s3_joined_output_prefix,
+                # PANDAS parses and concatenates the page CSVs as DataFrames; STREAMING (opt-in) copies them in order
+                # into a multipart upload, JOIN_WORKERS fetched ahead, keeping generatecsv's bytes and CRLF endings
+                "JOIN_MODE": "PANDAS",
+                "JOIN_WORKERS": "16",
+                "COLUMNAR_OUTPUT": columnar_output,
+                "COLUMNAR_S3_OUTPUT_PREFIX": f"{s3_joined_output_prefix}/parquet",
+                "PARQUET_COMPRESSION": "zstd"
             })
         lambda_join_csv.add_to_role_policy(
             iam.PolicyStatement(
-                actions=["s3:Get*", "s3:List*", "s3:PutObject"],
+                actions=["s3:Get*", "s3:List*", "s3:PutObject", "s3:AbortMultipartUpload"],
                 resources=[f"arn:aws:s3:::{s3_output_bucket}", f"arn:aws:s3:::{s3_output_bucket}/*"]))
 
+        if fused_page_processor:
+            # configurator, textract_sync, generatecsv and map_classifications_lambda in one image, with their settings
+            lambda_process_page: lambda_.IFunction = lambda_.DockerImageFunction(
+                self,
+                "LambdaProcessPage",
+                code=shared_image_code('process_page', 'configurator', 'textract_sync', 'generatecsv',
+                                       'map_classifications_lambda'),
+                memory_size=1048,
+                timeout=Duration.minutes(15),
+                architecture=lambda_.Architecture.X86_64,
+                environment={
+                    "LOG_LEVEL": "DEBUG",
+                    # NONE when the pages are configured in bulk before ProcessPagesMapState
+                    "CONFIGURE": "NONE" if configure_pages_in_bulk else "PAGE",
+                    "CONFIGURATION_TABLE": configuration_table.table_name,
+                    "CONFIGURATION_CACHE_TTL_S": "300",
+                    "CONFIGURATION_CACHE_MAX_ENTRIES": "128",
+                    "S3_OUTPUT_BUCKET": s3_output_bucket,
+                    "S3_OUTPUT_PREFIX": s3_output_prefix,
+                    "TEXTRACT_API": "GENERIC",
+                    "OUTPUT_ENCODING": "JSON_INDENT",
+                    "TEXTRACT_CACHE": "S3",
+                    "TEXTRACT_CACHE_PREFIX": f"{s3_output_prefix}/textract-cache",
+                    "RATE_LIMITER": "NONE",
+                    "RATE_LIMITER_TABLE": rate_limit_table.table_name,
+                    "RATE_LIMITS": rate_limits,
+                    "CSV_S3_OUTPUT_BUCKET": s3_output_bucket,
+                    "CSV_S3_OUTPUT_PREFIX": s3_csv_output_prefix,
+                    "JOINED_S3_OUTPUT_PREFIX": s3_joined_output_prefix,
+                    "OUTPUT_TYPE": "CSV",
+                    "TABLE_UPLOAD_WORKERS": "16",
+                    "CLAIM_CHECK_STORE": claim_check_store,
+                    "CLAIM_CHECK_BUCKET": s3_output_bucket,
+                    "CLAIM_CHECK_PREFIX": s3_claim_check_prefix})
+            lambda_process_page.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=['dynamodb:UpdateItem'],
+                    resources=[rate_limit_table.table_arn]))
+            lambda_process_page.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=['dynamodb:GetItem', 'dynamodb:BatchGetItem'],
+                    resources=[configuration_table.table_arn]))
+            lambda_process_page.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=["textract:Analyze*", "textract:Detect*"],
+                    resources=["*"]))
+            lambda_process_page.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=['s3:Get*', 's3:List*', 's3:PutObject', 's3:AbortMultipartUpload'],
+                    resources=[f"arn:aws:s3:::{s3_output_bucket}", f"arn:aws:s3:::{s3_output_bucket}/*"]))
+
         # DEFINE Step Functions tasks ###############
         # Step Functions task to set document mime type and number of pages
         decider_task = tcdk.TextractPOCDecider(
@@ -264,6 +458,21 @@ class DocumentSplitterWorkflow(Stack):
                     'InternalServerError', 'ProvisionedThroughputExceededException']
         )
 
+        if classification_mode == "BOUNDARIES":
+            boundary_detection_task = tasks.LambdaInvoke(
+                self,
+                "TaskBoundaryDetection",
+                lambda_function=lambda_boundary_detection,
+                payload_response_only=True,
+                result_path="$.boundaries")
+
+            # expands the classified boundary pages to one item per page, as ClassifyPagesMapState returns them
+            boundary_expand_task = tasks.LambdaInvoke(
+                self,
+                "TaskBoundaryExpand",
+                lambda_function=lambda_boundary_detection,
+                output_path='$.Payload')
+
         enumerate_pages_task = tasks.LambdaInvoke(
             self,
             "TaskEnumeratePages",
@@ -277,6 +486,15 @@ class DocumentSplitterWorkflow(Stack):
             timeout=Duration.seconds(100),
             output_path='$.Payload')
 
+        # configures all pages of the enumerate_pages output, keeps its {"Payload": [...]} shape
+        configure_pages_task = tasks.LambdaInvoke(
+            self,
+            f"{workflow_name}-ConfigurePages",
+            lambda_function=lambda_configurator,
+            timeout=Duration.seconds(100),
+            payload=sfn.TaskInput.from_json_path_at('$.Payload'),
+            result_selector={"Payload": sfn.JsonPath.string_at('$.Payload')})
+
         # Step Functions task to call Textract
         textract_sync_queries_task = tasks.LambdaInvoke(
             self,
@@ -323,6 +541,26 @@ class DocumentSplitterWorkflow(Stack):
             lambda_function=lambda_generate_classification_mapping,
             output_path='$.Payload')
 
+        if fused_page_processor:
+            # returns the record of generate_classification_mapping_task
+            process_page_task = tasks.LambdaInvoke(
+                self,
+                "TaskProcessPage",
+                lambda_function=lambda_process_page,
+                payload=sfn.TaskInput.from_object({
+                    "ExecutionId":
+                    sfn.JsonPath.string_at('$$.Execution.Id'),
+                    "Payload":
+                    sfn.JsonPath.entire_payload,
+                }),
+                output_path='$.Payload')
+            process_page_task.add_retry(
+                max_attempts=1,
+                backoff_rate=1,
+                interval=Duration.seconds(1),
+                errors=['ThrottlingException', 'LimitExceededException',
+                        'InternalServerError', 'ProvisionedThroughputExceededException'])
+
         compile_paths_task = tasks.LambdaInvoke(
             self,
             "TaskCompilePaths",
@@ -335,6 +573,8 @@ class DocumentSplitterWorkflow(Stack):
             payload=sfn.TaskInput.from_object({
                 "ExecutionId":
                     sfn.JsonPath.string_at('$$.Execution.Id'),
+                "ExecutionStartTime":
+                    sfn.JsonPath.string_at('$$.Execution.StartTime'),
                 "Payload":
                     sfn.JsonPath.entire_payload,
             }),
@@ -354,7 +594,9 @@ class DocumentSplitterWorkflow(Stack):
         classify_pages_map = sfn.Map(
             self,
             "ClassifyPagesMapState",
-            items_path=sfn.JsonPath.string_at('$.pages'),
+            items_path=sfn.JsonPath.string_at(
+                '$.boundaries.boundaryPages' if classification_mode == "BOUNDARIES" else '$.pages'),
+            result_path="$.classifiedPages" if classification_mode == "BOUNDARIES" else None,
             parameters={
                 "manifest": {
                     "s3Path":
@@ -370,7 +612,9 @@ class DocumentSplitterWorkflow(Stack):
         process_pages_map = sfn.Map(
             self,
             "ProcessPagesMapState",
-            items_path=sfn.JsonPath.string_at('$.Payload'))
+            items_path=sfn.JsonPath.string_at('$.Payload'),
+            # with a claim check store compile_paths reads the page results from there
+            result_path=sfn.JsonPath.DISCARD if claim_check_store != "NONE" else None)
 
         # Map state to compile each page's CSV into one CSV document
         compile_pages_map = sfn.Map(
@@ -382,17 +626,34 @@ class DocumentSplitterWorkflow(Stack):
         comprehend_sync_task.next(doc_type_choice)
         classify_pages_map.iterator(comprehend_sync_task)
 
-        configurator_task.next(textract_sync_queries_task) \
-            .next(generate_csv_task) \
+        textract_sync_queries_task.next(generate_csv_task) \
             .next(generate_classification_mapping_task)
-        process_pages_map.iterator(configurator_task)
+        if fused_page_processor:
+            process_pages_map.iterator(process_page_task)
+        elif configure_pages_in_bulk:
+            process_pages_map.iterator(textract_sync_queries_task)
+        else:
+            process_pages_map.iterator(configurator_task.next(textract_sync_queries_task))
+
+        if classification_mode == "BOUNDARIES":
+            classify_chain = sfn.Chain \
+                .start(boundary_detection_task) \
+                .next(classify_pages_map) \
+                .next(boundary_expand_task)
+        else:
+            classify_chain = sfn.Chain.start(classify_pages_map)
+
+        if configure_pages_in_bulk:
+            process_chain = sfn.Chain.start(configure_pages_task).next(process_pages_map)
+        else:
+            process_chain = sfn.Chain.start(process_pages_map)
 
         workflow_chain = sfn.Chain \
             .start(decider_task) \
             .next(document_splitter_task) \
-            .next(classify_pages_map) \
+            .next(classify_chain) \
             .next(enumerate_pages_task) \
-            .next(process_pages_map) \
+            .next(process_chain) \
             .next(compile_paths_task) \
             .next(compile_pages_map)
 
@@ -402,27 +663,205 @@ class DocumentSplitterWorkflow(Stack):
                                          workflow_name,
                                          definition=workflow_chain)
 
+        if single_page_fast_path:
+            # Express state machine of the single page fast path, Express workflows have no task tokens, so the
+            # callback Lambdas are invoked request-response and return their result
+            fast_path_classification_task = tasks.LambdaInvoke(
+                self,
+                "FastPathClassification",
+                lambda_function=lambda_comprehend_sync,
+                payload=sfn.TaskInput.from_object({
+                    "ExecutionId": sfn.JsonPath.string_at('$$.Execution.Id'),
+                    "Payload": sfn.JsonPath.entire_payload,
+                }),
+                # documentTypeWithPageNum is set by enumerate_pages in the standard workflow
+                result_selector={
+                    "classification": sfn.JsonPath.string_at('$.Payload'),
+                    "pageNumber": {
+                        "documentTypeWithPageNum":
+                        sfn.JsonPath.string_at("States.Format('{}_page1', $.Payload.documentType)")
+                    }
+                },
+                result_path="$.fastPath")
+            fast_path_classification_task.add_retry(
+                max_attempts=100,
+                backoff_rate=1.1,
+                interval=Duration.seconds(1),
+                errors=['ThrottlingException', 'LimitExceededException',
+                        'InternalServerError', 'ProvisionedThroughputExceededException'])
+
+            fast_path_page = sfn.Pass(
+                self,
+                "FastPathPage",
+                parameters={
+                    "manifest": sfn.JsonPath.string_at('$.manifest'),
+                    "mime": sfn.JsonPath.string_at('$.mime'),
+                    "numberOfPages": sfn.JsonPath.string_at('$.numberOfPages'),
+                    "classification": sfn.JsonPath.string_at(
+                        "States.JsonMerge($.fastPath.classification, $.fastPath.pageNumber, false)")
+                })
+
+            fast_path_configurator_task = tasks.LambdaInvoke(
+                self,
+                "FastPathConfigurator",
+                lambda_function=lambda_configurator,
+                timeout=Duration.seconds(100),
+                output_path='$.Payload')
+
+            fast_path_textract_sync_task = tasks.LambdaInvoke(
+                self,
+                "FastPathTextractSync",
+                lambda_function=lambda_textract_sync,
+                payload=sfn.TaskInput.from_object({
+                    "ExecutionId": sfn.JsonPath.string_at('$$.Execution.Id'),
+                    "Payload": sfn.JsonPath.entire_payload,
+                }),
+                result_selector={"TextractOutputJsonPath": sfn.JsonPath.string_at('$.Payload.TextractOutputJsonPath')},
+                result_path="$.textract_result")
+            fast_path_textract_sync_task.add_retry(
+                max_attempts=1,
+                backoff_rate=1,
+                interval=Duration.seconds(1),
+                errors=['ThrottlingException', 'LimitExceededException',
+                        'InternalServerError', 'ProvisionedThroughputExceededException'])
+
+            fast_path_generate_csv_task = tasks.LambdaInvoke(
+                self,
+                "FastPathGenerateCSV",
+                lambda_function=lambda_generate_csv,
+                payload=sfn.TaskInput.from_object({
+                    "ExecutionId": sfn.JsonPath.string_at('$$.Execution.Id'),
+                    "Payload": sfn.JsonPath.entire_payload
+                }),
+                result_selector={
+                    "TextractOutputCSVPath": sfn.JsonPath.string_at('$.Payload.TextractOutputCSVPath'),
+                    "TextractOutputTablesPaths": sfn.JsonPath.string_at('$.Payload.TextractOutputTablesPaths')
+                },
+                result_path="$.csv_output_location")
+
+            fast_path_mapping_task = tasks.LambdaInvoke(
+                self,
+                "FastPathGenerateClassificationMapping",
+                lambda_function=lambda_generate_classification_mapping,
+                output_path='$.Payload')
+
+            fast_path_compile_paths_task = tasks.LambdaInvoke(
+                self,
+                "FastPathCompilePaths",
+                lambda_function=lambda_compile_paths,
+                payload=sfn.TaskInput.from_json_path_at("States.Array($)"),
+                output_path='$.Payload')
+
+            fast_path_join_csv_task = tasks.LambdaInvoke(
+                self,
+                "FastPathJoinCSV",
+                lambda_function=lambda_join_csv,
+                payload=sfn.TaskInput.from_object({
+                    "ExecutionId": sfn.JsonPath.string_at('$$.Execution.Id'),
+                    "ExecutionStartTime": sfn.JsonPath.string_at('$$.Execution.StartTime'),
+                    "Payload": sfn.JsonPath.string_at('$[0]'),
+                }),
+                output_path='$.Payload')
+
+            fast_path_chain = sfn.Chain \
+                .start(fast_path_classification_task) \
+                .next(sfn.Choice(self, 'FastPathRouteDocType')
+                      .when(sfn.Condition.string_equals('$.fastPath.classification.documentType', 'NONE'),
+                            sfn.Fail(self, "FastPathDocumentTypeNotImplemented"))
+                      .otherwise(fast_path_page
+                                 .next(fast_path_configurator_task)
+                                 .next(fast_path_textract_sync_task)
+                                 .next(fast_path_generate_csv_task)
+                                 .next(fast_path_mapping_task)
+                                 .next(fast_path_compile_paths_task)
+                                 .next(fast_path_join_csv_task)))
+
+            fast_path_state_machine = sfn.StateMachine(
+                self,
+                f"{workflow_name}SinglePage",
+                definition=fast_path_chain,
+                state_machine_type=sfn.StateMachineType.EXPRESS,
+                timeout=Duration.minutes(5),
+                # Express executions have no execution history, failures are logged
+                logs=sfn.LogOptions(destination=logs.LogGroup(self, "SinglePageWorkflowLogGroup",
+                                                              removal_policy=RemovalPolicy.DESTROY),
+                                    level=sfn.LogLevel.ERROR))
+
         # Step Functions definition end ###############
 
         # Lambda function to start workflow on new object at S3 bucket/prefix location
+        # (bucket, key, ETag) of the started uploads, S3 delivers notifications at least once
+        start_dedup_table = dynamodb.Table(
+            self,
+            "StartDedupTable",
+            partition_key=dynamodb.Attribute(
+                name="DEDUP_KEY", type=dynamodb.AttributeType.STRING
+            ),
+            time_to_live_attribute="EXPIRES_AT",
+            removal_policy=RemovalPolicy.DESTROY,
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST)
         lambda_step_start_step_function = lambda_.DockerImageFunction(
             self,
             "LambdaStartStepFunctionGeneric",
-            code=lambda_.DockerImageCode.from_image_asset(
-                os.path.join(script_location, '../lambda/startstepfunction')),
+            code=shared_image_code('startstepfunction'),
             memory_size=128,
+            timeout=Duration.seconds(60),
             architecture=lambda_.Architecture.X86_64,
-            environment={"STATE_MACHINE_ARN": state_machine.state_machine_arn})
+            environment={
+                "STATE_MACHINE_ARN": state_machine.state_machine_arn,
+                # NONE | MEMORY | DYNAMODB, events for a (bucket, key, ETag) started within DEDUP_WINDOW_S are skipped
+                "DEDUP_STORE": "DYNAMODB",
+                "DEDUP_TABLE": start_dedup_table.table_name,
+                "DEDUP_WINDOW_S": "3600",
+                "START_WORKERS": "16",
+                "FAST_PATH": "SINGLE_PAGE" if single_page_fast_path else "NONE",
+                # larger PDF and TIFF uploads go through the standard workflow without being read
+                "FAST_PATH_MAX_BYTES": str(5 * 1024 * 1024),
+                "S3_OUTPUT_BUCKET": s3_output_bucket,
+                "S3_OUTPUT_PREFIX": s3_output_prefix
+            })
 
         lambda_step_start_step_function.add_to_role_policy(
-            iam.PolicyStatement(actions=['states:StartExecution'],
-                                resources=[state_machine.state_machine_arn]))
-
-        document_bucket.add_event_notification(
-            s3.EventType.OBJECT_CREATED,
-            s3n.LambdaDestination(
-                lambda_step_start_step_function),  # type: ignore
-            s3.NotificationKeyFilter(prefix=s3_upload_prefix))
+            iam.PolicyStatement(actions=['states:StartExecution'], resources=[state_machine.state_machine_arn]))
+        if single_page_fast_path:
+            # reads the upload to count its pages and copies it to where the DocumentSplitter puts page 1
+            lambda_step_start_step_function.add_environment("FAST_PATH_STATE_MACHINE_ARN",
+                                                            fast_path_state_machine.state_machine_arn)
+            lambda_step_start_step_function.add_to_role_policy(
+                iam.PolicyStatement(actions=['states:StartExecution'],
+                                    resources=[fast_path_state_machine.state_machine_arn]))
+            lambda_step_start_step_function.add_to_role_policy(
+                iam.PolicyStatement(actions=['s3:GetObject'],
+                                    resources=[f"arn:aws:s3:::{s3_output_bucket}/{s3_upload_prefix}/*"]))
+            lambda_step_start_step_function.add_to_role_policy(
+                iam.PolicyStatement(actions=['s3:PutObject'],
+                                    resources=[f"arn:aws:s3:::{s3_output_bucket}/{s3_output_prefix}/*"]))
+        lambda_step_start_step_function.add_to_role_policy(
+            iam.PolicyStatement(actions=['dynamodb:PutItem', 'dynamodb:DeleteItem'],
+                                resources=[start_dedup_table.table_arn]))
+
+        if start_from_queue:
+            start_queue = sqs.Queue(self,
+                                    "StartQueue",
+                                    visibility_timeout=Duration.seconds(360),
+                                    dead_letter_queue=sqs.DeadLetterQueue(
+                                        max_receive_count=5,
+                                        queue=sqs.Queue(self, "StartDeadLetterQueue")))
+            document_bucket.add_event_notification(
+                s3.EventType.OBJECT_CREATED,
+                s3n.SqsDestination(start_queue),  # type: ignore
+                s3.NotificationKeyFilter(prefix=s3_upload_prefix))
+            lambda_step_start_step_function.add_event_source(
+                lambda_event_sources.SqsEventSource(start_queue,
+                                                    batch_size=100,
+                                                    max_batching_window=Duration.seconds(1),
+                                                    report_batch_item_failures=True))
+        else:
+            document_bucket.add_event_notification(
+                s3.EventType.OBJECT_CREATED,
+                s3n.LambdaDestination(
+                    lambda_step_start_step_function),  # type: ignore
+                s3.NotificationKeyFilter(prefix=s3_upload_prefix))
 
         # CloudFormation OUTPUT
         CfnOutput(
@@ -0,0 +1,173 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import io
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from s3_io import get_bytes, get_many, pooled_client
+
+logger = logging.getLogger(__name__)
+
+boundary_workers = int(os.environ.get('BOUNDARY_WORKERS', '16'))
+s3 = pooled_client(max_pool_connections=boundary_workers)
+
+PAGE_MARKER = re.compile(r"\bpage\s+(\d+)\s*(?:of|/)\s*(\d+)\b", re.IGNORECASE)
+TOKEN_PATTERN = re.compile(r"\w+")
+DIGITS = re.compile(r"\d")
+HEADER_FOOTER_LINES = 3
+
+# classification keys that belong to the page that was classified and must not be inherited
+PAGE_SPECIFIC_KEYS = ("TextractOutputJsonPath", "TextractFeatures")
+
+
+def page_number(page: str) -> int:
+    return int(os.path.splitext(os.path.basename(page))[0])
+
+
+def _header_footer_tokens(text: str) -> frozenset:
+    # running headers and footers (title, patient, form name) repeat on every page of one document
+    lines = [line for line in text.splitlines() if line.strip()]
+    lines = lines[:HEADER_FOOTER_LINES] + lines[-HEADER_FOOTER_LINES:]
+    return frozenset(TOKEN_PATTERN.findall(DIGITS.sub("0", " ".join(lines).lower())))
+
+
+def _average_hash(image) -> int:
+    # 8x8 grayscale thumbnail, one bit per pixel above the mean
+    pixels = list(image.convert('L').resize((8, 8)).getdata())
+    mean = sum(pixels) / len(pixels)
+    return sum(1 << i for i, pixel in enumerate(pixels) if pixel > mean)
+
+
+def page_signals(body: bytes) -> dict:
+    """Cheap per page signals read from the split page object, no OCR.
+
+    size: (width, height) rounded, rotation: /Rotate of PDF pages, header_footer: tokens of the
+    first and last text lines (PDF text layer), marker: (n, total) of a "Page n of total" text,
+    ahash: 64 bit average hash of images.
+    """
+    signals: dict = {'size': None, 'rotation': 0, 'header_footer': None, 'marker': None, 'ahash': None}
+    if body[:5] == b'%PDF-':
+        from PyPDF2 import PdfReader
+        page = PdfReader(io.BytesIO(body)).pages[0]
+        signals['size'] = (round(float(page.mediabox.width)), round(float(page.mediabox.height)))
+        signals['rotation'] = int(page.get('/Rotate', 0)) % 360
+        text = page.extract_text() or ""
+        if text.strip():
+            signals['header_footer'] = _header_footer_tokens(text)
+            marker = PAGE_MARKER.search(text)
+            if marker:
+                signals['marker'] = (int(marker.group(1)), int(marker.group(2)))
+    else:
+        from PIL import Image
+        with Image.open(io.BytesIO(body)) as image:
+            signals['size'] = image.size
+            signals['ahash'] = _average_hash(image)
+    return signals
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def is_boundary(previous: Optional[dict], current: dict, similarity: float) -> Tuple[bool, str]:
+    """True when current looks like the first page of a new document, with the deciding signal.
+
+    Without a usable signal the page counts as a boundary, so it is classified.
+    """
+    if previous is None:
+        return True, "first_page"
+    marker = current['marker']
+    if marker:
+        if marker[0] == 1:
+            return True, "page_marker"
+        if previous['marker'] and previous['marker'] == (marker[0] - 1, marker[1]):
+            return False, "page_marker"
+    if previous['size'] != current['size'] or previous['rotation'] != current['rotation']:
+        return True, "page_size"
+    if previous['header_footer'] is not None and current['header_footer'] is not None:
+        if _jaccard(previous['header_footer'], current['header_footer']) >= similarity:
+            return False, "header_footer"
+        return True, "header_footer"
+    if previous['ahash'] is not None and current['ahash'] is not None:
+        if 1 - bin(previous['ahash'] ^ current['ahash']).count("1") / 64 >= similarity:
+            return False, "image_hash"
+        return True, "image_hash"
+    return True, "no_signal"
+
+
+def detect_segments(signals: List[dict], similarity: float, max_segment_pages: int) -> Tuple[List[int], Dict[str, int]]:
+    """Returns the indexes of the boundary pages and the number of decisions per signal.
+
+    With max_segment_pages > 0 a page is also classified when the segment reached that length,
+    so a missed boundary only mislabels a bounded run of pages.
+    """
+    boundaries: List[int] = list()
+    reasons: Dict[str, int] = dict()
+    previous = None
+    for index, current in enumerate(signals):
+        boundary, reason = is_boundary(previous, current, similarity)
+        if not boundary and max_segment_pages and index - boundaries[-1] >= max_segment_pages:
+            boundary, reason = True, "max_segment_pages"
+        if boundary:
+            boundaries.append(index)
+        reasons[reason] = reasons.get(reason, 0) + 1
+        previous = current
+    return boundaries, reasons
+
+
+def detect(event: dict) -> dict:
+    similarity = float(os.environ.get('BOUNDARY_SIMILARITY', '0.5'))
+    max_segment_pages = int(os.environ.get('BOUNDARY_MAX_SEGMENT_PAGES', '25'))
+    s3_bucket = event['documentSplitterS3OutputBucket']
+    s3_prefix = event['documentSplitterS3OutputPath']
+    pages = sorted(event['pages'], key=page_number)
+
+    start_time = round(time.time() * 1000)
+
+    page_paths = [f"s3://{s3_bucket}/{s3_prefix}/{page}" for page in pages]
+    # the signals are computed on the fetching threads, only one page body per worker is held at a time
+    signals = list(get_many(s3, page_paths, boundary_workers,
+                            fetch=lambda s3_path: page_signals(get_bytes(s3, s3_path))))
+    boundaries, reasons = detect_segments(signals, similarity, max_segment_pages)
+    call_duration = round(time.time() * 1000) - start_time
+    logger.info(f"boundary_detection_duration_in_ms: {call_duration}")
+    logger.info(f"boundary_detection_pages: {len(pages)}, boundary_pages: {len(boundaries)}, signals: {reasons}")
+
+    segments = [pages[start:end] for start, end in zip(boundaries, boundaries[1:] + [len(pages)])]
+    return {"boundaryPages": [segment[0] for segment in segments], "segments": segments}
+
+
+def expand(event: dict) -> List[dict]:
+    """Per page items in the shape ClassifyPagesMapState returns when every page is classified;
+    interior pages inherit the classification of the boundary page of their segment."""
+    s3_bucket = event['documentSplitterS3OutputBucket']
+    s3_prefix = event['documentSplitterS3OutputPath']
+    items = list()
+    for segment, classified in zip(event['boundaries']['segments'], event['classifiedPages']):
+        inherited = {k: v for k, v in classified['classification'].items() if k not in PAGE_SPECIFIC_KEYS}
+        for page in segment:
+            items.append({
+                "manifest": {
+                    "s3Path": f"s3://{s3_bucket}/{s3_prefix}/{page}"
+                },
+                "mime": event['mime'],
+                "numberOfPages": 1,
+                "classification": classified['classification'] if page == segment[0] else dict(inherited)
+            })
+    return items
+
+
+def lambda_handler(event, _):
+    """Runs twice per document: before ClassifyPagesMapState to find the pages to classify and
+    after it, when the event has classifiedPages, to expand the result to every page."""
+    log_level = os.environ.get('LOG_LEVEL', 'INFO')
+    logger.setLevel(log_level)
+    logger.debug(f"event: {event}")
+
+    if 'classifiedPages' in event:
+        return expand(event)
+    return detect(event)
@@ -4,18 +4,38 @@
 import json
 import logging
 import os
-import boto3
+from typing import List
+
+from claim_check import CLAIM_CHECK_KEY, check_in, check_out, claim_check_store, page_record_name
+from s3_io import get_many, pooled_client
 
 logger = logging.getLogger(__name__)
 
-s3 = boto3.resource("s3")
+claim_check_workers = int(os.environ.get('CLAIM_CHECK_WORKERS', '16'))
+s3_client = pooled_client(max_pool_connections=claim_check_workers)
+
+
+def load_page_records(store, pages: List[dict]) -> List[dict]:
+    """ProcessPagesMapState results the map_classifications_lambda stored per page, in page order."""
+    uris = [store.uri(page_record_name(page['manifest']['s3Path'])) for page in pages]
+    return list(get_many(s3_client, uris, claim_check_workers,
+                         fetch=lambda uri: check_out({CLAIM_CHECK_KEY: uri}, s3_client)))
 
 
 def lambda_handler(event, _):
+    """event is the list of ProcessPagesMapState results, or with CLAIM_CHECK_STORE the state with
+    the enumerate_pages output in Payload, when the Map state discarded its results."""
     log_level = os.environ.get('LOG_LEVEL', 'DEBUG')
+    store = claim_check_store(os.environ.get('CLAIM_CHECK_STORE', 'NONE'), s3_client)
+    threshold_bytes = int(os.environ.get('CLAIM_CHECK_THRESHOLD_BYTES', '8192'))
 
     logger.setLevel(log_level)
-    logger.info(json.dumps(event))
+    if isinstance(event, dict):
+        if store is None:
+            raise ValueError("page results discarded by the Map state need a CLAIM_CHECK_STORE")
+        event = load_page_records(store, check_out(event['Payload'], s3_client))
+    logger.info(f"number of pages: {len(event)}")
+    logger.debug(json.dumps(event))
 
     documents = list()
     if len(event):
@@ -35,9 +55,14 @@ def lambda_handler(event, _):
                 if i == len(event):
                     break
             document['original_document_pages'] = f"{start_page}-{i}"
+            # large path lists are passed to CompilePagesMapState as claim checks
+            document['output_csv_paths'] = check_in(store, document['output_csv_paths'],
+                                                    threshold_bytes=threshold_bytes)
+            document['table_csv_paths'] = check_in(store, document['table_csv_paths'],
+                                                   threshold_bytes=threshold_bytes)
             documents.append(document)
     else:
         logger.warning("no items found in event")
 
     logger.debug(json.dumps(documents))
-    return documents
\ No newline at end of file
+    return documents
@@ -0,0 +1,197 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# NONE disables the cache, MEMORY is per warm container, DYNAMODB is shared by all invocations
+CLASSIFICATION_CACHES = ("NONE", "MEMORY", "DYNAMODB")
+
+FINGERPRINT_BITS = 64
+TOKEN_PATTERN = re.compile(r"\w+")
+DIGITS = re.compile(r"\d")
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('UTF-8'), digest_size=8).digest(), 'big')
+
+
+def simhash(text: str) -> int:
+    """64 bit SimHash over word unigrams and bigrams of the normalized text.
+
+    Digits are normalized, so pages of the same form template with different filled-in
+    numbers and dates end up a few bits apart.
+    """
+    tokens = TOKEN_PATTERN.findall(DIGITS.sub("0", text.lower()))
+    weights = [0] * FINGERPRINT_BITS
+    for gram in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+        h = _hash64(gram)
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def max_distance_for(similarity: float) -> int:
+    # similarity is the fraction of equal fingerprint bits
+    return int(FINGERPRINT_BITS * (1 - similarity))
+
+
+def bands(fingerprint: int, number_of_bands: int) -> List[str]:
+    """Splits the fingerprint into number_of_bands pieces; two fingerprints at most
+    number_of_bands - 1 bits apart share at least one piece (pigeonhole)."""
+    width = FINGERPRINT_BITS // number_of_bands
+    mask = (1 << width) - 1
+    return [f"{i}:{fingerprint >> (i * width) & mask:x}" for i in range(number_of_bands)]
+
+
+def exact_key(document: bytes) -> str:
+    return "sha256:" + hashlib.sha256(document).hexdigest()
+
+
+class InMemoryFingerprintStore():
+    """LRU of max_entries fingerprints with a ttl_s expiry, indexed by band for the candidate lookup."""
+
+    def __init__(self, max_entries: int = 10000, ttl_s: float = 86400):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.entries: OrderedDict = OrderedDict()  # key -> (document_type, expires_at, band keys)
+        self.index: Dict[str, set] = dict()
+        self._lock = threading.Lock()
+
+    def _remove(self, key: str):
+        _, _, band_keys = self.entries.pop(key)
+        for band_key in band_keys:
+            self.index[band_key].discard(key)
+            if not self.index[band_key]:
+                del self.index[band_key]
+
+    def candidates(self, band_keys: List[str]) -> List[Tuple[str, str]]:
+        now = time.time()
+        with self._lock:
+            keys = set().union(*[self.index.get(b, set()) for b in band_keys]) if band_keys else set()
+            result = list()
+            for key in keys:
+                document_type, expires_at, _ = self.entries[key]
+                if expires_at < now:
+                    self._remove(key)
+                    continue
+                self.entries.move_to_end(key)
+                result.append((key, document_type))
+            return result
+
+    def put(self, key: str, band_keys: List[str], document_type: str):
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (document_type, time.time() + self.ttl_s, band_keys)
+            for band_key in band_keys:
+                self.index.setdefault(band_key, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+
+class DynamoDBFingerprintStore():
+    """One item per band value and fingerprint (partition key BAND_KEY, sort key FINGERPRINT) with the
+    DOCUMENT_TYPE, so a band holds any number of fingerprints and a put is one write per band.
+
+    EXPIRES_AT can be used as TTL attribute. candidates() reads at most max_candidates_per_band items
+    of every band.
+    """
+
+    def __init__(self, dynamodb_resource, table_name: str, ttl_s: float = 86400, max_candidates_per_band: int = 100):
+        self.table = dynamodb_resource.Table(table_name)
+        self.ttl_s = ttl_s
+        self.max_candidates_per_band = max_candidates_per_band
+
+    def candidates(self, band_keys: List[str]) -> List[Tuple[str, str]]:
+        now = time.time()
+        result = dict()
+        for band_key in band_keys:
+            response = self.table.query(KeyConditionExpression="BAND_KEY = :band_key",
+                                        ExpressionAttributeValues={':band_key': band_key},
+                                        Limit=self.max_candidates_per_band)
+            for item in response.get('Items', []):
+                if int(item.get('EXPIRES_AT', 0)) >= now:
+                    result[item['FINGERPRINT']] = item['DOCUMENT_TYPE']
+        return list(result.items())
+
+    def put(self, key: str, band_keys: List[str], document_type: str):
+        expires_at = int(time.time() + self.ttl_s)
+        with self.table.batch_writer() as batch:
+            for band_key in band_keys:
+                batch.put_item(Item={
+                    'BAND_KEY': band_key,
+                    'FINGERPRINT': key,
+                    'DOCUMENT_TYPE': document_type,
+                    'EXPIRES_AT': expires_at
+                })
+
+
+class ClassificationCache():
+    """documentType lookup for near-duplicate texts (SimHash) or identical page bytes (sha256).
+
+    A text matches when its fingerprint is at most max_distance_for(similarity) bits from a
+    stored one. hits, misses and the endpoint latency saved are counted per container; the
+    saving of a hit is the average duration of the classifications that were cached.
+    """
+
+    def __init__(self, store, similarity: float = 0.95):
+        self.store = store
+        self.max_distance = max_distance_for(similarity)
+        self.number_of_bands = self.max_distance + 1
+        if FINGERPRINT_BITS // self.number_of_bands < 4:
+            raise ValueError(f"similarity {similarity} too low for {FINGERPRINT_BITS} bit fingerprints")
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+        self.classification_ms = 0.0
+        self.classifications = 0
+
+    def _keys(self, text: Optional[str], document: Optional[bytes]) -> Tuple[str, List[str], Optional[int]]:
+        if text is not None:
+            fingerprint = simhash(text)
+            return f"{fingerprint:016x}", bands(fingerprint, self.number_of_bands), fingerprint
+        key = exact_key(document or b'')
+        return key, [key], None
+
+    def get(self, text: Optional[str] = None, document: Optional[bytes] = None) -> Optional[str]:
+        start_time = time.perf_counter()
+        key, band_keys, fingerprint = self._keys(text, document)
+        document_type = None
+        best = self.max_distance + 1
+        for candidate, candidate_type in self.store.candidates(band_keys):
+            if fingerprint is None:
+                distance = 0 if candidate == key else best
+            elif candidate.startswith("sha256:"):
+                continue
+            else:
+                distance = bin(int(candidate, 16) ^ fingerprint).count("1")
+            if distance < best:
+                best, document_type = distance, candidate_type
+        lookup_ms = (time.perf_counter() - start_time) * 1000
+        if document_type:
+            self.hits += 1
+            if self.classifications:
+                self.saved_ms += max(0.0, self.classification_ms / self.classifications - lookup_ms)
+        else:
+            self.misses += 1
+        return document_type
+
+    def put(self, document_type: str, classification_ms: float, text: Optional[str] = None,
+            document: Optional[bytes] = None):
+        key, band_keys, _ = self._keys(text, document)
+        self.store.put(key, band_keys, document_type)
+        self.classifications += 1
+        self.classification_ms += classification_ms
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
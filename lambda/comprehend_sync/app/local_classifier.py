@@ -0,0 +1,112 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+hashed n-gram + softmax regression text classifier, the first stage of the classification cascade
+
+    python local_classifier.py train --dataset comprehend_claims_dataset.csv --output cascade_model.npz
+"""
+import argparse
+import csv
+import re
+import sys
+import zlib
+from typing import List, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+DEFAULT_NUMBER_OF_FEATURES = 2**15
+
+
+def features(text: str, number_of_features: int = DEFAULT_NUMBER_OF_FEATURES) -> Tuple[np.ndarray, np.ndarray]:
+    """Word unigrams and bigrams hashed into number_of_features buckets (crc32, stable across processes).
+
+    Returns the sparse (indices, values) with log scaled counts, L2 normalized.
+    """
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    if not grams:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    hashes = np.fromiter((zlib.crc32(g.encode('UTF-8')) for g in grams), dtype=np.int64, count=len(grams))
+    indices, counts = np.unique(hashes % number_of_features, return_counts=True)
+    values = (1 + np.log(counts)).astype(np.float32)
+    return indices, values / np.linalg.norm(values)
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    scores = scores - scores.max(axis=-1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class LocalClassifier():
+
+    def __init__(self, classes: List[str], weights: np.ndarray, bias: np.ndarray):
+        self.classes = classes
+        self.weights = weights  # classes x features
+        self.bias = bias
+        self.number_of_features = weights.shape[1]
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Returns the class and its probability."""
+        indices, values = features(text, self.number_of_features)
+        probabilities = _softmax(self.weights[:, indices] @ values + self.bias)
+        best = int(np.argmax(probabilities))
+        return self.classes[best], float(probabilities[best])
+
+    @classmethod
+    def train(cls,
+              texts: List[str],
+              labels: List[str],
+              number_of_features: int = DEFAULT_NUMBER_OF_FEATURES,
+              epochs: int = 300,
+              learning_rate: float = 0.5,
+              l2: float = 1e-4) -> 'LocalClassifier':
+        """Full batch gradient descent on the softmax cross entropy, deterministic."""
+        classes = sorted(set(labels))
+        y = np.zeros((len(texts), len(classes)), dtype=np.float32)
+        y[np.arange(len(texts)), [classes.index(label) for label in labels]] = 1
+        x = np.zeros((len(texts), number_of_features), dtype=np.float32)
+        for row, text in enumerate(texts):
+            indices, values = features(text, number_of_features)
+            x[row, indices] = values
+        weights = np.zeros((len(classes), number_of_features), dtype=np.float32)
+        bias = np.zeros(len(classes), dtype=np.float32)
+        for _ in range(epochs):
+            error = _softmax(x @ weights.T + bias) - y
+            weights -= learning_rate * (error.T @ x / len(texts) + l2 * weights)
+            bias -= learning_rate * error.mean(axis=0)
+        return cls(classes, weights, bias)
+
+    def save(self, path: str):
+        np.savez_compressed(path, classes=np.array(self.classes), weights=self.weights, bias=self.bias)
+
+    @classmethod
+    def load(cls, path: str) -> 'LocalClassifier':
+        with np.load(path) as model:
+            return cls([str(c) for c in model['classes']], model['weights'], model['bias'])
+
+
+def read_dataset(path: str) -> Tuple[List[str], List[str]]:
+    # Comprehend training data layout: label,text
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline='') as f:
+        rows = [row for row in csv.reader(f) if len(row) >= 2]
+    return [row[1] for row in rows], [row[0] for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['train'])
+    parser.add_argument('--dataset', required=True)
+    parser.add_argument('--output', default='cascade_model.npz')
+    parser.add_argument('--features', type=int, default=DEFAULT_NUMBER_OF_FEATURES)
+    args = parser.parse_args()
+    texts, labels = read_dataset(args.dataset)
+    LocalClassifier.train(texts, labels, number_of_features=args.features).save(args.output)
+    print(f"trained on {len(texts)} rows, saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
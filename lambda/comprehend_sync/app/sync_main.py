@@ -9,16 +9,33 @@ import time
 import boto3
 import textractmanifest as tm
 
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from typing import Tuple, List
+from rate_limiter import RATE_LIMITERS, DynamoDBWindowCounter, InMemoryTokenBucket, RateLimiter, parse_rate_limits
+from classification_cache import (CLASSIFICATION_CACHES, ClassificationCache, DynamoDBFingerprintStore,
+                                  InMemoryFingerprintStore)
+from datetime import datetime
+from result_encoding import OUTPUT_ENCODINGS, decode_body, encode_textract_response
+from s3_io import get_object, pooled_client, split_s3_path_to_bucket_and_key
+from task_callback import task_callback
+from typing import Dict, Tuple, List, Optional
 
 logger = logging.getLogger(__name__)
 version = "0.0.1"
-s3 = boto3.client("s3")
+s3 = pooled_client()
 step_functions_client = boto3.client(service_name="stepfunctions")
-sqs = boto3.client("sqs")
 
 comprehend = boto3.client("comprehend")
+textract = boto3.client("textract", config=Config(retries={'max_attempts': 0, 'mode': 'standard'}))
+dynamodb = None
+
+# the in-memory token buckets are shared by all threads of the container
+memory_token_bucket = InMemoryTokenBucket()
+local_classifier = None
+# one cache per CLASSIFICATION_CACHE setting, kept for the lifetime of the warm container
+classification_caches: Dict[str, ClassificationCache] = dict()
+# one rate limiter per RATE_LIMITER setting, kept for the lifetime of the warm container
+rate_limiters: Dict[str, RateLimiter] = dict()
 
 
 def validate_document_reader_config(document_reader_config: dict):
@@ -41,32 +58,109 @@ def validate_document_reader_config(document_reader_config: dict):
             raise Exception("FeatureTypes must be a list of strings with values TABLES and/or FORMS")
 
 
-def split_s3_path_to_bucket_and_key(s3_path: str) -> Tuple[str, str]:
-    if len(s3_path) > 7 and s3_path.lower().startswith("s3://"):
-        s3_bucket, s3_key = s3_path.replace("s3://", "").split("/", 1)
-        return s3_bucket, s3_key
-    else:
-        raise ValueError(
-            f"s3_path: {s3_path} is no s3_path in the form of s3://bucket/key."
-        )
+def get_file_bytes_from_s3(s3_path: str) -> bytes:
+    # gzip/zstd encoded objects (textract_sync OUTPUT_ENCODING) are decoded transparently
+    o = get_object(s3, s3_path)
+    return decode_body(o.get("Body").read(), o.get("ContentEncoding"))
 
 
-def get_file_bytes_from_s3(s3_path: str) -> bytes:
+def get_dynamodb():
+    # the DynamoDB resource is only needed by the DYNAMODB rate limiter and caches, creating it on first
+    # use keeps its service model out of the init phase of every other configuration
+    global dynamodb
+    if dynamodb is None:
+        dynamodb = boto3.resource("dynamodb")
+    return dynamodb
+
+
+def get_rate_limiter(rate_limiter: str) -> RateLimiter:
+    if rate_limiter not in rate_limiters:
+        if rate_limiter == "DYNAMODB":
+            backend = DynamoDBWindowCounter(get_dynamodb().Table(os.environ["RATE_LIMITER_TABLE"]))
+        else:
+            backend = memory_token_bucket
+        rate_limiters[rate_limiter] = RateLimiter(backend,
+                                                  parse_rate_limits(os.environ.get("RATE_LIMITS")),
+                                                  max_wait_s=float(os.environ.get("RATE_LIMITER_MAX_WAIT_S", 30)))
+    return rate_limiters[rate_limiter]
+
+
+def read_page_once(s3_path: str, textract_features: List[str], s3_output_bucket: str, s3_output_prefix: str,
+                   output_encoding: str, rate_limiter: str) -> Tuple[str, str]:
+    """OCR_ONCE: runs Textract on the page, stores the response for textract_sync to reuse
+    and returns the LINE text for classification together with the stored s3 path."""
     s3_bucket, s3_key = split_s3_path_to_bucket_and_key(s3_path)
-    o = s3.get_object(Bucket=s3_bucket, Key=s3_key)
-    return o.get("Body").read()
+    params = {"Document": {"S3Object": {"Bucket": s3_bucket, "Name": s3_key}}}
+    api = "AnalyzeDocument" if textract_features else "DetectDocumentText"
+    if rate_limiter != "NONE" and not get_rate_limiter(rate_limiter).acquire(api):
+        raise ThrottlingException(f"RateLimiter: no {api} capacity")
+    if textract_features:
+        textract_response = textract.analyze_document(FeatureTypes=textract_features, **params)
+    else:
+        textract_response = textract.detect_document_text(**params)
+
+    s3_filename, _ = os.path.splitext(os.path.basename(s3_path))
+    output_bucket_key = s3_output_prefix + "/" + s3_filename + datetime.utcnow(
+    ).isoformat() + "/" + s3_filename + ".json"
+    body, encoding_args = encode_textract_response(textract_response, output_encoding)
+    s3.put_object(Body=body, Bucket=s3_output_bucket, Key=output_bucket_key, **encoding_args)
+
+    # same text as the generatecsv LINES output of the page
+    text = " ".join([b["Text"] for b in textract_response["Blocks"] if b["BlockType"] == "LINE"])
+    return text, f"s3://{s3_output_bucket}/{output_bucket_key}"
 
 
-def send_failure_to_step_function(error, cause, token, event):
+def get_local_classifier():
+    # loaded once per warm container, numpy is only imported when the cascade is enabled
+    global local_classifier
+    if local_classifier is None:
+        from local_classifier import LocalClassifier
+        start_time = round(time.time() * 1000)
+        local_classifier = LocalClassifier.load(
+            os.environ.get("LOCAL_CLASSIFIER_MODEL", os.path.join(os.path.dirname(__file__), "cascade_model.npz")))
+        logger.info(f"comprehend_sync_local_classifier_load_duration_in_ms: {round(time.time() * 1000) - start_time}")
+    return local_classifier
+
+
+def get_classification_cache(classification_cache_mode: str) -> ClassificationCache:
+    if classification_cache_mode not in classification_caches:
+        ttl_s = float(os.environ.get("CLASSIFICATION_CACHE_TTL_S", 86400))
+        if classification_cache_mode == "DYNAMODB":
+            store = DynamoDBFingerprintStore(
+                get_dynamodb(),
+                os.environ["CLASSIFICATION_CACHE_TABLE"],
+                ttl_s=ttl_s,
+                max_candidates_per_band=int(os.environ.get("CLASSIFICATION_CACHE_MAX_CANDIDATES", 100)))
+        else:
+            store = InMemoryFingerprintStore(max_entries=int(os.environ.get("CLASSIFICATION_CACHE_MAX_ENTRIES", 10000)),
+                                             ttl_s=ttl_s)
+        classification_caches[classification_cache_mode] = ClassificationCache(
+            store, similarity=float(os.environ.get("CLASSIFICATION_CACHE_SIMILARITY", 0.95)))
+    return classification_caches[classification_cache_mode]
+
+
+def classify_locally(text: str, threshold: float) -> Optional[str]:
+    """Returns the document type when the local classifier is confident enough, None to ask the endpoint."""
+    start_time = time.perf_counter()
+    document_type, confidence = get_local_classifier().predict(text)
+    duration_ms = (time.perf_counter() - start_time) * 1000
+    confident = confidence >= threshold
+    logger.info(f"comprehend_sync_local_classifier_{'hit' if confident else 'deferred'}: 1 \n \
+                comprehend_sync_local_classifier_confidence: {confidence:.3f} \n \
+                comprehend_sync_local_classifier_duration_in_ms: {duration_ms:.2f}")
+    return document_type if confident else None
+
+
+def send_failure_to_step_function(callback, error, cause, token, event):
     try:
-        step_functions_client.send_task_failure(taskToken=token,
-                                                error=error,
-                                                cause=cause)
-    except step_functions_client.exceptions.InvalidToken:
+        callback.send_task_failure(taskToken=token,
+                                   error=error,
+                                   cause=cause)
+    except callback.exceptions.InvalidToken:
         logger.error(f"InvalidToken for event: {event} ")
-    except step_functions_client.exceptions.TaskDoesNotExist:
+    except callback.exceptions.TaskDoesNotExist:
         logger.error(f"TaskDoesNotExist for event: {event} ")
-    except step_functions_client.exceptions.TaskTimedOut:
+    except callback.exceptions.TaskTimedOut:
         logger.error(f"TaskTimedOut for event: {event} ")
 
 
@@ -78,7 +172,7 @@ class ThrottlingException(Exception):
     pass
 
 
-def lambda_handler(event, _):
+def process_event(event, _, callback, token):
     log_level = os.environ.get("LOG_LEVEL", "DEBUG")
     logger.setLevel(log_level)
     logger.info(f"version: {version}\n \
@@ -92,21 +186,53 @@ def lambda_handler(event, _):
 
     text_or_bytes = os.environ.get("TEXT_OR_BYTES", "TEXT")
     document_reader_config = os.environ.get("DOCUMENT_READER_CONFIG", None)
-    if text_or_bytes in {"TEXT", "BYTES"}:
+    if text_or_bytes in {"TEXT", "BYTES", "OCR_ONCE"}:
         if text_or_bytes == "BYTES":
             if not document_reader_config:
                 raise Exception("no DOCUMENT_READER_CONFIG set")
             document_reader_config = json.loads(document_reader_config)
             validate_document_reader_config(document_reader_config)
     else:
-        raise Exception("TEXT_OR_BYTES must be either TEXT or BYTES")
+        raise Exception("TEXT_OR_BYTES must be either TEXT, BYTES or OCR_ONCE")
+
+    # OCR_ONCE: features of the Textract read, should cover the features configured for most document types
+    ocr_once_features: List[str] = json.loads(os.environ.get("OCR_ONCE_FEATURES", '["FORMS", "TABLES", "SIGNATURES"]'))
+    s3_output_bucket = os.environ.get("S3_OUTPUT_BUCKET")
+    s3_output_prefix = os.environ.get("S3_OUTPUT_PREFIX")
+    output_encoding = os.environ.get("OUTPUT_ENCODING", "JSON_INDENT")
+    if text_or_bytes == "OCR_ONCE":
+        if not s3_output_bucket or not s3_output_prefix:
+            raise Exception("OCR_ONCE requires S3_OUTPUT_BUCKET and S3_OUTPUT_PREFIX")
+        if "QUERIES" in ocr_once_features:
+            raise Exception("OCR_ONCE_FEATURES cannot include QUERIES, they depend on the document type")
+        if output_encoding not in OUTPUT_ENCODINGS:
+            raise Exception(f"OUTPUT_ENCODING must be one of {OUTPUT_ENCODINGS}")
+
+    rate_limiter = os.environ.get("RATE_LIMITER", "NONE")
+    # CASCADE classifies TEXT and OCR_ONCE text locally first and calls the endpoint below the threshold
+    local_classifier_mode = os.environ.get("LOCAL_CLASSIFIER", "NONE")
+    local_classifier_threshold = float(os.environ.get("LOCAL_CLASSIFIER_THRESHOLD", 0.9))
+    # near-duplicate texts (SimHash) or identical page bytes (BYTES) reuse an earlier documentType
+    classification_cache_mode = os.environ.get("CLASSIFICATION_CACHE", "NONE")
+    if classification_cache_mode not in CLASSIFICATION_CACHES:
+        raise Exception(f"CLASSIFICATION_CACHE must be one of {CLASSIFICATION_CACHES}")
+    if local_classifier_mode not in {"NONE", "CASCADE"}:
+        raise Exception("LOCAL_CLASSIFIER must be either NONE or CASCADE")
+    if local_classifier_mode == "CASCADE" and text_or_bytes == "BYTES":
+        logger.warning("LOCAL_CLASSIFIER CASCADE needs text, it is not used with TEXT_OR_BYTES BYTES")
+    if rate_limiter not in RATE_LIMITERS:
+        raise Exception(f"RATE_LIMITER must be one of {RATE_LIMITERS}")
 
     logger.debug(f"LOG_LEVEL: {log_level} \n \
                 COMPREHEND_CLASSIFIER_ARN: {comprehend_classifier_arn} \n \
                 TEXT_OR_BYTES: {text_or_bytes} \n \
-                DOCUMENT_READER_CONFIG: {document_reader_config}")
+                DOCUMENT_READER_CONFIG: {document_reader_config} \n \
+                OCR_ONCE_FEATURES: {ocr_once_features} \n \
+                RATE_LIMITER: {rate_limiter} \n \
+                LOCAL_CLASSIFIER: {local_classifier_mode} \n \
+                CLASSIFICATION_CACHE: {classification_cache_mode} \n \
+                LOCAL_CLASSIFIER_THRESHOLD: {local_classifier_threshold}")
 
-    token = event["Token"]
     execution_id = event["ExecutionId"]
 
     if "Payload" not in event:
@@ -133,7 +259,15 @@ def lambda_handler(event, _):
 
     try:
         params = {"EndpointArn": comprehend_classifier_arn}
-        if text_or_bytes == "TEXT":
+        ocr_output: dict = dict()
+        if text_or_bytes == "OCR_ONCE":
+            start_time = round(time.time() * 1000)
+            text, textract_output_json_path = read_page_once(s3_path, ocr_once_features, s3_output_bucket,
+                                                             s3_output_prefix, output_encoding, rate_limiter)
+            logger.info(f"comprehend_sync_ocr_once_textract_duration_in_ms: {round(time.time() * 1000) - start_time}")
+            params["Text"] = text[0:4900]
+            ocr_output = {"TextractOutputJsonPath": textract_output_json_path, "TextractFeatures": ocr_once_features}
+        elif text_or_bytes == "TEXT":
             text = get_file_bytes_from_s3(s3_path=s3_input_text).decode('utf-8')[0:4900]
             params["Text"] = text
         elif text_or_bytes == "BYTES":
@@ -141,39 +275,64 @@ def lambda_handler(event, _):
             params["Bytes"] = file_bytes
             params["DocumentReaderConfig"] = document_reader_config
 
-        start_time = round(time.time() * 1000)
-        response = comprehend.classify_document(**params)
-        logger.debug(f"comprehend result: {response}")
-
-        classification_result = "NONE"
-        for c in response["Classes"]:
-            if c["Score"] > 0.50:
-                classification_result = c["Name"]
-                break
-
-        call_duration = round(time.time() * 1000) - start_time
-        logger.info(
-            f"comprehend_sync_generic_call_duration_in_ms: {call_duration}"
-        )
+        classification_start_time = time.perf_counter()
+        classification_result = None
+        if classification_cache_mode != "NONE":
+            classification_cache = get_classification_cache(classification_cache_mode)
+            classification_result = classification_cache.get(text=params.get("Text"), document=params.get("Bytes"))
+            logger.info(f"comprehend_sync_classification_cache_{'hit' if classification_result else 'miss'}: 1 \n \
+                comprehend_sync_classification_cache_hit_ratio: {classification_cache.hit_ratio:.3f} \n \
+                comprehend_sync_classification_cache_latency_saved_in_ms: {classification_cache.saved_ms:.0f}")
+            cache_hit = bool(classification_result)
+
+        if not classification_result and local_classifier_mode == "CASCADE" and "Text" in params:
+            classification_result = classify_locally(params["Text"], local_classifier_threshold)
+
+        if not classification_result:
+            start_time = round(time.time() * 1000)
+            if rate_limiter != "NONE" and not get_rate_limiter(rate_limiter).acquire("ClassifyDocument"):
+                # wait for the shared quota instead of bouncing off the endpoint, Step Functions retries this
+                raise ThrottlingException("RateLimiter: no ClassifyDocument capacity")
+            response = comprehend.classify_document(**params)
+            logger.debug(f"comprehend result: {response}")
+
+            classification_result = "NONE"
+            for c in response["Classes"]:
+                if c["Score"] > 0.50:
+                    classification_result = c["Name"]
+                    break
+
+            call_duration = round(time.time() * 1000) - start_time
+            logger.info(
+                f"comprehend_sync_generic_call_duration_in_ms: {call_duration}"
+            )
+        if classification_cache_mode != "NONE" and not cache_hit and classification_result != "NONE":
+            classification_cache.put(classification_result, (time.perf_counter() - classification_start_time) * 1000,
+                                     text=params.get("Text"),
+                                     document=params.get("Bytes"))
         try:
-            step_functions_client.send_task_success(
+            callback.send_task_success(
                 taskToken=token,
-                output=json.dumps({"documentType": classification_result}))
-        except step_functions_client.exceptions.InvalidToken:
+                output=json.dumps(dict({"documentType": classification_result}, **ocr_output)))
+        except callback.exceptions.InvalidToken:
             logger.error(f"InvalidToken for event: {event} ")
-        except step_functions_client.exceptions.TaskDoesNotExist:
+        except callback.exceptions.TaskDoesNotExist:
             logger.error(f"TaskDoesNotExist for event: {event} ")
-        except step_functions_client.exceptions.TaskTimedOut:
+        except callback.exceptions.TaskTimedOut:
             logger.error(f"TaskTimedOut for event: {event} ")
-        except step_functions_client.exceptions.InvalidOutput:
+        except callback.exceptions.InvalidOutput:
             logger.error(f"InvalidOutput for event: {event} ")
 
     except comprehend.exceptions.TextSizeLimitExceededException as e:
         logger.error(e, exc_info=True)
-        send_failure_to_step_function('TextSizeLimitExceededException', str(e), token, event)
+        send_failure_to_step_function(callback, 'TextSizeLimitExceededException', str(e), token, event)
     except comprehend.exceptions.InvalidRequestException as e:
         logger.error(e, exc_info=True)
-        send_failure_to_step_function('InvalidRequestException', str(e), token, event)
+        send_failure_to_step_function(callback, 'InvalidRequestException', str(e), token, event)
+    except (textract.exceptions.ThrottlingException, textract.exceptions.ProvisionedThroughputExceededException,
+            textract.exceptions.LimitExceededException):
+        logger.warning(f"Textract throttling for: {s3_path} in OCR_ONCE mode.")
+        raise ThrottlingException('ThrottlingException')
     except comprehend.exceptions.TooManyRequestsException:
         # try again, will throw Exception for Lambda and retry
         logger.warning(f"TooManyRequestsException for: {s3_path} to Comprehend.")
@@ -184,6 +343,16 @@ def lambda_handler(event, _):
             raise ThrottlingException('ThrottlingException')
         else:
             logger.error(e, exc_info=True)
-            send_failure_to_step_function('ClientError', str(e), token, event)
+            send_failure_to_step_function(callback, 'ClientError', str(e), token, event)
+    except ThrottlingException:
+        logger.warning(f"rate limiter ThrottlingException for: {s3_path}")
+        raise
     except Exception as e:
-        send_failure_to_step_function('unhandled', str(e), token, event)
+        send_failure_to_step_function(callback, 'unhandled', str(e), token, event)
+
+
+def lambda_handler(event, context):
+    # without Token (request-response, e.g. from an Express workflow) the result is returned instead of sent
+    callback, token = task_callback(step_functions_client, event)
+    process_event(event, context, callback, token)
+    return None if token else callback.result()
@@ -0,0 +1,207 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import codecs
+import csv
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import textractmanifest as tm
+
+logger = logging.getLogger(__name__)
+
+TEXTRACT_FEATURES = ("FORMS", "TABLES", "QUERIES", "SIGNATURES", "LAYOUT")
+BATCH_WRITE_MAX_ITEMS = 25
+# marks the configurations written by load_catalog, the only ones a later catalog load deletes
+CATALOG_ATTRIBUTE = "FROM_CATALOG"
+
+
+class InvalidConfiguration(Exception):
+    pass
+
+
+def iter_text_lines(stream, chunk_size: int = 1 << 20) -> Iterator[str]:
+    """Lines of a UTF-8 file object or S3 StreamingBody, read chunk_size bytes at a time."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ""
+    while True:
+        chunk = stream.read(chunk_size)
+        pending += decoder.decode(chunk, final=not chunk)
+        lines = pending.splitlines(keepends=True)
+        pending = lines.pop() if lines and chunk and not lines[-1].endswith(("\n", "\r")) else ""
+        yield from lines
+        if not chunk:
+            if pending:
+                yield pending
+            return
+
+
+def iter_configuration_rows(stream, file_format: str) -> Iterator[Tuple[int, str, str]]:
+    """(line number, document type, manifest JSON) of a CSV (DOCUMENT_TYPE,CONFIG, the layout of
+    default_config.csv) or JSONL ({"DOCUMENT_TYPE": ..., "CONFIG": {...}}) catalog."""
+    lines = iter_text_lines(stream)
+    if file_format == "CSV":
+        csv.field_size_limit(sys.maxsize)
+        reader = csv.reader(lines)
+        for row in reader:
+            if row:
+                yield reader.line_num, row[0], row[1] if len(row) > 1 else ""
+    elif file_format == "JSONL":
+        for line_number, line in enumerate(lines, start=1):
+            if line.strip():
+                row = json.loads(line)
+                config = row.get('CONFIG', "")
+                yield line_number, row.get('DOCUMENT_TYPE', ""), config if isinstance(config, str) else json.dumps(config)
+    else:
+        raise ValueError(f"unsupported configuration file format: {file_format}, use CSV or JSONL")
+
+
+def validate_configuration(document_type: str, config: str) -> str:
+    """Returns the normalized manifest JSON stored as CONFIG, raises InvalidConfiguration."""
+    if not document_type:
+        raise InvalidConfiguration("empty DOCUMENT_TYPE")
+    try:
+        manifest: tm.IDPManifest = tm.IDPManifestSchema().loads(config)  #type: ignore
+    except Exception as e:
+        raise InvalidConfiguration(f"{document_type}: invalid manifest: {e}")
+    features = manifest.textract_features or []
+    unknown = set(features) - set(TEXTRACT_FEATURES)
+    if unknown:
+        raise InvalidConfiguration(f"{document_type}: unknown textract_features {sorted(unknown)}")
+    if "QUERIES" in features and not manifest.queries_config:
+        raise InvalidConfiguration(f"{document_type}: QUERIES without queries_config")
+    return tm.IDPManifestSchema().dumps(manifest)
+
+
+def read_catalog(stream, file_format: str) -> Dict[str, str]:
+    """Validated, normalized CONFIG per document type. All rows are checked before anything is
+    written, so a catalog with errors leaves the table unchanged."""
+    catalog: Dict[str, str] = dict()
+    errors: List[str] = list()
+    for line_number, document_type, config in iter_configuration_rows(stream, file_format):
+        try:
+            if document_type in catalog:
+                raise InvalidConfiguration(f"{document_type}: duplicate DOCUMENT_TYPE")
+            catalog[document_type] = validate_configuration(document_type, config)
+        except InvalidConfiguration as e:
+            errors.append(f"line {line_number}: {e}")
+    if errors:
+        raise InvalidConfiguration(f"{len(errors)} invalid configurations: " + "; ".join(errors[:20]))
+    return catalog
+
+
+def read_table(table) -> Tuple[Dict[str, str], Set[str]]:
+    """CONFIG per DOCUMENT_TYPE of the configuration table and the document types a catalog load
+    wrote, paginated Scan."""
+    current: Dict[str, str] = dict()
+    from_catalog: Set[str] = set()
+    params: dict = {'ProjectionExpression': f"DOCUMENT_TYPE, CONFIG, {CATALOG_ATTRIBUTE}"}
+    while True:
+        response = table.scan(**params)
+        for item in response.get('Items', []):
+            current[item['DOCUMENT_TYPE']] = item.get('CONFIG', "")
+            if item.get(CATALOG_ATTRIBUTE):
+                from_catalog.add(item['DOCUMENT_TYPE'])
+        if 'LastEvaluatedKey' not in response:
+            return current, from_catalog
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def same_configuration(current: Optional[str], config: str) -> bool:
+    """Whether the table's CONFIG is the catalog's manifest, JSON key order aside (the table may hold
+    configurations written by another serializer)."""
+    if current is None:
+        return False
+    try:
+        return json.loads(current) == json.loads(config)
+    except ValueError:
+        return False
+
+
+def compute_diff(catalog: Dict[str, str], current: Dict[str, str],
+                 from_catalog: Set[str]) -> Tuple[Dict[str, str], List[str]]:
+    """(configurations to put, document types to delete), only document types an earlier catalog load
+    wrote are deleted, the ones put into the table otherwise are kept"""
+    puts = {t: config for t, config in catalog.items() if not same_configuration(current.get(t), config)}
+    deletes = sorted((set(current) - set(catalog)) & from_catalog)
+    return puts, deletes
+
+
+class BatchWriter():
+    """BatchWriteItem requests of 25 items sent by max_workers threads, UnprocessedItems are
+    retried with exponential backoff."""
+
+    def __init__(self, dynamodb_resource, table_name: str, max_workers: int = 8, max_attempts: int = 8,
+                 backoff_s: float = 0.05):
+        self.dynamodb = dynamodb_resource
+        self.table_name = table_name
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.backoff_s = backoff_s
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _write(self, write_requests: List[dict]):
+        request_items = {self.table_name: write_requests}
+        for attempt in range(self.max_attempts):
+            response = self.dynamodb.batch_write_item(RequestItems=request_items)
+            with self._lock:
+                self.requests += 1
+            request_items = response.get('UnprocessedItems') or {}
+            if not request_items:
+                return
+            time.sleep(self.backoff_s * 2**attempt)
+        raise Exception(f"unprocessed items after {self.max_attempts} attempts: {request_items}")
+
+    def write(self, puts: Dict[str, str], deletes: List[str]):
+        updated_at = datetime.now(timezone.utc).isoformat()
+        write_requests = [{
+            'PutRequest': {
+                'Item': {
+                    "DOCUMENT_TYPE": document_type,
+                    "CONFIG": config,
+                    "UPDATED_AT": updated_at,
+                    CATALOG_ATTRIBUTE: True
+                }
+            }
+        } for document_type, config in puts.items()]
+        write_requests += [{'DeleteRequest': {'Key': {"DOCUMENT_TYPE": t}}} for t in deletes]
+        batches = [
+            write_requests[i:i + BATCH_WRITE_MAX_ITEMS] for i in range(0, len(write_requests), BATCH_WRITE_MAX_ITEMS)
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            list(pool.map(self._write, batches))
+
+
+def load_catalog(dynamodb_resource,
+                 table_name: str,
+                 stream,
+                 file_format: str,
+                 diff: bool,
+                 max_workers: int = 8) -> dict:
+    """Writes the catalog to the configuration table; with diff only new and changed document
+    types are written and the ones an earlier catalog load wrote but no longer in the catalog
+    deleted. Returns the counts."""
+    start_time = round(time.time() * 1000)
+    catalog = read_catalog(stream, file_format)
+    current, from_catalog = read_table(dynamodb_resource.Table(table_name)) if diff else (dict(), set())
+    puts, deletes = compute_diff(catalog, current, from_catalog)
+    writer = BatchWriter(dynamodb_resource, table_name, max_workers=max_workers)
+    writer.write(puts, deletes)
+    call_duration = round(time.time() * 1000) - start_time
+    logger.info(f"config_prefill_duration_in_ms: {call_duration}")
+    result = {
+        "documentTypes": len(catalog),
+        "put": len(puts),
+        "deleted": len(deletes),
+        "unchanged": len(catalog) - len(puts),
+        "batchWriteRequests": writer.requests
+    }
+    logger.info(f"config_prefill_result: {result}")
+    return result
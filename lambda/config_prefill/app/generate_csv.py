@@ -1,12 +1,11 @@
 import textractmanifest as tm
 import csv
+import json
 from typing import List
 
 
 class CSVRow():
 
-    rows: List[List[str]] = list()
-
     def __init__(self,
                  classification: str,
                  queries: List[List[str]],
@@ -20,8 +19,6 @@ class CSVRow():
         self.queries_config: List[tm.Query] = self.get_queries_config()
         self.manifest: tm.IDPManifest = self.create_manifest()
         self.csv_row = self.get_csv_row()
-        CSVRow.rows.append(self.csv_row)
-
 
     def get_queries_config(self):
         queries_config: List[tm.Query] = list()
@@ -34,7 +31,13 @@ class CSVRow():
                                   textract_features=self.textract_features)
 
     def get_csv_row(self):
-        return [self.classification, tm.IDPManifestSchema().dumps(self.manifest)]
+        manifest = tm.IDPManifestSchema().dump(self.manifest)
+        # key order of the committed default_config.csv, the schema's dump order depends on the marshmallow version
+        config = {
+            "textractFeatures": manifest["textractFeatures"],
+            "queriesConfig": [{"alias": q["alias"], "text": q["text"]} for q in manifest["queriesConfig"]]
+        }
+        return [self.classification, json.dumps(config)]
 
 
 def get_csv_rows():
@@ -68,7 +71,7 @@ def get_csv_rows():
                              dischargesummary_queries,
                              dischargesummary_features)
 
-    return CSVRow.rows
+    return [claimform_row.csv_row, doctorsnote_row.csv_row, dischargesummary_row.csv_row]
 
 
 def write_csv():
@@ -78,3 +81,7 @@ def write_csv():
     with open('default_config.csv', 'w') as f:
         csv_writer = csv.writer(f, quoting=csv.QUOTE_MINIMAL)
         csv_writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    write_csv()
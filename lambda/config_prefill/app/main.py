@@ -3,37 +3,50 @@ import logging
 import os
 import boto3
 import json
-from generate_csv import get_csv_rows
+from config_loader import load_catalog
+from s3_io import open_stream, pooled_client
 
 logger = logging.getLogger(__name__)
 __version__ = "0.0.1"
 
 dynamodb = boto3.resource('dynamodb')
+s3 = pooled_client()
 
 
-def put_item(table, document_type: str, manifest: str):
-    ddb_response = table.put_item(Item={
-        "DOCUMENT_TYPE": document_type,
-        "CONFIG": manifest
-    })
-    logger.debug(ddb_response)
+def get_configuration_source(event) -> str:
+    # ConfigurationSource of the custom resource, an s3://bucket/key or a file in the image
+    return event.get('ResourceProperties', {}).get('ConfigurationSource') \
+        or os.environ.get('CONFIGURATION_SOURCE', 'default_config.csv')
+
+
+def load_configuration(source: str, table_name: str, diff: bool) -> dict:
+    file_format = "JSONL" if source.lower().endswith(('.jsonl', '.json')) else "CSV"
+    max_workers = int(os.environ.get('WRITE_WORKERS', '8'))
+    logger.info(f"configuration source: {source}, format: {file_format}, diff: {diff}")
+    if source.lower().startswith("s3://"):
+        body, _ = open_stream(s3, source)
+        try:
+            return load_catalog(dynamodb, table_name, body, file_format, diff=diff, max_workers=max_workers)
+        finally:
+            body.close()
+    with open(source, 'rb') as f:
+        return load_catalog(dynamodb, table_name, f, file_format, diff=diff, max_workers=max_workers)
 
 
 def on_create(event, context, table_name):
     physical_id = 'initConfiguration'
-    table = dynamodb.Table(table_name)
-    rows = get_csv_rows()
-    for row in rows:
-        logger.debug(row)
-        put_item(table, row[0], row[1])
+    result = load_configuration(get_configuration_source(event), table_name, diff=False)
     cfnresponse.send(event, context, cfnresponse.SUCCESS,
-                     {'Response': "created"}, physical_id)
+                     dict(result, Response="created"), physical_id)
 
 
-def on_update(event, context):
+def on_update(event, context, table_name):
+    # writes only the document types that are new or changed and removes the ones an earlier catalog load
+    # wrote that are no longer listed
     physical_id = 'initConfiguration'
+    result = load_configuration(get_configuration_source(event), table_name, diff=True)
     cfnresponse.send(event, context, cfnresponse.SUCCESS,
-                     {'Response': "created"}, physical_id)
+                     dict(result, Response="updated"), physical_id)
 
 
 def on_delete(event, context):
@@ -59,7 +72,9 @@ def lambda_handler(event, context):
                          context=context,
                          table_name=configuration_table)
     if request_type == 'update':
-        return on_update(event=event, context=context)
+        return on_update(event=event,
+                         context=context,
+                         table_name=configuration_table)
     if request_type == 'delete':
         return on_delete(event=event, context=context)
     raise Exception(f'Invalid request type: {request_type}')
@@ -0,0 +1,117 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+import textractmanifest as tm
+
+logger = logging.getLogger(__name__)
+
+# written by config_prefill on every put, items without it are versioned by the hash of CONFIG
+VERSION_ATTRIBUTE = "UPDATED_AT"
+BATCH_GET_MAX_KEYS = 100
+
+
+def config_version(item: dict) -> str:
+    if VERSION_ATTRIBUTE in item:
+        return str(item[VERSION_ATTRIBUTE])
+    return hashlib.sha256(item.get('CONFIG', '').encode('UTF-8')).hexdigest()
+
+
+class CachedConfiguration():
+
+    def __init__(self, version: Optional[str], manifest: Optional[tm.IDPManifest], expires_at: float):
+        # manifest is None for document types without CONFIG, those are cached as well
+        self.version = version
+        self.manifest = manifest
+        self.expires_at = expires_at
+
+
+class ConfigurationCache():
+    """Parsed configuration manifests per DOCUMENT_TYPE, LRU of max_entries for ttl_s seconds.
+
+    After the TTL the item is read again and only parsed when its version changed. The cached
+    IDPManifest is shared between invocations, IDPManifest.merge only reads the passed manifest.
+    """
+
+    def __init__(self, ttl_s: float = 300, max_entries: int = 128):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.parses = 0
+        self._lock = threading.Lock()
+
+    def resolve(self, document_types: Iterable[str],
+                read_items: Callable[[List[str]], Dict[str, dict]]) -> Dict[str, Optional[tm.IDPManifest]]:
+        """Configuration manifest per document type; read_items is called once with all types that
+        are not cached or expired and returns the DynamoDB items found by DOCUMENT_TYPE."""
+        now = time.time()
+        result: Dict[str, Optional[tm.IDPManifest]] = dict()
+        expired: Dict[str, Optional[CachedConfiguration]] = dict()
+        with self._lock:
+            for document_type in set(document_types):
+                entry = self.entries.get(document_type)
+                if entry and entry.expires_at > now:
+                    self.entries.move_to_end(document_type)
+                    result[document_type] = entry.manifest
+                    self.hits += 1
+                else:
+                    expired[document_type] = entry
+                    self.misses += 1
+        if not expired:
+            return result
+
+        items = read_items(sorted(expired))
+        with self._lock:
+            for document_type, previous in expired.items():
+                item = items.get(document_type)
+                if item and 'CONFIG' in item:
+                    version = config_version(item)
+                    if previous and previous.version == version:
+                        manifest = previous.manifest
+                    else:
+                        manifest = tm.IDPManifestSchema().loads(item['CONFIG'])  #type: ignore
+                        self.parses += 1
+                else:
+                    version, manifest = None, None
+                self.entries[document_type] = CachedConfiguration(version, manifest, now + self.ttl_s)
+                self.entries.move_to_end(document_type)
+                result[document_type] = manifest
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return result
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def batch_read_items(dynamodb_resource, table_name: str, document_types: List[str],
+                     max_attempts: int = 5, backoff_s: float = 0.1) -> Dict[str, dict]:
+    """BatchGetItem of the DOCUMENT_TYPE keys in chunks of 100, retrying UnprocessedKeys."""
+    items: Dict[str, dict] = dict()
+    for start in range(0, len(document_types), BATCH_GET_MAX_KEYS):
+        request_items = {
+            table_name: {
+                'Keys': [{'DOCUMENT_TYPE': t} for t in document_types[start:start + BATCH_GET_MAX_KEYS]]
+            }
+        }
+        for attempt in range(max_attempts):
+            response = dynamodb_resource.batch_get_item(RequestItems=request_items)
+            for item in response.get('Responses', {}).get(table_name, []):
+                items[item['DOCUMENT_TYPE']] = item
+            request_items = response.get('UnprocessedKeys') or {}
+            if not request_items:
+                break
+            time.sleep(backoff_s * 2**attempt)
+        if request_items:
+            raise Exception(f"unprocessed keys after {max_attempts} attempts: {request_items}")
+    return items
@@ -4,48 +4,75 @@
 import json
 import logging
 import os
+import time
+from typing import Dict, List, Optional
+
 import boto3
-import json
 import textractmanifest as tm
+from configuration_cache import ConfigurationCache, batch_read_items
 
 logger = logging.getLogger(__name__)
 version = "0.0.13"
 
 dynamodb = boto3.resource('dynamodb')
 
+configuration_cache = ConfigurationCache(ttl_s=float(os.environ.get('CONFIGURATION_CACHE_TTL_S', '300')),
+                                         max_entries=int(os.environ.get('CONFIGURATION_CACHE_MAX_ENTRIES', '128')))
 
-def lambda_handler(event, _):
-    log_level = os.environ.get('LOG_LEVEL', 'INFO')
-    table_name = os.environ.get('CONFIGURATION_TABLE')
 
-    logger.setLevel(log_level)
-    logger.info(f"version: {version}")
-    logger.info(f"amazon-textract-idp-cdk-manifest version: {tm.__version__}")
-    logger.info(f"table_name: {table_name}")
-    logger.info(json.dumps(event))
+def read_configuration_items(table_name: str, document_types: List[str]) -> Dict[str, dict]:
+    if len(document_types) == 1:
+        ddb_response = dynamodb.Table(table_name).get_item(Key={"DOCUMENT_TYPE": document_types[0]})  #pyright: ignore
+        logger.debug(f"ddb_response: {ddb_response}")
+        return {document_types[0]: ddb_response['Item']} if 'Item' in ddb_response else {}
+    return batch_read_items(dynamodb, table_name, document_types)
+
+
+def get_document_type(event: dict) -> str:
     if 'classification' in event and 'documentType' in event['classification']:
-        document_type = event['classification']['documentType']
-        logger.debug(f"document_type: {document_type}")
-    else:
-        raise ValueError(
-            f'no [classification][documentType] given in event: {event}')
+        return event['classification']['documentType']
+    raise ValueError(f'no [classification][documentType] given in event: {event}')
 
-    table = dynamodb.Table(table_name)  #pyright: ignore
 
-    ddb_response = table.get_item(Key={"DOCUMENT_TYPE": document_type})
-    logger.debug(f"ddb_response: {ddb_response}")
+def configure(event: dict, configuration_manifest: Optional[tm.IDPManifest]) -> dict:
     input_manifest: tm.IDPManifest = tm.IDPManifestSchema().load(
         event['manifest'])  #type: ignore
 
-    if 'Item' in ddb_response and 'CONFIG' in ddb_response['Item']:
-        configuration_manifest: tm.IDPManifest = tm.IDPManifestSchema().loads(
-            ddb_response['Item']['CONFIG'])  #type: ignore
+    if configuration_manifest:
         input_manifest.merge(configuration_manifest)
-        if configuration_manifest and configuration_manifest.queries_config:
+        if configuration_manifest.queries_config:
             event['numberOfQueries'] = len(
                 configuration_manifest.queries_config)
         logger.debug(f"merged manifest: {input_manifest}")
         event['manifest'] = tm.IDPManifestSchema().dump(input_manifest)
     else:
         logger.warning("no config found")
-    return event
\ No newline at end of file
+    return event
+
+
+def lambda_handler(event, _):
+    """Configures one page, or with a list of pages (the enumerate_pages output) all pages of the
+    packet with one read of their distinct document types."""
+    log_level = os.environ.get('LOG_LEVEL', 'INFO')
+    table_name = os.environ.get('CONFIGURATION_TABLE')
+
+    logger.setLevel(log_level)
+    logger.info(f"version: {version}")
+    logger.info(f"amazon-textract-idp-cdk-manifest version: {tm.__version__}")
+    logger.info(f"table_name: {table_name}")
+    logger.debug(json.dumps(event))
+
+    start_time = round(time.time() * 1000)
+    pages = event if isinstance(event, list) else [event]
+    document_types = [get_document_type(page) for page in pages]
+    logger.debug(f"document_types: {set(document_types)}")
+
+    configurations = configuration_cache.resolve(
+        document_types, lambda missing: read_configuration_items(table_name, missing))  #type: ignore
+    pages = [configure(page, configurations[document_type]) for page, document_type in zip(pages, document_types)]
+
+    call_duration = round(time.time() * 1000) - start_time
+    logger.info(f"configurator_duration_in_ms: {call_duration}")
+    logger.info(f"configurator_cache_hits: {configuration_cache.hits}, misses: {configuration_cache.misses}, "
+                f"parses: {configuration_cache.parses}, hit_ratio: {configuration_cache.hit_ratio:.2f}")
+    return pages if isinstance(event, list) else pages[0]
@@ -4,12 +4,9 @@
 import json
 import logging
 import os
-import boto3
 
 logger = logging.getLogger(__name__)
 
-s3 = boto3.resource("s3")
-
 
 def lambda_handler(event, _):
     log_level = os.environ.get('LOG_LEVEL', 'DEBUG')
@@ -34,8 +31,8 @@ def lambda_handler(event, _):
     else:
         logger.warning("no items found in event")
 
-    logger.info(json.dumps(event, indent=4))
-    logger.info(len(event))
+    # the list grows with the number of pages, the items are only logged at DEBUG
+    logger.debug(json.dumps(event))
     return event
 
 
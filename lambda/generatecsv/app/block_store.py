@@ -0,0 +1,119 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+SIGNATURE = "SIGNATURE"
+
+
+class BlockStore():
+    """Index over the Textract blocks, built in a single pass.
+
+    Holds the id -> block map, the ids per BlockType in document order and the relationship
+    adjacency (parent id -> relationship type -> child ids, child id -> parent id for CHILD).
+    Blocks are never mutated, SIGNATURE blocks are filtered out when reading the children of a
+    block instead of removing them from the lists.
+    """
+
+    def __init__(self, blocks: Iterable[dict] = ()):
+        self.blocks: Dict[str, dict] = dict()
+        self.ids_by_type: Dict[str, List[str]] = defaultdict(list)
+        self.relationships: Dict[str, Dict[str, List[str]]] = dict()
+        self.parent: Dict[str, str] = dict()
+        for block in blocks:
+            self.add(block)
+
+    @classmethod
+    def from_textract_json(cls, file_json: dict) -> "BlockStore":
+        return cls(file_json['Blocks'])
+
+    def add(self, block: dict):
+        block_id = block['Id']
+        self.blocks[block_id] = block
+        self.ids_by_type[block['BlockType']].append(block_id)
+        if block.get('Relationships'):
+            relationships: Dict[str, List[str]] = dict()
+            for relationship in block['Relationships']:
+                relationships.setdefault(relationship['Type'], list()).extend(relationship['Ids'])
+            self.relationships[block_id] = relationships
+            for child_id in relationships.get('CHILD', ()):
+                self.parent[child_id] = block_id
+
+    def of_type(self, block_type: str) -> List[dict]:
+        return [self.blocks[_id] for _id in self.ids_by_type.get(block_type, ())]
+
+    def related(self,
+                block: dict,
+                relationship_type: str = 'CHILD',
+                block_types: Optional[Set[str]] = None,
+                exclude_types: Set[str] = frozenset({SIGNATURE})) -> List[dict]:
+        result: List[dict] = list()
+        for _id in self.relationships.get(block['Id'], {}).get(relationship_type, ()):
+            related_block = self.blocks.get(_id)
+            if not related_block or related_block['BlockType'] in exclude_types:
+                continue
+            if block_types is None or related_block['BlockType'] in block_types:
+                result.append(related_block)
+        return result
+
+    @property
+    def pages(self) -> List[dict]:
+        pages = self.of_type('PAGE')
+        if not pages:
+            raise ValueError("PAGE block not found in Blocks")
+        return pages
+
+    @property
+    def has_signature(self) -> bool:
+        return bool(self.ids_by_type.get(SIGNATURE))
+
+    @property
+    def table_blocks(self) -> List[dict]:
+        return self.of_type('TABLE')
+
+    @staticmethod
+    def get_text_for_blocks(blocks: List[dict]) -> str:
+        # same result as trp2 TDocument.get_text_for_tblocks
+        text = ' '.join([b['Text'] for b in blocks if b.get('Text')])
+        text += ' '.join([b['SelectionStatus'] for b in blocks if b.get('SelectionStatus')])
+        return text
+
+    def forms(self) -> List[List[List]]:
+        """Per page [key confidence, key text, value confidence, value text], like convert_form_to_list_trp2."""
+        page_list: List[List[List]] = list()
+        for page in self.pages:
+            key_value_list: List[List] = list()
+            for key in self.related(page, block_types={'KEY_VALUE_SET'}):
+                if 'KEY' not in key.get('EntityTypes', ()):
+                    continue
+                value_confidence = ""
+                value_blocks: List[dict] = list()
+                for value in self.related(key, relationship_type='VALUE'):
+                    value_confidence = value.get('Confidence', "")
+                    value_blocks.extend(self.related(value))
+                key_value_list.append([
+                    key.get('Confidence', ""),
+                    self.get_text_for_blocks(self.related(key)), value_confidence,
+                    self.get_text_for_blocks(value_blocks)
+                ])
+            page_list.append(key_value_list)
+        return page_list
+
+    def queries(self) -> List[List[List]]:
+        """Per page [query text, alias (the query text without alias), answer confidence, answer text], like
+        convert_queries_to_list_trp2."""
+        page_list: List[List[List]] = list()
+        for page in self.pages:
+            query_list: List[List] = list()
+            for query in self.related(page, block_types={'QUERY'}):
+                text = query['Query'].get('Text', "")
+                key = query['Query'].get('Alias') or text
+                answers = self.related(query, relationship_type='ANSWER')
+                if answers:
+                    for answer in answers:
+                        query_list.append([text, key, answer.get('Confidence', ""), answer.get('Text', "")])
+                else:
+                    query_list.append([text, key, "", ""])
+            page_list.append(query_list)
+        return page_list
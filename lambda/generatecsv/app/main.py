@@ -6,54 +6,29 @@ import os
 import io
 import csv
 import boto3
-from typing import Tuple, List, Dict
+from typing import List, Dict, Optional
 import json
-from textractprettyprinter.t_pretty_print import convert_queries_to_list_trp2, \
-    convert_form_to_list_trp2, \
-    convert_table_to_list
-import trp.trp2 as t2
-import trp
 import datetime
+from block_store import BlockStore
+from result_encoding import decode_body, decoding_stream
+from s3_io import get_object, open_stream, pooled_client
+from task_callback import task_callback
+from s3_stream_writer import DEFAULT_PART_SIZE, S3StreamWriter
+from table_uploader import DEFAULT_MAX_WORKERS, TableUploader
+from streaming import DEFAULT_CHUNK_SIZE, StreamingBlockResolver, iter_textract_blocks, resolve_blocks
 
 logger = logging.getLogger(__name__)
 version = "0.0.3"
-s3_client = boto3.client('s3')
+# one pooled connection per table upload worker
+table_upload_workers = int(os.environ.get('TABLE_UPLOAD_WORKERS', DEFAULT_MAX_WORKERS))
+s3_client = pooled_client(max_pool_connections=max(table_upload_workers, 10))
 step_functions_client = boto3.client(service_name='stepfunctions')
 
 
-def get_signature_table_info(file_json: dict)\
-        -> Tuple[bool, Dict[str, dict], List[dict]]:
-    has_signature: bool = False
-    signature_block_ids: List[str] = list()
-    signature_blocks: List[dict] = list()
-    table_blocks: List[dict] = list()
-    block_map: Dict[str, dict] = dict()
-    page_block: dict = dict()
-
-    for block in file_json['Blocks']:
-        if block['BlockType'] == "SIGNATURE":
-            has_signature = True
-            signature_block_ids.append(block['Id'])
-            signature_blocks.append(block)
-        elif block['BlockType'] == "TABLE":
-            table_blocks.append(block)
-        elif block['BlockType'] == "PAGE":
-            page_block = block
-        block_map[block['Id']] = block
-
-    for block in signature_blocks:
-        file_json['Blocks'].remove(block)
-
-    if page_block:
-        for _id in signature_block_ids:
-            page_block['Relationships'][0]['Ids'].remove(_id)
-    else:
-        raise ValueError(f"PAGE block not found in {file_json['Blocks']}")
-
-    return has_signature, block_map, table_blocks
-
-
 def get_table_list(block_map: Dict[str, dict], table_blocks: List[dict]) -> List[List]:
+    # trp and textractprettyprinter are only imported by pages with tables in PARSE_MODE DOCUMENT
+    import trp
+    from textractprettyprinter.t_pretty_print import convert_table_to_list
     result_list: List[List] = list()
     for table_block in table_blocks:
         table: trp.Table = trp.Table(table_block, block_map)
@@ -62,23 +37,154 @@ def get_table_list(block_map: Dict[str, dict], table_blocks: List[dict]) -> List
     return result_list
 
 
-def split_s3_path_to_bucket_and_key(s3_path: str) -> Tuple[str, str]:
-    if len(s3_path) > 7 and s3_path.lower().startswith("s3://"):
-        s3_bucket, s3_key = s3_path.replace("s3://", "").split("/", 1)
-        return s3_bucket, s3_key
-    else:
+def get_file_from_s3(s3_path: str) -> bytes:
+    # gzip/zstd encoded Textract results (textract_sync OUTPUT_ENCODING) are decoded transparently
+    o = get_object(s3_client, s3_path)
+    return decode_body(o.get('Body').read(), o.get('ContentEncoding'))
+
+
+def get_file_stream_from_s3(s3_path: str):
+    return decoding_stream(*open_stream(s3_client, s3_path))
+
+
+def put_table_csv(table: List[List], s3_bucket: str, s3_key: str):
+    csv_output = io.StringIO()
+    csv_writer = csv.writer(csv_output,
+                            delimiter=",",
+                            quotechar='"',
+                            quoting=csv.QUOTE_MINIMAL)
+    csv_writer.writerows(table)
+    s3_client.put_object(Body=bytes(csv_output.getvalue().encode('UTF-8')),
+                         Bucket=s3_bucket,
+                         Key=s3_key)
+
+
+def generate_output(s3_path: str,
+                    classification: str,
+                    document_type_with_page_num: Optional[str],
+                    execution_id: str,
+                    file_json: Optional[dict] = None) -> dict:
+    """Writes the CSV (or text) of the Textract result at s3_path and returns TextractOutputCSVPath and
+    TextractOutputTablesPaths. file_json is the Textract response already in memory (process_page Lambda),
+    which is then not read back from s3_path."""
+    csv_s3_output_prefix = os.environ.get('CSV_S3_OUTPUT_PREFIX')
+    output_type = os.environ.get('OUTPUT_TYPE', 'CSV')
+    csv_s3_output_bucket = os.environ.get('CSV_S3_OUTPUT_BUCKET')
+    joined_s3_output_prefix = os.environ.get('JOINED_S3_OUTPUT_PREFIX')
+    # a response in memory is parsed as DOCUMENT, there is nothing left to stream
+    parse_mode = os.environ.get('PARSE_MODE', 'DOCUMENT') if file_json is None else 'DOCUMENT'
+    stream_chunk_size = int(os.environ.get('STREAM_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+    multipart_part_size = int(os.environ.get('MULTIPART_PART_SIZE', DEFAULT_PART_SIZE))
+
+    logger.info(f"CSV_S3_OUTPUT_PREFIX: {csv_s3_output_prefix} \n\
+                    CSV_S3_OUTPUT_BUCKET: {csv_s3_output_bucket} \n\
+                    OUTPUT_TYPE: {output_type} \n\
+                    JOINED_S3_OUTPUT_PREFIX: {joined_s3_output_prefix} \n\
+                    PARSE_MODE: {parse_mode}")
+    if not csv_s3_output_prefix or not csv_s3_output_bucket:
+        raise ValueError(
+            f"require CSV_S3_OUTPUT_PREFIX and CSV_S3_OUTPUT_BUCKET")
+    if output_type == "CSV" and not joined_s3_output_prefix:
         raise ValueError(
-            f"s3_path: {s3_path} is no s3_path in the form of s3://bucket/key."
-        )
+            f"require JOINED_S3_OUTPUT_PREFIX since OUTPUT_TYPE is CSV")
+    if parse_mode not in {"DOCUMENT", "STREAMING"}:
+        raise ValueError(f"PARSE_MODE must be either DOCUMENT or STREAMING")
+
+    base_filename = os.path.basename(s3_path)
+    base_filename_no_suffix, _ = os.path.splitext(base_filename)
+    if parse_mode == "STREAMING":
+        blocks = iter_textract_blocks(get_file_stream_from_s3(s3_path=s3_path), chunk_size=stream_chunk_size)
+    elif file_json is None:
+        file_json = json.loads(get_file_from_s3(s3_path=s3_path).decode('utf-8'))
 
+    timestamp = datetime.datetime.now().astimezone().replace(
+        microsecond=0).isoformat()
 
-def get_file_from_s3(s3_path: str) -> bytes:
-    s3_bucket, s3_key = split_s3_path_to_bucket_and_key(s3_path)
-    o = s3_client.get_object(Bucket=s3_bucket, Key=s3_key)
-    return o.get('Body').read()
+    if output_type == "CSV":
+        table_s3_output_prefix = \
+            f"{joined_s3_output_prefix}/csvfiles_{execution_id}/tables/{document_type_with_page_num}"
+        csv_s3_output_key = f"{csv_s3_output_prefix}/{timestamp}/{base_filename_no_suffix}.csv"
+        with TableUploader(put_table_csv, csv_s3_output_bucket, max_workers=table_upload_workers) as table_uploader, \
+                S3StreamWriter(s3_client, csv_s3_output_bucket, csv_s3_output_key,
+                               part_size=multipart_part_size) as csv_output:
+            csv_writer = csv.writer(csv_output,
+                                    delimiter=",",
+                                    quotechar='"',
+                                    quoting=csv.QUOTE_MINIMAL)
+            if parse_mode == "STREAMING":
+                # rows are written as soon as the blocks they need arrived, tables are uploaded when complete
+                resolver = StreamingBlockResolver(emit_fields=True)
+                queries_rows: List[List] = list()
+                for kind, value in resolve_blocks(blocks, resolver):
+                    if kind == "FORMS":
+                        csv_writer.writerow(
+                            [timestamp, classification, base_filename, "FORMS", value[1], value[3]])
+                    elif kind == "QUERIES":
+                        queries_rows.append(
+                            [timestamp, classification, base_filename, "QUERIES", value[1], value[3]])
+                    elif kind == "TABLES":
+                        table_number, table = value
+                        table_uploader.submit(table_number, table,
+                                              f"{table_s3_output_prefix}/table_{table_number}.csv")
+                csv_writer.writerows(queries_rows)
+                has_signature = resolver.has_signature
+            else:
+                # one index serves FORMS, QUERIES, TABLES and SIGNATURES, no second parse through trp2
+                block_store = BlockStore.from_textract_json(file_json)
+                has_signature = block_store.has_signature
+
+                key_value_list = block_store.forms()
+                queries_value_list = block_store.queries()
+                table_value_list = get_table_list(block_store.blocks, block_store.table_blocks)
+
+                for i, table in enumerate(table_value_list):
+                    table_uploader.submit(i + 1, table, f"{table_s3_output_prefix}/table_{i + 1}.csv")
+
+                for page in key_value_list:
+                    csv_writer.writerows(
+                        [[timestamp, classification, base_filename, "FORMS"] +
+                         [x[1], x[3]] for x in page])  # only include key name and key value
+                for page in queries_value_list:
+                    csv_writer.writerows(
+                        [[timestamp, classification, base_filename, "QUERIES"] +
+                         [x[1], x[3]] for x in page])  # only include alias and query result
+            if has_signature:
+                signature_value = "Contains Signature"
+            else:
+                signature_value = "Does NOT Contain Signature"
+            csv_writer.writerow(
+                [timestamp, classification, base_filename,
+                 "SIGNATURES", "HAS_SIGNATURE", signature_value])
+            # a failed table upload aborts the page CSV instead of surfacing after it was written
+            table_output_s3_paths = table_uploader.result()
+    elif output_type == 'LINES':
+        csv_s3_output_key = f"{csv_s3_output_prefix}/{timestamp}/{base_filename_no_suffix}.txt"
+        with S3StreamWriter(s3_client, csv_s3_output_bucket, csv_s3_output_key,
+                            part_size=multipart_part_size) as text_output:
+            if parse_mode == "STREAMING":
+                # same text as trp2: lines of a page in CHILD order joined with ' ', pages without separator
+                resolver = StreamingBlockResolver(emit_lines=True, emit_fields=False)
+                for kind, value in resolve_blocks(blocks, resolver):
+                    if kind == "LINES":
+                        text_output.write(value[1])
+            else:
+                import trp.trp2 as t2
+                trp2_doc: t2.TDocument = t2.TDocumentSchema().load(file_json)  # type: ignore
+                for page in trp2_doc.pages:
+                    text_output.write(t2.TDocument.get_text_for_tblocks(
+                        trp2_doc.lines(page=page)))
+        logger.debug(f"got {text_output.bytes_written}")
+    else:
+        raise ValueError(f"output_type '${output_type}' not supported: ")
 
+    output_json = {"TextractOutputCSVPath": f"s3://{csv_s3_output_bucket}/{csv_s3_output_key}"}
+    if output_type == "CSV":
+        output_json["TextractOutputTablesPaths"] = [document_type_with_page_num, table_output_s3_paths]
+    logger.debug(output_json)
+    return output_json
 
-def lambda_handler(event, _):
+
+def process_event(event, _, callback, task_token):
     # takes and even which includes a location to a Textract JSON schema file
     # and generates CSV based on Query results + FORMS + TABLES results
     # in the form of
@@ -88,23 +194,7 @@ def lambda_handler(event, _):
     logger.setLevel(log_level)
     logger.debug(f"version: {version}")
     logger.debug(json.dumps(event))
-    csv_s3_output_prefix = os.environ.get('CSV_S3_OUTPUT_PREFIX')
-    output_type = os.environ.get('OUTPUT_TYPE', 'CSV')
-    csv_s3_output_bucket = os.environ.get('CSV_S3_OUTPUT_BUCKET')
-    joined_s3_output_prefix = os.environ.get('JOINED_S3_OUTPUT_PREFIX')
-
-    logger.info(f"CSV_S3_OUTPUT_PREFIX: {csv_s3_output_prefix} \n\
-                    CSV_S3_OUTPUT_BUCKET: {csv_s3_output_bucket} \n\
-                    OUTPUT_TYPE: {output_type} \n\
-                    JOINED_S3_OUTPUT_PREFIX: {joined_s3_output_prefix}")
-    task_token = event['Token']
     try:
-        if not csv_s3_output_prefix or not csv_s3_output_bucket:
-            raise ValueError(
-                f"require CSV_S3_OUTPUT_PREFIX and CSV_S3_OUTPUT_BUCKET")
-        if output_type == "CSV" and not joined_s3_output_prefix:
-            raise ValueError(
-                f"require JOINED_S3_OUTPUT_PREFIX since OUTPUT_TYPE is CSV")
         if 'Payload' not in event and 'textract_result' in event[
                 'Payload'] and 'TextractOutputJsonPath' not in event[
                     'Payload']['textract_result']:
@@ -120,83 +210,20 @@ def lambda_handler(event, _):
             documentTypeWithPageNum = event['Payload']['classification']['documentTypeWithPageNum']
         execution_id = event["ExecutionId"].split(":")[-1]
 
-        base_filename = os.path.basename(s3_path)
-        base_filename_no_suffix, _ = os.path.splitext(base_filename)
-        file_json = json.loads(get_file_from_s3(s3_path=s3_path).decode('utf-8'))
-        trp2_doc: t2.TDocument = t2.TDocumentSchema().load(file_json)  # type: ignore
-
-        timestamp = datetime.datetime.now().astimezone().replace(
-            microsecond=0).isoformat()
-
-        if output_type == "CSV":
-            has_signature, block_map, table_blocks = get_signature_table_info(file_json)
-
-            key_value_list = convert_form_to_list_trp2(trp2_doc=trp2_doc)  # type: ignore
-            queries_value_list = convert_queries_to_list_trp2(trp2_doc=trp2_doc)  # type: ignore
-            table_value_list = get_table_list(block_map, table_blocks)  # type: ignore
-
-            table_output_s3_paths = list()
-            for i, table in enumerate(table_value_list):
-                csv_output = io.StringIO()
-                csv_writer = csv.writer(csv_output,
-                                        delimiter=",",
-                                        quotechar='"',
-                                        quoting=csv.QUOTE_MINIMAL)
-                csv_writer.writerows(table)
-                result_value = csv_output.getvalue()
-                table_s3_output_key = \
-                    f"{joined_s3_output_prefix}/csvfiles_{execution_id}/tables/{documentTypeWithPageNum}/table_{i + 1}.csv"
-                table_output_s3_paths.append(f"s3://{csv_s3_output_bucket}/{table_s3_output_key}")
-                s3_client.put_object(Body=bytes(result_value.encode('UTF-8')),
-                                     Bucket=csv_s3_output_bucket,
-                                     Key=table_s3_output_key)
-
-            csv_output = io.StringIO()
-            csv_writer = csv.writer(csv_output,
-                                    delimiter=",",
-                                    quotechar='"',
-                                    quoting=csv.QUOTE_MINIMAL)
-            for page in key_value_list:
-                csv_writer.writerows(
-                    [[timestamp, classification, base_filename, "FORMS"] +
-                     [x[1], x[3]] for x in page])  # only include key name and key value
-            for page in queries_value_list:
-                csv_writer.writerows(
-                    [[timestamp, classification, base_filename, "QUERIES"] +
-                     [x[1], x[3]] for x in page])  # only include alias and query result
-            if has_signature:
-                signature_value = "Contains Signature"
-            else:
-                signature_value = "Does NOT Contain Signature"
-            csv_writer.writerow(
-                [timestamp, classification, base_filename,
-                 "SIGNATURES", "HAS_SIGNATURE", signature_value])
-            csv_s3_output_key = f"{csv_s3_output_prefix}/{timestamp}/{base_filename_no_suffix}.csv"
-            result_value = csv_output.getvalue()
-        elif output_type == 'LINES':
-            csv_s3_output_key = f"{csv_s3_output_prefix}/{timestamp}/{base_filename_no_suffix}.txt"
-            result_value = ""
-            for page in trp2_doc.pages:
-                result_value += t2.TDocument.get_text_for_tblocks(
-                    trp2_doc.lines(page=page))
-            logger.debug(f"got {len(result_value)}")
-        else:
-            raise ValueError(f"output_type '${output_type}' not supported: ")
-
-        s3_client.put_object(Body=bytes(result_value.encode('UTF-8')),
-                             Bucket=csv_s3_output_bucket,
-                             Key=csv_s3_output_key)
-
-        output_json = {"TextractOutputCSVPath": f"s3://{csv_s3_output_bucket}/{csv_s3_output_key}"}
-        if output_type == "CSV":
-            output_json["TextractOutputTablesPaths"] = [documentTypeWithPageNum, table_output_s3_paths]
-        logger.debug(output_json)
-
-        step_functions_client.send_task_success(
+        output_json = generate_output(s3_path, classification, documentTypeWithPageNum, execution_id)
+
+        callback.send_task_success(
             taskToken=task_token,
             output=json.dumps(output_json))
     except Exception as e:
         logger.error(e, exc_info=True)
-        step_functions_client.send_task_failure(taskToken=task_token,
-                                                error=str(type(e)),
-                                                cause=str(e))
+        callback.send_task_failure(taskToken=task_token,
+                                   error=str(type(e)),
+                                   cause=str(e))
+
+
+def lambda_handler(event, context):
+    # without Token (request-response, e.g. from an Express workflow) the result is returned instead of sent
+    callback, task_token = task_callback(step_functions_client, event)
+    process_event(event, context, callback, task_token)
+    return None if task_token else callback.result()
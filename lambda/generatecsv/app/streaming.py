@@ -0,0 +1,329 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import codecs
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from block_store import BlockStore
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+class _JSONStreamReader():
+    """Decodes JSON values one at a time from a binary stream read in chunks."""
+
+    def __init__(self, stream, chunk_size: int):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + self.utf8.decode(chunk, final=self.eof)
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.pos = _whitespace.match(self.buffer, self.pos).end()  # type: ignore
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, characters: str) -> str:
+        c = self.peek()
+        if not c or c not in characters:
+            raise ValueError(f"expected one of '{characters}' at position {self.pos} but got '{c}'")
+        self.pos += 1
+        return c
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # a value ending with the buffer, e.g. a number, can continue in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_textract_blocks(stream,
+                         chunk_size: int = DEFAULT_CHUNK_SIZE,
+                         metadata: Optional[dict] = None) -> Iterator[dict]:
+    """Yields the entries of the top level 'Blocks' array of a Textract response one by one.
+
+    Only one chunk and the block being decoded are held in memory. The other top level
+    values (DocumentMetadata, ...) are put into metadata when given.
+    """
+    reader = _JSONStreamReader(stream, chunk_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'Blocks':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+        else:
+            value = reader.value()
+            if metadata is not None:
+                metadata[key] = value
+        if reader.expect(',}') == '}':
+            return
+
+
+def table_to_list(cells: List[dict]) -> List[List[str]]:
+    # same rows as trp.Table + convert_table_to_list: a new row starts when RowIndex increases
+    # and the cell text is every WORD followed by ' ' and every SELECTION_ELEMENT by ', '
+    rows: List[List[str]] = list()
+    row: List[str] = list()
+    row_index = 1
+    for cell in cells:
+        if cell['RowIndex'] > row_index:
+            rows.append(row)
+            row = list()
+            row_index = cell['RowIndex']
+        row.append(cell['Text'])
+    if row:
+        rows.append(row)
+    return rows
+
+
+class StreamingBlockResolver():
+    """Turns a stream of Textract blocks into CSV events as soon as their dependencies arrived.
+
+    Groups are KEY_VALUE_SET KEYs (VALUE block and the WORDs of both), QUERYs (QUERY_RESULT
+    answers) and TABLEs (CELLs and their WORDs). Only the parts the output needs are kept:
+    leaf text (WORD, SELECTION_ELEMENT, QUERY_RESULT) of the current page, VALUE and CELL blocks
+    until their group resolved and the unresolved groups. Textract returns the blocks grouped
+    by page starting with the PAGE block, so leaf text of earlier pages nobody waits for is
+    released when the next PAGE block arrives. LINE text is kept until the page ends and emitted
+    in the order of the PAGE block's CHILD ids, like trp2 does.
+
+    feed() and finish() return events:
+        ('LINES', (page, text of the page's lines joined with ' ')), ('FORMS', row), ('QUERIES', row),
+        ('TABLES', (table_number, rows)), ('SIGNATURES', True) for the first SIGNATURE block
+    """
+
+    def __init__(self, emit_lines: bool = False, emit_fields: bool = True):
+        self.emit_lines = emit_lines
+        self.emit_fields = emit_fields
+        self.leaves: Dict[str, dict] = dict()
+        self.intermediates: Dict[str, dict] = dict()
+        self.groups: Dict[str, dict] = dict()
+        self.missing: Dict[str, Set[str]] = dict()
+        self.waiting: Dict[str, Set[str]] = dict()
+        self.page = 0
+        self.page_lines: Optional[Tuple[int, List[str]]] = None
+        self.lines: Dict[str, str] = dict()
+        self.number_of_tables = 0
+        self.has_signature = False
+
+    @property
+    def pending(self) -> int:
+        # number of retained blocks, for logging the peak
+        return len(self.leaves) + len(self.intermediates) + len(self.groups)
+
+    @staticmethod
+    def _children(block: dict, relationship_type: str = 'CHILD') -> List[str]:
+        ids: List[str] = list()
+        for relationship in block.get('Relationships') or ():
+            if relationship['Type'] == relationship_type:
+                ids.extend(relationship['Ids'])
+        return ids
+
+    def _require(self, group_id: str, ids: Iterable[str]):
+        for _id in ids:
+            if _id in self.leaves:
+                continue
+            if _id in self.intermediates:
+                self._require(group_id, self.intermediates[_id]['children'])
+                continue
+            self.missing[group_id].add(_id)
+            self.waiting.setdefault(_id, set()).add(group_id)
+
+    def _add_group(self, group: dict, ids: List[str]) -> List[Tuple[str, Any]]:
+        group_id = group['Id']
+        self.groups[group_id] = group
+        self.missing[group_id] = set()
+        self._require(group_id, ids)
+        if not self.missing[group_id]:
+            return self._resolve(group_id)
+        return []
+
+    def _arrived(self, _id: str) -> List[Tuple[str, Any]]:
+        events: List[Tuple[str, Any]] = list()
+        for group_id in self.waiting.pop(_id, ()):
+            missing = self.missing.get(group_id)
+            if missing is None:
+                continue
+            missing.discard(_id)
+            if _id in self.intermediates:
+                self._require(group_id, self.intermediates[_id]['children'])
+            if not missing:
+                events.extend(self._resolve(group_id))
+        return events
+
+    def _text(self, ids: Iterable[str]) -> str:
+        return BlockStore.get_text_for_blocks([self.leaves[_id] for _id in ids if _id in self.leaves])
+
+    def _resolve(self, group_id: str) -> List[Tuple[str, Any]]:
+        group = self.groups.pop(group_id)
+        for _id in self.missing.pop(group_id):
+            waiting = self.waiting.get(_id)
+            if waiting:
+                waiting.discard(group_id)
+                if not waiting:
+                    del self.waiting[_id]
+
+        events: List[Tuple[str, Any]] = list()
+        if group['BlockType'] == 'KEY':
+            value_confidence = ""
+            value_ids: List[str] = list()
+            for value_id in group['values']:
+                value = self.intermediates.pop(value_id, None)
+                if value:
+                    value_confidence = value['Confidence']
+                    value_ids.extend(value['children'])
+            events.append(('FORMS', [group['Confidence'], self._text(group['children']), value_confidence,
+                                     self._text(value_ids)]))
+        elif group['BlockType'] == 'QUERY':
+            answers = [self.leaves[_id] for _id in group['answers'] if _id in self.leaves]
+            if answers:
+                for answer in answers:
+                    events.append(('QUERIES', [group['Text'], group['Alias'] or group['Text'],
+                                               answer.get('Confidence', ""), answer.get('Text', "")]))
+            else:
+                events.append(('QUERIES', [group['Text'], group['Alias'] or group['Text'], "", ""]))
+        elif group['BlockType'] == 'TABLE':
+            cells: List[dict] = list()
+            for cell_id in group['children']:
+                cell = self.intermediates.pop(cell_id, None)
+                if cell:
+                    text = ""
+                    for _id in cell['children']:
+                        leaf = self.leaves.get(_id)
+                        if leaf and leaf['BlockType'] == 'WORD':
+                            text += leaf.get('Text', "") + ' '
+                        elif leaf and leaf['BlockType'] == 'SELECTION_ELEMENT':
+                            text += leaf.get('SelectionStatus', "") + ', '
+                    cells.append({'RowIndex': cell['RowIndex'], 'Text': text})
+            events.append(('TABLES', (group['number'], table_to_list(cells))))
+        return events
+
+    def _next_page(self, page: int):
+        self.page = page
+        for _id in [_id for _id, leaf in self.leaves.items() if leaf['Page'] < page and _id not in self.waiting]:
+            del self.leaves[_id]
+
+    def _page_lines(self) -> List[Tuple[str, Any]]:
+        # trp2 takes the lines of a page from the first CHILD relationship of the PAGE block
+        if self.page_lines is None:
+            return []
+        page, ids = self.page_lines
+        text = ' '.join([self.lines[_id] for _id in ids if self.lines.get(_id)])
+        self.page_lines = None
+        self.lines = dict()
+        return [('LINES', (page, text))]
+
+    def feed(self, block: dict) -> List[Tuple[str, Any]]:
+        block_type = block['BlockType']
+        page = block.get('Page', 1)
+        if block_type == 'PAGE':
+            if page > self.page:
+                self._next_page(page)
+            if not self.emit_lines:
+                return []
+            events = self._page_lines()
+            relationships = [r for r in block.get('Relationships') or () if r['Type'] == 'CHILD']
+            self.page_lines = (page, relationships[0]['Ids'] if relationships else [])
+            return events
+        if block_type == 'SIGNATURE':
+            if self.has_signature:
+                return []
+            self.has_signature = True
+            return [('SIGNATURES', True)]
+        if block_type == 'LINE':
+            if self.emit_lines:
+                self.lines[block['Id']] = block.get('Text', "")
+            return []
+        if not self.emit_fields:
+            return []
+
+        _id = block['Id']
+        if block_type in {'WORD', 'SELECTION_ELEMENT', 'QUERY_RESULT'}:
+            leaf = {'BlockType': block_type, 'Page': page}
+            for attribute in ('Text', 'SelectionStatus', 'Confidence'):
+                if attribute in block:
+                    leaf[attribute] = block[attribute]
+            self.leaves[_id] = leaf
+            return self._arrived(_id)
+        if block_type == 'KEY_VALUE_SET' and 'VALUE' in block.get('EntityTypes', ()):
+            self.intermediates[_id] = {'Confidence': block.get('Confidence', ""), 'children': self._children(block)}
+            return self._arrived(_id)
+        if block_type == 'CELL':
+            self.intermediates[_id] = {'RowIndex': block['RowIndex'], 'children': self._children(block)}
+            return self._arrived(_id)
+        if block_type == 'KEY_VALUE_SET' and 'KEY' in block.get('EntityTypes', ()):
+            group = {
+                'Id': _id,
+                'BlockType': 'KEY',
+                'Confidence': block.get('Confidence', ""),
+                'children': self._children(block),
+                'values': self._children(block, 'VALUE')
+            }
+            return self._add_group(group, group['children'] + group['values'])
+        if block_type == 'QUERY':
+            group = {
+                'Id': _id,
+                'BlockType': 'QUERY',
+                'Text': block['Query'].get('Text', ""),
+                'Alias': block['Query'].get('Alias', ""),
+                'answers': self._children(block, 'ANSWER')
+            }
+            return self._add_group(group, group['answers'])
+        if block_type == 'TABLE':
+            self.number_of_tables += 1
+            group = {'Id': _id, 'BlockType': 'TABLE', 'number': self.number_of_tables, 'children': self._children(block)}
+            return self._add_group(group, group['children'])
+        return []
+
+    def finish(self) -> List[Tuple[str, Any]]:
+        # groups whose blocks never arrived are emitted with what is there, like BlockStore does
+        events: List[Tuple[str, Any]] = list()
+        for group_id in list(self.groups):
+            events.extend(self._resolve(group_id))
+        events.extend(self._page_lines())
+        return events
+
+
+def resolve_blocks(blocks: Iterable[dict], resolver: StreamingBlockResolver) -> Iterator[Tuple[str, Any]]:
+    for block in blocks:
+        yield from resolver.feed(block)
+    yield from resolver.finish()
@@ -0,0 +1,77 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+import time
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 16
+
+
+class TableUploader():
+    """Uploads the per table CSV files on a bounded thread pool.
+
+    upload(table, bucket, key) runs on the pool. Tables can be submitted while the document is
+    still being processed; result() waits for all of them and returns the S3 paths ordered by
+    table number, independent of completion order. The first failed upload cancels the uploads
+    that did not start yet and is raised, a later submit() raises it right away. Used as context
+    manager, the pool is shut down on every exit, uploads not started yet are cancelled.
+    """
+
+    def __init__(self,
+                 upload: Callable[[List[List], str, str], None],
+                 s3_bucket: str,
+                 max_workers: int = DEFAULT_MAX_WORKERS):
+        self.upload = upload
+        self.s3_bucket = s3_bucket
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='table-upload')
+        self.futures: Dict[int, Future] = dict()
+        self.durations_ms: Dict[int, float] = dict()
+        self.start_time = time.perf_counter()
+
+    def _upload(self, table_number: int, table: List[List], s3_key: str) -> str:
+        start_time = time.perf_counter()
+        self.upload(table, self.s3_bucket, s3_key)
+        self.durations_ms[table_number] = (time.perf_counter() - start_time) * 1000
+        return f"s3://{self.s3_bucket}/{s3_key}"
+
+    def _raise_first_error(self, futures):
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception():
+                for pending in self.futures.values():
+                    pending.cancel()
+                self.executor.shutdown(wait=True)
+                raise future.exception()  # type: ignore
+
+    def submit(self, table_number: int, table: List[List], s3_key: str):
+        self._raise_first_error(self.futures.values())
+        self.futures[table_number] = self.executor.submit(self._upload, table_number, table, s3_key)
+
+    def result(self) -> List[str]:
+        done, _ = wait(self.futures.values(), return_when=FIRST_EXCEPTION)
+        self._raise_first_error(done)
+        self.executor.shutdown(wait=True)
+        wall_ms = (time.perf_counter() - self.start_time) * 1000
+        if self.durations_ms:
+            durations = sorted(self.durations_ms.values())
+            logger.info(f"generatecsv_table_upload_count: {len(durations)} \n\
+                    generatecsv_table_upload_duration_in_ms p50: {durations[len(durations) // 2]:.1f} \n\
+                    generatecsv_table_upload_duration_in_ms max: {durations[-1]:.1f} \n\
+                    generatecsv_table_upload_duration_in_ms sum: {sum(durations):.1f} \n\
+                    generatecsv_table_upload_wall_time_in_ms: {wall_ms:.1f}")
+            logger.debug(f"generatecsv_table_upload_duration_in_ms per table: {self.durations_ms}")
+        return [self.futures[n].result() for n in sorted(self.futures)]
+
+    def close(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
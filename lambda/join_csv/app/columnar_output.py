@@ -0,0 +1,188 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import csv
+import io
+import json
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from s3_io import put_many
+
+logger = logging.getLogger(__name__)
+
+NUMBER_PATTERN = re.compile(r"^[-+]?[$€£]?\s*\d[\d,]*(\.\d+)?\s*%?$")
+PAGE_PATTERN = re.compile(r"_page(\d+)$")
+TABLE_PATTERN = re.compile(r"table_(\d+)\.csv$")
+
+# classification and execution_date are the partition directories, not columns in the files
+FIELDS_SCHEMA = pa.schema([
+    ("execution_id", pa.string()),
+    ("original_document_pages", pa.string()),
+    ("timestamp", pa.timestamp("s", tz="UTC")),
+    ("base_filename", pa.string()),
+    ("page", pa.int32()),
+    ("feature_type", pa.dictionary(pa.int8(), pa.string())),
+    ("alias", pa.string()),
+    ("value", pa.string()),
+    ("value_number", pa.float64()),
+])
+
+TABLES_SCHEMA = pa.schema([
+    ("execution_id", pa.string()),
+    ("original_document_pages", pa.string()),
+    ("page", pa.int32()),
+    ("table_number", pa.int32()),
+    ("row_index", pa.int32()),
+    ("column_index", pa.int32()),
+    ("value", pa.string()),
+    ("value_number", pa.float64()),
+])
+
+
+def parse_number(value: str) -> Optional[float]:
+    """Numeric cell and field values ("1,234.50", "$ 12", "7%") as float, None otherwise."""
+    value = value.strip()
+    if not value or not NUMBER_PATTERN.match(value):
+        return None
+    return float(re.sub(r"[^\d.+-]", "", value))
+
+
+def _page_number(name: str) -> Optional[int]:
+    # "12.json" of the page CSVs, "<documentType>_page3" of the table paths
+    stem = os.path.splitext(os.path.basename(name))[0]
+    if stem.isdigit():
+        return int(stem)
+    match = PAGE_PATTERN.search(stem)
+    return int(match.group(1)) if match else None
+
+
+def _timestamp(value: str) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value).astimezone(timezone.utc)
+    except ValueError:
+        return None
+
+
+class ParquetBuilder():
+    """Collects rows of one schema and writes a row group every row_group_size rows into an
+    in-memory Parquet file."""
+
+    def __init__(self, schema: pa.Schema, compression: str = "zstd", row_group_size: int = 100000):
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.output = io.BytesIO()
+        self.writer = pq.ParquetWriter(self.output, schema, compression=compression)
+        self.columns: Dict[str, list] = {name: list() for name in schema.names}
+        self.pending = 0
+        self.rows = 0
+
+    def append(self, **row):
+        for name, values in self.columns.items():
+            values.append(row.get(name))
+        self.pending += 1
+        if self.pending >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.writer.write_table(pa.Table.from_pydict(self.columns, schema=self.schema))
+            self.rows += self.pending
+            self.columns = {name: list() for name in self.schema.names}
+            self.pending = 0
+
+    def close(self) -> bytes:
+        self._flush()
+        self.writer.close()
+        return self.output.getvalue()
+
+
+class ColumnarDatasetWriter():
+    """Long format Parquet datasets of one joined document, Hive partitioned:
+
+        <prefix>/fields/classification=<type>/execution_date=<YYYY-MM-DD>/<name>.parquet
+        <prefix>/tables/classification=<type>/execution_date=<YYYY-MM-DD>/<name>.parquet
+        <prefix>/manifests/execution_date=<YYYY-MM-DD>/<name>.json
+
+    fields has one row per page CSV row, tables one row per table cell. The manifest lists the
+    written files with their row counts and sizes.
+    """
+
+    def __init__(self, s3_client, bucket: str, prefix: str, execution_id: str, document_type: str,
+                 original_document_pages: str, execution_date: str, compression: str = "zstd"):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.execution_id = execution_id
+        self.document_type = document_type
+        self.original_document_pages = original_document_pages
+        self.execution_date = execution_date
+        self.name = f"{execution_id}_{document_type}_pages_{original_document_pages}"
+        self.compression = compression
+        self.fields = ParquetBuilder(FIELDS_SCHEMA, compression)
+        self.tables = ParquetBuilder(TABLES_SCHEMA, compression)
+
+    def add_page_csv(self, page_bytes: bytes):
+        # Timestamp, Classification, Base Filename, Feature Type, Alias, Value
+        for row in csv.reader(io.StringIO(page_bytes.decode('UTF-8'))):
+            if len(row) < 6:
+                continue
+            self.fields.append(execution_id=self.execution_id,
+                               original_document_pages=self.original_document_pages,
+                               timestamp=_timestamp(row[0]),
+                               base_filename=row[2],
+                               page=_page_number(row[2]),
+                               feature_type=row[3],
+                               alias=row[4],
+                               value=row[5],
+                               value_number=parse_number(row[5]))
+
+    def add_table_csv(self, table_s3_path: str, page_name: str, table_bytes: bytes):
+        match = TABLE_PATTERN.search(table_s3_path)
+        table_number = int(match.group(1)) if match else None
+        page = _page_number(page_name)
+        for row_index, row in enumerate(csv.reader(io.StringIO(table_bytes.decode('UTF-8')))):
+            for column_index, value in enumerate(row):
+                self.tables.append(execution_id=self.execution_id,
+                                   original_document_pages=self.original_document_pages,
+                                   page=page,
+                                   table_number=table_number,
+                                   row_index=row_index,
+                                   column_index=column_index,
+                                   value=value,
+                                   value_number=parse_number(value))
+
+    def _partition(self, dataset: str) -> str:
+        return f"{self.prefix}/{dataset}/classification={self.document_type}/execution_date={self.execution_date}"
+
+    def close(self) -> str:
+        """Uploads the datasets that have rows and the manifest, returns the manifest s3 path."""
+        files: List[dict] = list()
+        bodies: List[tuple] = list()
+        for dataset, builder in (("fields", self.fields), ("tables", self.tables)):
+            body = builder.close()
+            if not builder.rows:
+                continue
+            s3_path = f"s3://{self.bucket}/{self._partition(dataset)}/{self.name}.parquet"
+            bodies.append((s3_path, body))
+            files.append({"dataset": dataset, "path": s3_path, "rows": builder.rows, "bytes": len(body)})
+        put_many(self.s3, bodies, max_workers=2)
+        manifest = {
+            "executionId": self.execution_id,
+            "documentType": self.document_type,
+            "originalDocumentPages": self.original_document_pages,
+            "executionDate": self.execution_date,
+            "compression": self.compression,
+            "files": files
+        }
+        manifest_key = f"{self.prefix}/manifests/execution_date={self.execution_date}/{self.name}.json"
+        self.s3.put_object(Body=json.dumps(manifest).encode('UTF-8'), Bucket=self.bucket, Key=manifest_key,
+                           ContentType='application/json')
+        logger.info(f"join_csv_parquet_rows: {sum(f['rows'] for f in files)}, "
+                    f"bytes: {sum(f['bytes'] for f in files)}")
+        return f"s3://{self.bucket}/{manifest_key}"
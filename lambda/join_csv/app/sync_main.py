@@ -1,33 +1,63 @@
 # Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
+import csv
+import io
 import json
 import logging
 import os
-import boto3
-
-import pandas as pd
-from io import BytesIO
+import time
 from datetime import datetime
+from typing import Callable, List, Optional
+
+import boto3
+from claim_check import check_out
+from s3_io import get_bytes, get_many, pooled_client
+from s3_stream_writer import DEFAULT_PART_SIZE, S3StreamWriter
 
 logger = logging.getLogger(__name__)
-s3 = boto3.client('s3')
 
+# PANDAS parses every page CSV into a DataFrame, STREAMING copies the rows of the pages in order
+# into a multipart upload without parsing them and without importing pandas
+JOIN_MODES = ("PANDAS", "STREAMING")
+# NONE only writes the joined CSV, PARQUET also writes the fields and tables datasets of columnar_output
+COLUMNAR_OUTPUTS = ("NONE", "PARQUET")
+COLUMN_NAMES = ["Timestamp", "Classification", "Base Filename", "Feature Type", "Alias", "Value"]
 
-def split_s3_path_to_bucket_and_key(s3_path):
-    if len(s3_path) > 7 and s3_path.lower().startswith("s3://"):
-        s3_bucket, s3_key = s3_path.replace("s3://", "").split("/", 1)
-        return s3_bucket, s3_key
-    else:
-        raise ValueError(
-            f"s3_path: {s3_path} is no s3_path in the form of s3://bucket/key."
-        )
+join_workers = int(os.environ.get('JOIN_WORKERS', '16'))
+s3 = pooled_client(max_pool_connections=join_workers)
 
 
-def get_file_from_s3(s3_path):
-    s3_bucket, s3_key = split_s3_path_to_bucket_and_key(s3_path)
-    o = s3.get_object(Bucket=s3_bucket, Key=s3_key)
-    return o.get('Body').read()
+def join_streaming(s3_paths: List[str], s3_output_bucket: str, output_bucket_key: str,
+                   on_page: Optional[Callable[[bytes], None]] = None):
+    part_size = int(os.environ.get('MULTIPART_PART_SIZE', DEFAULT_PART_SIZE))
+    with S3StreamWriter(s3, s3_output_bucket, output_bucket_key, part_size=part_size) as output:
+        csv.writer(output, delimiter=",", quotechar='"', quoting=csv.QUOTE_MINIMAL).writerow(COLUMN_NAMES)
+        for page_bytes in get_many(s3, s3_paths, join_workers):
+            if on_page:
+                on_page(page_bytes)
+            output.write_bytes(page_bytes)
+            if page_bytes and not page_bytes.endswith(b"\n"):
+                output.write_bytes(b"\r\n")
+
+
+def join_pandas(s3_paths: List[str], s3_output_bucket: str, output_bucket_key: str,
+                on_page: Optional[Callable[[bytes], None]] = None):
+    import pandas as pd
+    all_df = []
+    for s3_path in s3_paths:
+        file_bytes = get_bytes(s3, s3_path)
+        if on_page:
+            on_page(file_bytes)
+        with io.BytesIO(file_bytes) as f:
+            df = pd.read_csv(f, header=None)
+            all_df.append(df)
+
+    result = pd.concat(all_df, ignore_index=True)
+    result_bytes = result.to_csv(index=False, header=COLUMN_NAMES)
+    s3.put_object(Body=result_bytes,
+                  Bucket=s3_output_bucket,
+                  Key=output_bucket_key)
 
 
 def lambda_handler(event, _):
@@ -52,28 +82,52 @@ def lambda_handler(event, _):
                     S3_OUTPUT_BUCKET: {s3_output_bucket} \n \
                     S3_OUTPUT_PREFIX: {s3_output_prefix}")
 
-    all_df = []
-    col_names = ["Timestamp", "Classification", "Base Filename", "Feature Type", "Alias", "Value"]
-    for s3_path in payload['output_csv_paths']:
-        file_bytes = get_file_from_s3(s3_path)
-        with BytesIO(file_bytes) as f:
-            df = pd.read_csv(f, header=None)
-            all_df.append(df)
+    join_mode = os.environ.get('JOIN_MODE', 'PANDAS')
+    if join_mode not in JOIN_MODES:
+        raise ValueError(f"JOIN_MODE must be one of {JOIN_MODES}, got {join_mode}")
+    columnar_output = os.environ.get('COLUMNAR_OUTPUT', 'NONE')
+    if columnar_output not in COLUMNAR_OUTPUTS:
+        raise ValueError(f"COLUMNAR_OUTPUT must be one of {COLUMNAR_OUTPUTS}, got {columnar_output}")
 
-    result = pd.concat(all_df, ignore_index=True)
-    result_bytes = result.to_csv(index=False, header=col_names)
     s3_filename = f"{payload['document_type']}_pages_{payload['original_document_pages']}"
     
     output_bucket_key = f"{s3_output_prefix}/csvfiles_{execution_id}/{s3_filename}_{datetime.utcnow().isoformat()}.csv"
     logger.debug(s3_output_bucket)
     logger.debug(s3_output_prefix)
     logger.debug(output_bucket_key)
-    
-    s3.put_object(Body=result_bytes,
-                  Bucket=s3_output_bucket,
-                  Key=output_bucket_key)
-    
-    return {
+
+    # compile_paths passes large lists as claim checks, table_csv_paths is returned without loading it
+    s3_paths = check_out(payload['output_csv_paths'], s3)
+    start_time = round(time.time() * 1000)
+    dataset = None
+    if columnar_output == "PARQUET":
+        from columnar_output import ColumnarDatasetWriter
+        # partitioned by the day the execution started, so all documents of a packet end up in one partition
+        execution_date = event.get("ExecutionStartTime", datetime.utcnow().isoformat())[:10]
+        dataset = ColumnarDatasetWriter(s3, s3_output_bucket,
+                                        os.environ.get('COLUMNAR_S3_OUTPUT_PREFIX', f"{s3_output_prefix}/parquet"),
+                                        execution_id, payload['document_type'], payload['original_document_pages'],
+                                        execution_date, compression=os.environ.get('PARQUET_COMPRESSION', 'zstd'))
+    on_page = dataset.add_page_csv if dataset else None
+    if join_mode == "STREAMING":
+        join_streaming(s3_paths, s3_output_bucket, output_bucket_key, on_page)
+    else:
+        join_pandas(s3_paths, s3_output_bucket, output_bucket_key, on_page)
+    call_duration = round(time.time() * 1000) - start_time
+    logger.info(f"join_csv_pages: {len(s3_paths)}")
+    logger.info(f"join_csv_{join_mode.lower()}_duration_in_ms: {call_duration}")
+
+    output = {
         "JoinedCSVOutputPath": f"s3://{s3_output_bucket}/{output_bucket_key}",
         "TextractOutputTablesPaths": payload['table_csv_paths']
     }
+    if dataset:
+        start_time = round(time.time() * 1000)
+        table_csv_paths = check_out(payload['table_csv_paths'], s3)
+        tables = [(page_name, s3_path) for page_name, paths in table_csv_paths.items() for s3_path in paths]
+        for (page_name, s3_path), table_bytes in zip(tables, get_many(s3, [p for _, p in tables], join_workers)):
+            dataset.add_table_csv(s3_path, page_name, table_bytes)
+        output["ColumnarManifestPath"] = dataset.close()
+        call_duration = round(time.time() * 1000) - start_time
+        logger.info(f"join_csv_parquet_duration_in_ms: {call_duration}")
+    return output
@@ -4,10 +4,14 @@ kicks off Step Function executions
 import json
 import logging
 import os
-import json
+
+from claim_check import check_in, claim_check_store, page_record_name
+from s3_io import pooled_client
 
 logger = logging.getLogger(__name__)
 
+s3_client = pooled_client()
+
 
 def lambda_handler(event, _):
     log_level = os.environ.get('LOG_LEVEL', 'INFO')
@@ -20,10 +24,14 @@ def lambda_handler(event, _):
     s3_filename, _ = os.path.splitext(os.path.basename(file_name))
 
     if s3_filename and classification:
-        return {
+        record = {
             s3_filename: classification,
             "TextractOutputCSVPath": event['csv_output_location']['TextractOutputCSVPath'],
             "TextractOutputTablesPaths": event['csv_output_location']['TextractOutputTablesPaths']
         }
+        # with a claim check store compile_paths reads the record from there instead of the Map state result
+        store = claim_check_store(os.environ.get('CLAIM_CHECK_STORE', 'NONE'), s3_client)
+        check_in(store, record, name=page_record_name(file_name))
+        return record
     else:
         return {}
@@ -0,0 +1,105 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+configures, extracts, generates the CSV and maps the classification of one page in one invocation
+"""
+import json
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+import textractmanifest as tm
+
+# the Dockerfile copies the main.py of configurator, generatecsv and map_classifications_lambda under these names
+import configurator_main as configurator
+import generatecsv_main as generatecsv
+import map_classifications_main as map_classifications
+import sync_main as textract_sync
+from task_callback import task_failed
+
+logger = logging.getLogger(__name__)
+__version__ = "0.0.1"
+
+# PAGE runs the configurator for the page, NONE when ProcessPagesMapState gets pages configured in bulk
+CONFIGURE_MODES = ("PAGE", "NONE")
+
+
+def extract(page: dict) -> Tuple[str, Optional[dict]]:
+    """textract_sync for one page, (TextractOutputJsonPath, Textract response or None when it was not called).
+
+    Failures textract_sync sends with send_task_failure are raised as exceptions of the same name, the
+    retryable ones as textract_sync raises them, so Retry and Catch of the task match the same errors.
+    """
+    s3_output_bucket = os.environ.get('S3_OUTPUT_BUCKET')
+    s3_output_prefix = os.environ.get('S3_OUTPUT_PREFIX')
+    textract_api = os.environ.get('TEXTRACT_API', 'GENERIC')
+    output_encoding = os.environ.get('OUTPUT_ENCODING', 'JSON_INDENT')
+    cache_store = os.environ.get('TEXTRACT_CACHE', 'NONE')
+    if not s3_output_bucket or not s3_output_prefix:
+        raise ValueError(
+            f"no s3_output_bucket: {s3_output_bucket} or s3_output_prefix: {s3_output_prefix} defined.")
+    if output_encoding not in textract_sync.OUTPUT_ENCODINGS:
+        raise ValueError(f"OUTPUT_ENCODING must be one of {textract_sync.OUTPUT_ENCODINGS}")
+    if cache_store not in textract_sync.CACHE_STORES:
+        raise ValueError(f"TEXTRACT_CACHE must be one of {textract_sync.CACHE_STORES}")
+
+    number_of_pages = int(page.get('numberOfPages', 0))
+    if number_of_pages > 1:
+        raise task_failed('TooManyPagesForSync',
+                          f'Document with > 1 page was sent to a Sync Textract API endpoint (number pages: '
+                          f'{number_of_pages}')
+    manifest: tm.IDPManifest = tm.IDPManifestSchema().load(page['manifest'])  # type: ignore
+    try:
+        return textract_sync.process_manifest_response(manifest, s3_output_bucket, s3_output_prefix, textract_api,
+                                                       output_encoding, cache_store, page.get('classification'))
+    except Exception as e:
+        name = textract_sync.textract_error_name(e)
+        if name in textract_sync.RETRYABLE_EXCEPTIONS:
+            logger.warning(f"textract.exceptions.{name}")
+            raise textract_sync.RETRYABLE_EXCEPTIONS[name](name)
+        logger.error(e)
+        raise task_failed(name, f"{name}: {e} for manifest: {manifest}"[:250]) from e
+
+
+def lambda_handler(event, _):
+    """ProcessPagesMapState in one task: configurator, textract_sync, generatecsv and map_classifications_lambda
+    for the page in Payload, returns the map_classifications_lambda record. The Textract response is passed to
+    the CSV generation in memory, the Textract JSON, page CSV and table CSVs are stored as before."""
+    log_level = os.environ.get('LOG_LEVEL', 'INFO')
+    logger.setLevel(log_level)
+    logger.info(f"version: {__version__}")
+    logger.debug(json.dumps(event))
+    configure_mode = os.environ.get('CONFIGURE', 'PAGE')
+    if configure_mode not in CONFIGURE_MODES:
+        raise ValueError(f"CONFIGURE must be one of {CONFIGURE_MODES}")
+    if "Payload" not in event:
+        raise ValueError("Need Payload with manifest to process message.")
+
+    start_time = round(time.time() * 1000)
+    page = event['Payload']
+    if configure_mode == "PAGE":
+        page = configurator.lambda_handler(page, None)
+    configure_time = round(time.time() * 1000)
+
+    textract_output_json_path, textract_response = extract(page)
+    page['textract_result'] = {"TextractOutputJsonPath": textract_output_json_path}
+    extract_time = round(time.time() * 1000)
+
+    classification = page.get('classification') or {}
+    page['csv_output_location'] = generatecsv.generate_output(textract_output_json_path,
+                                                              classification.get('documentType', ""),
+                                                              classification.get('documentTypeWithPageNum'),
+                                                              event['ExecutionId'].split(":")[-1],
+                                                              file_json=textract_response)
+    csv_time = round(time.time() * 1000)
+
+    record = map_classifications.lambda_handler(page, None)
+    call_duration = round(time.time() * 1000) - start_time
+    logger.info(f"process_page_configure_duration_in_ms: {configure_time - start_time} \n \
+        process_page_textract_duration_in_ms: {extract_time - configure_time} \n \
+        process_page_generatecsv_duration_in_ms: {csv_time - extract_time} \n \
+        process_page_textract_response_in_memory: {1 if textract_response is not None else 0} \n \
+        process_page_duration_in_ms: {call_duration}")
+    return record
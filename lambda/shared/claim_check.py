@@ -0,0 +1,103 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import json
+import os
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+from s3_io import get_bytes, put_bytes
+
+# NONE passes the values in the state, S3 stores them under CLAIM_CHECK_BUCKET/CLAIM_CHECK_PREFIX,
+# LOCAL under CLAIM_CHECK_DIRECTORY (local runs without S3)
+CLAIM_CHECK_STORES = ("NONE", "S3", "LOCAL")
+CLAIM_CHECK_KEY = "claimCheck"
+
+
+def is_claim_check(value: Any) -> bool:
+    return isinstance(value, dict) and CLAIM_CHECK_KEY in value
+
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, separators=(',', ':')).encode('UTF-8')
+
+
+class S3ClaimCheckStore():
+
+    def __init__(self, s3_client, bucket: str, prefix: str):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def uri(self, name: str) -> str:
+        return f"s3://{self.bucket}/{self.prefix}/{name}.json"
+
+    def put(self, name: str, body: bytes) -> str:
+        return put_bytes(self.s3, self.uri(name), body, ContentType='application/json')
+
+
+class LocalClaimCheckStore():
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def uri(self, name: str) -> str:
+        return f"file://{os.path.abspath(os.path.join(self.directory, name))}.json"
+
+    def put(self, name: str, body: bytes) -> str:
+        path = urlparse(self.uri(name)).path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(body)
+        return self.uri(name)
+
+
+def claim_check_store(mode: str, s3_client=None):
+    """Store for check_in from the CLAIM_CHECK_* environment, None for NONE."""
+    if mode not in CLAIM_CHECK_STORES:
+        raise ValueError(f"CLAIM_CHECK_STORE must be one of {CLAIM_CHECK_STORES}, got {mode}")
+    if mode == "S3":
+        bucket = os.environ.get('CLAIM_CHECK_BUCKET')
+        if not bucket:
+            raise ValueError("CLAIM_CHECK_STORE S3 needs CLAIM_CHECK_BUCKET")
+        return S3ClaimCheckStore(s3_client, bucket, os.environ.get('CLAIM_CHECK_PREFIX', 'claim-check'))
+    if mode == "LOCAL":
+        return LocalClaimCheckStore(os.environ.get('CLAIM_CHECK_DIRECTORY', '/tmp/claim-check'))
+    return None
+
+
+def check_in(store, value: Any, name: Optional[str] = None, threshold_bytes: int = 0) -> Any:
+    """Stores value and returns {"claimCheck": uri, "length": ...} in its place, or returns value
+    unchanged without a store or when its JSON is at most threshold_bytes. Without a name the key
+    is the content hash, so a retried invocation writes the same object."""
+    if store is None:
+        return value
+    body = _dumps(value)
+    if len(body) <= threshold_bytes:
+        return value
+    uri = store.put(name or hashlib.sha256(body).hexdigest(), body)
+    reference = {CLAIM_CHECK_KEY: uri}
+    if isinstance(value, (list, dict)):
+        reference['length'] = len(value)
+    return reference
+
+
+def check_out(value: Any, s3_client=None) -> Any:
+    """Loads the value a claim check refers to, any other value is returned unchanged."""
+    if not is_claim_check(value):
+        return value
+    uri = urlparse(value[CLAIM_CHECK_KEY])
+    if uri.scheme == "s3":
+        body = get_bytes(s3_client, value[CLAIM_CHECK_KEY])
+    elif uri.scheme == "file":
+        with open(uri.path, 'rb') as f:
+            body = f.read()
+    else:
+        raise ValueError(f"unsupported claim check: {value[CLAIM_CHECK_KEY]}")
+    return json.loads(body)
+
+
+def page_record_name(page_s3_path: str) -> str:
+    # per page result of ProcessPagesMapState, written by map_classifications_lambda and read by compile_paths
+    return "pages/" + page_s3_path.replace("s3://", "", 1)
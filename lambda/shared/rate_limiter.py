@@ -0,0 +1,115 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import logging
+import math
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# NONE disables the limiter, MEMORY limits the threads of one container,
+# DYNAMODB shares the quota between all concurrent Lambda invocations
+RATE_LIMITERS = ("NONE", "MEMORY", "DYNAMODB")
+
+# requests per second, override with RATE_LIMITS='{"AnalyzeDocument": 10, ...}' to match the account quotas
+DEFAULT_RATE_LIMITS: Dict[str, float] = {
+    "AnalyzeDocument": 10,
+    "DetectDocumentText": 10,
+    "ClassifyDocument": 10,
+}
+
+
+def parse_rate_limits(rate_limits: Optional[str]) -> Dict[str, float]:
+    limits = dict(DEFAULT_RATE_LIMITS)
+    if rate_limits:
+        limits.update({api: float(tps) for api, tps in json.loads(rate_limits).items()})
+    if any(tps <= 0 for tps in limits.values()):
+        raise ValueError(f"RATE_LIMITS must be > 0, got {limits}")
+    return limits
+
+
+class InMemoryTokenBucket():
+    """Token bucket per API, refilled with rate tokens/second up to rate tokens (1 second burst).
+
+    The bucket holds at least 1 token, otherwise rates below 1/second would never grant a request.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[str, list] = dict()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, api: str, rate: float) -> float:
+        # returns 0 when a token was taken, otherwise the seconds until the next token is available
+        with self._lock:
+            now = time.monotonic()
+            capacity = max(rate, 1.0)
+            tokens, last = self.buckets.get(api, [capacity, now])
+            tokens = min(capacity, tokens + (now - last) * rate)
+            if tokens >= 1:
+                self.buckets[api] = [tokens - 1, now]
+                return 0.0
+            self.buckets[api] = [tokens, now]
+            return (1 - tokens) / rate
+
+
+class DynamoDBWindowCounter():
+    """Conditional counter per API and window in a DynamoDB table.
+
+    The table has the partition key RATE_LIMIT_KEY; EXPIRES_AT can be used as TTL attribute so
+    old windows are removed. An increment only succeeds while the window count is below the limit
+    of the window, so all invocations sharing the table together stay under the quota. Windows
+    are one second long, for rates below 1/second ceil(1 / rate) seconds with one request.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def try_acquire(self, api: str, rate: float) -> float:
+        now = time.time()
+        window_s = max(1, math.ceil(1 / rate))
+        limit = max(1, int(rate * window_s))
+        window = int(now // window_s) * window_s
+        try:
+            self.table.update_item(Key={'RATE_LIMIT_KEY': f"{api}#{window}"},
+                                   UpdateExpression="ADD #count :one SET #expires = :expires",
+                                   ConditionExpression="attribute_not_exists(#count) OR #count < :limit",
+                                   ExpressionAttributeNames={
+                                       '#count': 'REQUEST_COUNT',
+                                       '#expires': 'EXPIRES_AT'
+                                   },
+                                   ExpressionAttributeValues={
+                                       ':one': 1,
+                                       ':limit': limit,
+                                       ':expires': window + window_s + 60
+                                   })
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return window + window_s - now
+        return 0.0
+
+
+class RateLimiter():
+    """Blocks callers until the backend grants a request for the API, at most max_wait_s seconds."""
+
+    def __init__(self, backend, rate_limits: Dict[str, float], max_wait_s: float = 30):
+        self.backend = backend
+        self.rate_limits = rate_limits
+        self.max_wait_s = max_wait_s
+
+    def acquire(self, api: str) -> bool:
+        """False when no request was granted within max_wait_s, the caller should treat it as throttling."""
+        start_time = time.monotonic()
+        waited = 0.0
+        while True:
+            wait_s = self.backend.try_acquire(api, self.rate_limits[api])
+            if not wait_s:
+                if waited:
+                    logger.info(f"rate_limiter_{api}_wait_in_ms: {round(waited * 1000)}")
+                return True
+            waited = time.monotonic() - start_time
+            if waited + wait_s > self.max_wait_s:
+                logger.warning(f"rate_limiter_{api}_timeout_in_ms: {round(waited * 1000)}")
+                return False
+            time.sleep(wait_s)
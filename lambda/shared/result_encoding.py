@@ -0,0 +1,89 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import json
+from typing import Optional, Tuple
+
+# JSON_INDENT is the original pretty printed output, JSON drops the whitespace,
+# GZIP and ZSTD compress the compact JSON and set Content-Encoding on the object
+OUTPUT_ENCODINGS = ("JSON_INDENT", "JSON", "GZIP", "ZSTD")
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("ZSTD encoding requires the zstandard package")
+    return zstandard
+
+
+def encode_textract_response(textract_response: dict, output_encoding: str) -> Tuple[bytes, dict]:
+    """Returns the object body and the put_object metadata arguments for the encoding."""
+    if output_encoding == "JSON_INDENT":
+        return json.dumps(textract_response, indent=4).encode('UTF-8'), {'ContentType': 'application/json'}
+    body = json.dumps(textract_response, separators=(',', ':')).encode('UTF-8')
+    if output_encoding == "JSON":
+        return body, {'ContentType': 'application/json'}
+    if output_encoding == "GZIP":
+        return gzip.compress(body, compresslevel=6), {'ContentType': 'application/json', 'ContentEncoding': 'gzip'}
+    if output_encoding == "ZSTD":
+        return _zstandard().ZstdCompressor(level=3).compress(body), {
+            'ContentType': 'application/json',
+            'ContentEncoding': 'zstd'
+        }
+    raise ValueError(f"OUTPUT_ENCODING must be one of {OUTPUT_ENCODINGS}, got {output_encoding}")
+
+
+def _detect(head: bytes, content_encoding: Optional[str]) -> Optional[str]:
+    # Content-Encoding wins, the magic bytes cover objects copied without their metadata
+    if content_encoding in ('gzip', 'zstd'):
+        return content_encoding
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+
+def decode_body(body: bytes, content_encoding: Optional[str] = None) -> bytes:
+    encoding = _detect(body[:4], content_encoding)
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    if encoding == 'zstd':
+        return _zstandard().ZstdDecompressor().decompressobj().decompress(body)
+    return body
+
+
+class _PeekedStream():
+    # puts the bytes read to detect the encoding back in front of the stream
+
+    def __init__(self, head: bytes, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if not self.head:
+            return self.stream.read() if size is None or size < 0 else self.stream.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.stream.read(), b''
+            return data
+        data, self.head = self.head[:size], self.head[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+
+
+def decoding_stream(stream, content_encoding: Optional[str] = None):
+    """Wraps a readable binary stream (e.g. the S3 StreamingBody) so reads return decoded bytes."""
+    head = stream.read(4)
+    stream = _PeekedStream(head, stream)
+    encoding = _detect(head, content_encoding)
+    if encoding == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if encoding == 'zstd':
+        return _zstandard().ZstdDecompressor().stream_reader(stream)
+    return stream
@@ -0,0 +1,236 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+# S3 reads and writes of the Lambdas, copied from lambda/shared/ into their images. The functions take
+# the client as first argument, so the handlers keep their module level client and localpipeline can
+# replace it with a stand-in or a LocalFileSystemS3.
+
+DEFAULT_MAX_POOL_CONNECTIONS = 32
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+def split_s3_path_to_bucket_and_key(s3_path: str) -> Tuple[str, str]:
+    if len(s3_path) > 7 and s3_path.lower().startswith("s3://"):
+        s3_bucket, s3_key = s3_path.replace("s3://", "").split("/", 1)
+        return s3_bucket, s3_key
+    else:
+        raise ValueError(f"s3_path: {s3_path} is no s3_path in the form of s3://bucket/key.")
+
+
+def pooled_client(max_pool_connections: Optional[int] = None, max_attempts: Optional[int] = None):
+    """boto3 S3 client for concurrent use: a connection pool of max_pool_connections
+    (S3_MAX_POOL_CONNECTIONS, default 32), TCP keep-alive and adaptive retries, which also slow the
+    client down on SlowDown responses (S3_MAX_ATTEMPTS, default 5)."""
+    import boto3
+    from botocore.config import Config
+    max_pool_connections = max_pool_connections or int(
+        os.environ.get('S3_MAX_POOL_CONNECTIONS', DEFAULT_MAX_POOL_CONNECTIONS))
+    max_attempts = max_attempts or int(os.environ.get('S3_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS))
+    config = dict(max_pool_connections=max_pool_connections,
+                  retries={'max_attempts': max_attempts, 'mode': 'adaptive'})
+    try:
+        return boto3.client('s3', config=Config(tcp_keepalive=True, **config))
+    except TypeError:
+        # botocore before 1.27.84 (boto3 pinned in textract_sync) has no tcp_keepalive
+        return boto3.client('s3', config=Config(**config))
+
+
+def get_object(s3_client, s3_path: str, start: Optional[int] = None, end: Optional[int] = None) -> dict:
+    """GetObject response, with start and/or end (inclusive) only that byte range."""
+    s3_bucket, s3_key = split_s3_path_to_bucket_and_key(s3_path)
+    params = dict(Bucket=s3_bucket, Key=s3_key)
+    if start is not None or end is not None:
+        params['Range'] = f"bytes={start or 0}-{'' if end is None else end}"
+    return s3_client.get_object(**params)
+
+
+def get_bytes(s3_client, s3_path: str, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+    return get_object(s3_client, s3_path, start, end)['Body'].read()
+
+
+def open_stream(s3_client, s3_path: str) -> Tuple[object, Optional[str]]:
+    """(streaming body, Content-Encoding) to read the object without holding it in memory."""
+    response = get_object(s3_client, s3_path)
+    return response['Body'], response.get('ContentEncoding')
+
+
+def iter_chunks(s3_client, s3_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    body, _ = open_stream(s3_client, s3_path)
+    try:
+        while True:
+            chunk = body.read(chunk_size)  # type: ignore
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        body.close()  # type: ignore
+
+
+def put_bytes(s3_client, s3_path: str, body: bytes, **kwargs) -> str:
+    s3_bucket, s3_key = split_s3_path_to_bucket_and_key(s3_path)
+    s3_client.put_object(Body=body, Bucket=s3_bucket, Key=s3_key, **kwargs)
+    return s3_path
+
+
+def exists(s3_client, s3_path: str) -> bool:
+    from botocore.exceptions import ClientError
+    s3_bucket, s3_key = split_s3_path_to_bucket_and_key(s3_path)
+    try:
+        s3_client.head_object(Bucket=s3_bucket, Key=s3_key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+    return True
+
+
+def get_many(s3_client,
+             s3_paths: Iterable[str],
+             max_workers: int = DEFAULT_MAX_WORKERS,
+             fetch: Optional[Callable[[str], Any]] = None) -> Iterator[Any]:
+    """Object bodies in the order of s3_paths, fetched on max_workers threads with at most
+    max_workers objects ahead of the consumer, so memory stays bounded whatever the number of
+    objects. fetch replaces get_bytes, e.g. to parse the objects on the worker threads."""
+    fetch = fetch or (lambda s3_path: get_bytes(s3_client, s3_path))
+    paths = iter(s3_paths)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque(pool.submit(fetch, s3_path) for _, s3_path in zip(range(max_workers), paths))
+        try:
+            while pending:
+                data = pending.popleft().result()
+                next_path = next(paths, None)
+                if next_path is not None:
+                    pending.append(pool.submit(fetch, next_path))
+                yield data
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def put_many(s3_client, objects: Iterable[Tuple[str, bytes]], max_workers: int = DEFAULT_MAX_WORKERS,
+             **kwargs) -> List[str]:
+    """Uploads (s3 path, body) pairs on max_workers threads, returns the paths in order and raises
+    the first failed upload."""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(lambda o: put_bytes(s3_client, o[0], o[1], **kwargs), objects))
+
+
+class _LocalBody():
+
+    def __init__(self, f, length: int):
+        self._file = f
+        self._remaining = length
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        amt = self._remaining if amt is None else min(amt, self._remaining)
+        data = self._file.read(amt)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class LocalFileSystemS3():
+    """The subset of the S3 client the Lambdas use, backed by root/<bucket>/<key>. Put parameters
+    like ContentEncoding are kept in a <key>.s3meta.json file next to the object."""
+
+    METADATA_SUFFIX = ".s3meta.json"
+
+    def __init__(self, root: str):
+        from botocore.exceptions import ClientError
+        self.root = root
+        self._client_error = ClientError
+        self.exceptions = SimpleNamespace(NoSuchKey=type('NoSuchKey', (ClientError, ), {}), ClientError=ClientError)
+        self.uploads: dict = dict()
+        self._lock = threading.Lock()
+
+    def _path(self, bucket: str, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.abspath(self.root) + os.sep):
+            raise ValueError(f"key outside of {self.root}: {key}")
+        return path
+
+    def _metadata(self, path: str) -> dict:
+        if not os.path.exists(path + self.METADATA_SUFFIX):
+            return dict()
+        with open(path + self.METADATA_SUFFIX) as f:
+            return json.load(f)
+
+    def put_object(self, Body, Bucket: str, Key: str, **kwargs) -> dict:
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif not isinstance(Body, (bytes, bytearray)):
+            Body = Body.read()
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, 'wb') as f:
+            f.write(Body)
+        # like S3 for single part uploads, the ETag is the MD5 of the bytes
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'
+        with open(path + self.METADATA_SUFFIX, 'w') as f:
+            json.dump(dict({k: v for k, v in kwargs.items() if isinstance(v, str)}, ETag=etag), f)
+        os.replace(temporary_path, path)
+        return {'ETag': etag}
+
+    def copy_object(self, Bucket: str, Key: str, CopySource: dict, **kwargs) -> dict:
+        response = self.get_object(Bucket=CopySource['Bucket'], Key=CopySource['Key'])
+        metadata = {k: v for k, v in response.items() if k not in ('Body', 'ContentLength')}
+        self.put_object(Body=response['Body'], Bucket=Bucket, Key=Key, **metadata)
+        response['Body'].close()
+        return {'CopyObjectResult': {}}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise self._client_error({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return dict(self._metadata(path), ContentLength=os.path.getsize(path))
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None, **kwargs) -> dict:
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise self.exceptions.NoSuchKey({'Error': {'Code': 'NoSuchKey', 'Message': f"s3://{Bucket}/{Key}"}},
+                                            'GetObject')
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        if Range:
+            first, last = Range.replace("bytes=", "").split("-")
+            start, end = int(first or 0), min(int(last), size - 1) if last else size - 1
+        f = open(path, 'rb')
+        f.seek(start)
+        length = max(end - start + 1, 0)
+        return dict(self._metadata(path), ContentLength=length, Body=_LocalBody(f, length))
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> dict:
+        with self._lock:
+            upload_id = str(len(self.uploads) + 1)
+            self.uploads[upload_id] = {'kwargs': kwargs, 'parts': dict()}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Body: bytes, Bucket: str, Key: str, UploadId: str, PartNumber: int, **kwargs) -> dict:
+        with self._lock:
+            self.uploads[UploadId]['parts'][PartNumber] = bytes(Body)
+        return {'ETag': f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict) -> dict:
+        with self._lock:
+            upload = self.uploads.pop(UploadId)
+        body = b''.join(upload['parts'][p['PartNumber']] for p in MultipartUpload['Parts'])
+        return self.put_object(Body=body, Bucket=Bucket, Key=Key, **upload['kwargs'])
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str) -> dict:
+        with self._lock:
+            self.uploads.pop(UploadId, None)
+        return {}
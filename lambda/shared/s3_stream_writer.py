@@ -0,0 +1,114 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# S3 requires at least 5 MiB for every part but the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+class S3StreamWriter():
+    """File-like text writer that uploads to S3 while it is written.
+
+    Encoded text is collected in a buffer and every full part_size chunk is sent as a part of a
+    multipart upload, so the whole object never exists as one string or bytes copy. Objects
+    smaller than one part are written with a single put_object on close. Usable as target for
+    csv.writer:
+
+        with S3StreamWriter(s3_client, bucket, key) as f:
+            csv.writer(f).writerows(rows)
+    """
+
+    def __init__(self,
+                 s3_client,
+                 bucket: str,
+                 key: str,
+                 part_size: int = DEFAULT_PART_SIZE,
+                 encoding: str = 'UTF-8',
+                 **put_kwargs):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.encoding = encoding
+        self.put_kwargs = put_kwargs
+        self.buffer = bytearray()
+        self.upload_id: Optional[str] = None
+        self.parts: List[dict] = list()
+        self.bytes_written = 0
+        self.closed = False
+
+    def write(self, text: str) -> int:
+        self.write_bytes(text.encode(self.encoding))
+        return len(text)
+
+    def write_bytes(self, data: bytes):
+        # already encoded content, e.g. the bytes of other objects that are concatenated
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def _upload_part(self, data: bytes):
+        if not self.upload_id:
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self.put_kwargs)
+            self.upload_id = response['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(Body=data,
+                                              Bucket=self.bucket,
+                                              Key=self.key,
+                                              UploadId=self.upload_id,
+                                              PartNumber=part_number)
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if not self.upload_id:
+                self.s3_client.put_object(Body=bytes(self.buffer), Bucket=self.bucket, Key=self.key,
+                                          **self.put_kwargs)
+            else:
+                if self.buffer:
+                    self._upload_part(bytes(self.buffer))
+                self.s3_client.complete_multipart_upload(Bucket=self.bucket,
+                                                         Key=self.key,
+                                                         UploadId=self.upload_id,
+                                                         MultipartUpload={'Parts': self.parts})
+        except Exception:
+            # uploaded parts of an incomplete multipart upload are stored (and billed) until aborted
+            self.abort()
+            raise
+        self.buffer = bytearray()
+        logger.debug(f"s3://{self.bucket}/{self.key}: {self.bytes_written} bytes in {max(len(self.parts), 1)} part(s)")
+
+    def abort(self):
+        # drops the parts uploaded so far, nothing is written to the key
+        self.closed = True
+        self.buffer = bytearray()
+        if self.upload_id:
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            except Exception as e:
+                # the error that made us abort is the one to raise
+                logger.warning(f"abort_multipart_upload failed for s3://{self.bucket}/{self.key}: {e}")
+            self.upload_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
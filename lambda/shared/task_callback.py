@@ -0,0 +1,54 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+from typing import Optional
+
+
+class TaskFailed(Exception):
+    pass
+
+
+def task_failed(error: str, cause: str = "") -> TaskFailed:
+    """TaskFailed subclass named after error, Step Functions takes the class name as the error name."""
+    return type(error, (TaskFailed, ), {})(cause)
+
+
+class RequestResponseCallback():
+    """Takes the place of the Step Functions client of a WAIT_FOR_TASK_TOKEN handler that is invoked
+    without a Token, request-response from an Express workflow, which has no task tokens.
+
+    The handler reports through send_task_success/send_task_failure as usual, result() then returns
+    the output or raises the failure as an exception named after the error, so Retry and Catch of the
+    invoking task match the same error names as with the callback.
+    """
+
+    def __init__(self, step_functions_client):
+        self.exceptions = step_functions_client.exceptions
+        self.output: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.cause = ""
+
+    def send_task_success(self, taskToken: Optional[str], output: str) -> dict:
+        self.output = json.loads(output)
+        return {}
+
+    def send_task_failure(self, taskToken: Optional[str], error: str = "", cause: str = "") -> dict:
+        self.error = str(error) or TaskFailed.__name__
+        self.cause = cause
+        return {}
+
+    def result(self) -> dict:
+        if self.error is not None:
+            raise task_failed(self.error, self.cause)
+        if self.output is None:
+            raise TaskFailed("handler reported neither success nor failure")
+        return self.output
+
+
+def task_callback(step_functions_client, event: dict):
+    """(client the handler reports to, token), RequestResponseCallback for an event without Token."""
+    token = event.get('Token')
+    if token:
+        return step_functions_client, token
+    return RequestResponseCallback(step_functions_client), None
@@ -0,0 +1,74 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# NONE starts every event, MEMORY only suppresses duplicates delivered to the same warm container,
+# DYNAMODB suppresses them across all containers
+DEDUP_STORES = ("NONE", "MEMORY", "DYNAMODB")
+
+
+def dedup_key(s3_bucket: str, s3_key: str, etag: Optional[str]) -> Optional[str]:
+    """bucket/key#ETag, None without ETag, an overwritten object has a new ETag and is started again"""
+    if not etag:
+        return None
+    return f"{s3_bucket}/{s3_key}#{etag.strip(chr(34))}"
+
+
+class InMemoryDedupStore():
+    """Keys claimed within the last window_s seconds, at most max_entries (oldest dropped first)."""
+
+    def __init__(self, window_s: float = 3600, max_entries: int = 100000):
+        self.window_s = window_s
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()  # key -> expires_at
+        self._lock = threading.Lock()
+
+    def claim(self, key: str) -> bool:
+        """True for the first claim of key within the window, False for a duplicate."""
+        now = time.time()
+        with self._lock:
+            expires_at = self.entries.get(key)
+            if expires_at is not None and expires_at >= now:
+                return False
+            self.entries[key] = now + self.window_s
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+
+    def release(self, key: str):
+        with self._lock:
+            self.entries.pop(key, None)
+
+
+class DynamoDBDedupStore():
+    """One item per claimed key (partition key DEDUP_KEY), written with a conditional put so only one
+    of concurrent claims succeeds. EXPIRES_AT can be used as TTL attribute, expired items which are not
+    deleted yet can be claimed again."""
+
+    def __init__(self, table, window_s: float = 3600):
+        self.table = table
+        self.window_s = window_s
+
+    def claim(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        now = int(time.time())
+        try:
+            self.table.put_item(Item={'DEDUP_KEY': key, 'EXPIRES_AT': now + int(self.window_s)},
+                                ConditionExpression="attribute_not_exists(DEDUP_KEY) OR EXPIRES_AT < :now",
+                                ExpressionAttributeValues={':now': now})
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    def release(self, key: str):
+        self.table.delete_item(Key={'DEDUP_KEY': key})
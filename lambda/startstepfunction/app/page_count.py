@@ -0,0 +1,70 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import re
+import struct
+from typing import Optional
+
+from s3_io import get_bytes
+
+# page objects of a PDF, /Type /Pages (the page tree nodes) does not match
+PDF_PAGE_PATTERN = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+# compressed object streams (PDF 1.5+) can hold page objects the pattern does not see
+PDF_OBJECT_STREAM_PATTERN = re.compile(rb"/Type\s*/ObjStm(?![A-Za-z])")
+SINGLE_PAGE_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+PDF_EXTENSIONS = (".pdf", )
+TIFF_EXTENSIONS = (".tif", ".tiff")
+
+
+def count_pdf_pages(data: bytes) -> Optional[int]:
+    """Number of page objects, None when the count is not exact.
+
+    A file with object streams is not counted, e.g. an incrementally updated PDF whose added pages
+    are compressed. Page objects that an incremental update replaced or removed stay in the file,
+    so without object streams the count can only be too high, never too low.
+    """
+    if not data.startswith(b"%PDF") or PDF_OBJECT_STREAM_PATTERN.search(data):
+        return None
+    return len(PDF_PAGE_PATTERN.findall(data)) or None
+
+
+def count_tiff_pages(data: bytes) -> Optional[int]:
+    """Number of image file directories in the chain of a TIFF, None if it is not a valid one."""
+    if data[:4] == b"II*\x00":
+        endian = "<"
+    elif data[:4] == b"MM\x00*":
+        endian = ">"
+    else:
+        return None
+    pages = 0
+    seen = set()
+    offset = struct.unpack(endian + "I", data[4:8])[0]
+    while offset:
+        if offset in seen or offset + 2 > len(data):
+            return None
+        seen.add(offset)
+        number_of_entries = struct.unpack(endian + "H", data[offset:offset + 2])[0]
+        next_offset_at = offset + 2 + 12 * number_of_entries
+        if next_offset_at + 4 > len(data):
+            return None
+        pages += 1
+        offset = struct.unpack(endian + "I", data[next_offset_at:next_offset_at + 4])[0]
+    return pages
+
+
+def is_single_page(s3_client, s3_bucket: str, s3_key: str, max_bytes: int) -> bool:
+    """True when the upload is known to have exactly one page: JPEG and PNG always, PDF and TIFF up to
+    max_bytes when their page objects or directories can be counted exactly. Everything else is False
+    and goes through the DocumentSplitter."""
+    extension = os.path.splitext(s3_key)[1].lower()
+    if extension in SINGLE_PAGE_IMAGE_EXTENSIONS:
+        return True
+    if extension not in PDF_EXTENSIONS + TIFF_EXTENSIONS:
+        return False
+    # one byte more than max_bytes tells larger objects apart without a HeadObject
+    data = get_bytes(s3_client, f"s3://{s3_bucket}/{s3_key}", start=0, end=max_bytes)
+    if len(data) > max_bytes:
+        return False
+    pages = count_pdf_pages(data) if extension in PDF_EXTENSIONS else count_tiff_pages(data)
+    return pages == 1
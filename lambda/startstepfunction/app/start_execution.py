@@ -1,20 +1,153 @@
 """
 kicks off Step Function executions
 """
+import hashlib
 import json
 import logging
+import mimetypes
 import os
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import unquote_plus
 import textractmanifest as tm
 from datetime import datetime, timezone
 import re
+import time
+from typing import Dict, List, Optional, Tuple
 
 import boto3
+from dedup_store import DEDUP_STORES, DynamoDBDedupStore, InMemoryDedupStore, dedup_key
+from page_count import is_single_page
+from s3_io import pooled_client
 
 logger = logging.getLogger(__name__)
 
 step_functions_client = boto3.client(service_name='stepfunctions')
+dynamodb = None
+s3 = None
 TRIGGER_TYPES = []
+EXECUTION_NAME_MAX_LENGTH = 80
+# SINGLE_PAGE starts single page uploads on the Express state machine without DocumentSplitter and Map states
+FAST_PATHS = ("NONE", "SINGLE_PAGE")
+
+# one store per DEDUP_STORE setting, kept for the lifetime of the warm container
+dedup_stores: Dict[str, object] = dict()
+
+
+def get_dynamodb():
+    # only the DYNAMODB dedup store needs the resource
+    global dynamodb
+    if dynamodb is None:
+        dynamodb = boto3.resource('dynamodb')
+    return dynamodb
+
+
+def get_s3():
+    # only FAST_PATH SINGLE_PAGE reads and copies the uploads
+    global s3
+    if s3 is None:
+        s3 = pooled_client(max_pool_connections=max(int(os.environ.get('START_WORKERS', 16)), 10))
+    return s3
+
+
+def get_dedup_store(dedup_store: str):
+    if dedup_store not in dedup_stores:
+        window_s = float(os.environ.get('DEDUP_WINDOW_S', 3600))
+        if dedup_store == "DYNAMODB":
+            dedup_stores[dedup_store] = DynamoDBDedupStore(get_dynamodb().Table(os.environ['DEDUP_TABLE']),
+                                                           window_s=window_s)
+        else:
+            max_entries = int(os.environ.get('DEDUP_MAX_ENTRIES', 100000))
+            dedup_stores[dedup_store] = InMemoryDedupStore(window_s=window_s, max_entries=max_entries)
+    return dedup_stores[dedup_store]
+
+
+def parse_record(record: dict) -> List[Tuple[str, str, Optional[str], Optional[str]]]:
+    """(bucket, key, ETag, sequencer) of the uploads in an S3 record or an SQS message, which is either
+    {"bucket": ..., "key": ..., "etag": ...} or an S3 event notification sent to the queue."""
+    event_source = record.get("eventSource")
+    if event_source == "aws:s3":
+        s3_object = record['s3']['object']
+        return [(record['s3']['bucket']['name'], unquote_plus(s3_object['key']), s3_object.get('eTag'),
+                 s3_object.get('sequencer'))]
+    elif event_source == "aws:sqs":
+        message = json.loads(record["body"])
+        if 'Records' in message:
+            return [u for r in message['Records'] for u in parse_record(r)]
+        if message.get('Event') == "s3:TestEvent":
+            return []
+        return [(message.get('bucket', ""), message.get('key', ""), message.get('etag'), message.get('sequencer'))]
+    else:
+        logger.error('unsupported event_source: {}'.format(event_source))
+        return []
+
+
+def execution_name(s3_bucket: str, s3_key: str, etag: Optional[str] = None, sequencer: Optional[str] = None) -> str:
+    # a short hash of the upload keeps the names of concurrent records with the same basename apart, the
+    # basename is shortened so timestamp and hash survive the 80 character limit of execution names
+    upload_hash = hashlib.sha256("\x00".join([s3_bucket, s3_key, etag or "", sequencer or ""]).encode()).hexdigest()[:8]
+    suffix = re.sub(r'[^A-Za-z0-9-_]', '', datetime.now(timezone.utc).isoformat()) + "-" + upload_hash
+    filename = re.sub(r'[^A-Za-z0-9-_]', '', os.path.basename(s3_key))
+    return filename[:EXECUTION_NAME_MAX_LENGTH - len(suffix)] + suffix
+
+
+def single_page_input(s3_bucket: str, s3_key: str) -> Optional[dict]:
+    """FAST_PATH SINGLE_PAGE: for a single page upload, copies it to where the DocumentSplitter puts page 1
+    and returns the page item the fast path state machine starts with, None for the standard workflow."""
+    if os.environ.get('FAST_PATH', "NONE") != "SINGLE_PAGE":
+        return None
+    max_bytes = int(os.environ.get('FAST_PATH_MAX_BYTES', 5 * 1024 * 1024))
+    if not is_single_page(get_s3(), s3_bucket, s3_key, max_bytes):
+        return None
+    s3_output_bucket = os.environ['S3_OUTPUT_BUCKET']
+    base_filename = os.path.basename(s3_key)
+    _, extension = os.path.splitext(base_filename)
+    page_key = f"{os.environ['S3_OUTPUT_PREFIX']}/{base_filename}/{datetime.now(timezone.utc).isoformat()}/1{extension}"
+    get_s3().copy_object(Bucket=s3_output_bucket, Key=page_key, CopySource={'Bucket': s3_bucket, 'Key': s3_key})
+    return {
+        "manifest": {
+            "s3Path": f"s3://{s3_output_bucket}/{page_key}"
+        },
+        "mime": mimetypes.guess_type(base_filename)[0] or "application/octet-stream",
+        "numberOfPages": 1
+    }
+
+
+def start(state_machine_arn: str, s3_bucket: str, s3_key: str, etag: Optional[str], sequencer: Optional[str],
+          dedup_store: str) -> str:
+    """Starts one execution, returns STARTED, FAST_PATH or DUPLICATE."""
+    if not (s3_bucket and s3_key):
+        raise ValueError(f"no s3_bucket: {s3_bucket} and/or s3_key: {s3_key} given.")
+    key = dedup_key(s3_bucket, s3_key, etag) if dedup_store != "NONE" else None
+    store = get_dedup_store(dedup_store) if key else None
+    if store and not store.claim(key):  # type: ignore
+        logger.info(f"duplicate event for s3://{s3_bucket}/{s3_key} ETag {etag}, not started")
+        return "DUPLICATE"
+
+    try:
+        fast_path_input = single_page_input(s3_bucket, s3_key)
+        if fast_path_input:
+            response = step_functions_client.start_execution(
+                stateMachineArn=os.environ['FAST_PATH_STATE_MACHINE_ARN'],
+                name=execution_name(s3_bucket, s3_key, etag, sequencer),
+                input=json.dumps(fast_path_input))
+        else:
+            manifest: tm.IDPManifest = tm.IDPManifest()
+            manifest.s3_path = f"s3://{s3_bucket}/{s3_key}"
+            logger.debug(f"manifest: {tm.IDPManifestSchema().dumps(manifest)}")
+            response = step_functions_client.start_execution(stateMachineArn=state_machine_arn,
+                                                             name=execution_name(s3_bucket, s3_key, etag, sequencer),
+                                                             input=tm.IDPManifestSchema().dumps(manifest))
+    except Exception:
+        # a failed start has to be retried, not suppressed as duplicate
+        if store:
+            store.release(key)  # type: ignore
+        raise
+    logger.info(response)
+    return "FAST_PATH" if fast_path_input else "STARTED"
+
+
+def start_record(state_machine_arn: str, record: dict, dedup_store: str) -> List[str]:
+    return [start(state_machine_arn, *upload, dedup_store) for upload in parse_record(record)]  # type: ignore
 
 
 def lambda_handler(event, _):
@@ -27,36 +160,40 @@ def lambda_handler(event, _):
     if not state_machine_arn:
         raise Exception("no STATE_MACHINE_ARN set")
     logger.info(f"STATE_MACHINE_ARN: {state_machine_arn}")
+    dedup_store = os.environ.get('DEDUP_STORE', "NONE")
+    if dedup_store not in DEDUP_STORES:
+        raise ValueError(f"DEDUP_STORE must be one of {DEDUP_STORES}")
+    start_workers = int(os.environ.get('START_WORKERS', 16))
+    fast_path_mode = os.environ.get('FAST_PATH', "NONE")
+    if fast_path_mode not in FAST_PATHS:
+        raise ValueError(f"FAST_PATH must be one of {FAST_PATHS}")
+    if fast_path_mode == "SINGLE_PAGE" and not os.environ.get('FAST_PATH_STATE_MACHINE_ARN'):
+        raise ValueError("FAST_PATH SINGLE_PAGE requires FAST_PATH_STATE_MACHINE_ARN")
+    logger.info(f"DEDUP_STORE: {dedup_store}, START_WORKERS: {start_workers}, FAST_PATH: {fast_path_mode}")
 
-    s3_bucket = ""
-    s3_key = ""
-
-    for record in event['Records']:
-        event_source = record["eventSource"]
-        if event_source == "aws:s3":
-            s3_bucket = record['s3']['bucket']['name']
-            s3_key = unquote_plus(record['s3']['object']['key'])
-        elif event_source == "aws:sqs":
-            message = json.loads(record["body"])
-            s3_bucket = message['bucket']
-            s3_key = message['key']
-        else:
-            logger.error('unsupported event_source: {}'.format(event_source))
-
-        filename = os.path.basename(s3_key) + datetime.now(timezone.utc).isoformat()
-
-        filename = re.sub(r'[^A-Za-z0-9-_]', '', filename)
-        filename = filename[:80]
-        if s3_bucket and s3_key:
-            manifest: tm.IDPManifest = tm.IDPManifest()
-            manifest.s3_path = f"s3://{s3_bucket}/{s3_key}"
-            logger.debug(f"manifest: {tm.IDPManifestSchema().dumps(manifest)}")
+    start_time = round(time.time() * 1000)
+    records = event['Records']
+    with ThreadPoolExecutor(max_workers=max(1, min(start_workers, len(records)))) as pool:
+        futures = [pool.submit(start_record, state_machine_arn, record, dedup_store) for record in records]
+    started, fast_path, duplicates, failed = 0, 0, 0, list()
+    for record, future in zip(records, futures):
+        try:
+            results = future.result()
+        except Exception as e:
+            logger.error(f"failed to start execution for record {record.get('messageId', '')}: {e}")
+            failed.append(record)
+            continue
+        started += results.count("STARTED")
+        fast_path += results.count("FAST_PATH")
+        duplicates += results.count("DUPLICATE")
+    call_duration = round(time.time() * 1000) - start_time
+    logger.info(f"start_execution_duration_in_ms: {call_duration}")
+    logger.info(f"start_execution_started: {started}, fast_path: {fast_path}, duplicates: {duplicates}, "
+                f"failed: {len(failed)}")
 
-            response = step_functions_client.start_execution(
-                stateMachineArn=state_machine_arn,
-                name=filename,
-                input=tm.IDPManifestSchema().dumps(manifest))
-            logger.info(response)
-        else:
-            raise ValueError(
-                f"no s3_bucket: {s3_bucket} and/or s3_key: {s3_key} given.")
+    # SQS retries only the messages listed as batchItemFailures (ReportBatchItemFailures on the event
+    # source mapping), asynchronous S3 invocations are retried as a whole, the dedup store then skips
+    # the executions that were already started
+    if any(record.get("eventSource") != "aws:sqs" for record in failed):
+        raise Exception(f"failed to start {len(failed)} of {len(records)} records")
+    return {"batchItemFailures": [{"itemIdentifier": record["messageId"]} for record in failed]}
@@ -0,0 +1,80 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrencyLimiter():
+    """AIMD limit on the number of calls in flight.
+
+    Every success adds 1/limit (about +1 per round of calls), every throttle halves the limit,
+    at most once per cooldown_s so a burst of throttles from the same round only counts once.
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 32, cooldown_s: float = 1.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.cooldown_s = cooldown_s
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.throttles = 0
+        self.last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def release(self, throttled: bool = False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                now = time.monotonic()
+                if now - self.last_decrease >= self.cooldown_s:
+                    self.limit = max(float(self.minimum), self.limit / 2)
+                    self.last_decrease = now
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+def run_adaptive(items: List,
+                 func: Callable,
+                 is_throttle: Callable[[Exception], bool],
+                 limiter: AdaptiveConcurrencyLimiter,
+                 max_attempts: int = 5,
+                 backoff_s: float = 0.5) -> List[Tuple[object, Exception]]:
+    """Calls func(item) for all items, at most limiter.limit at a time.
+
+    Throttled calls are retried up to max_attempts with exponential backoff, other errors are
+    not retried. Returns (result, None) or (None, error) per item, in the order of items.
+    """
+
+    def call(item):
+        for attempt in range(1, max_attempts + 1):
+            limiter.acquire()
+            try:
+                result = func(item)
+            except Exception as e:
+                throttled = is_throttle(e)
+                limiter.release(throttled=throttled)
+                if not throttled or attempt == max_attempts:
+                    return None, e
+                time.sleep(backoff_s * 2**(attempt - 1))
+            else:
+                limiter.release()
+                return result, None
+
+    with ThreadPoolExecutor(max_workers=limiter.maximum, thread_name_prefix='textract-batch') as executor:
+        return list(executor.map(call, items))
@@ -0,0 +1,53 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from typing import List, Optional, Set
+
+# block types only returned when the feature is requested
+FEATURE_BLOCK_TYPES = {
+    "FORMS": {"KEY_VALUE_SET"},
+    "TABLES": {"TABLE", "CELL", "MERGED_CELL", "TABLE_TITLE", "TABLE_FOOTER"},
+    "SIGNATURES": {"SIGNATURE"},
+    "QUERIES": {"QUERY", "QUERY_RESULT"},
+    "LAYOUT": {
+        "LAYOUT_TITLE", "LAYOUT_HEADER", "LAYOUT_FOOTER", "LAYOUT_SECTION_HEADER", "LAYOUT_PAGE_NUMBER",
+        "LAYOUT_LIST", "LAYOUT_FIGURE", "LAYOUT_TABLE", "LAYOUT_KEY_VALUE", "LAYOUT_TEXT"
+    },
+}
+
+
+def can_reuse(required_features: Optional[List[str]], available_features: Optional[List[str]]) -> bool:
+    """True when a stored result has every required feature; QUERIES depend on the document type
+    configuration, which is not known when the page is read for classification."""
+    required = set(required_features or [])
+    return "QUERIES" not in required and required <= set(available_features or [])
+
+
+def _dropped_block_types(features: Set[str], available_features: Set[str]) -> Set[str]:
+    dropped: Set[str] = set()
+    for feature in available_features - features:
+        dropped |= FEATURE_BLOCK_TYPES.get(feature, set())
+    # selection elements are part of FORMS and TABLES results
+    if not features & {"FORMS", "TABLES"}:
+        dropped.add("SELECTION_ELEMENT")
+    return dropped
+
+
+def filter_to_features(textract_response: dict, features: Optional[List[str]],
+                       available_features: Optional[List[str]]) -> dict:
+    """Drops the blocks of features that were read but not requested, so the result has the same
+    blocks the synchronous call with only the requested features returns."""
+    dropped = _dropped_block_types(set(features or []), set(available_features or []))
+    if not dropped:
+        return textract_response
+    blocks = [b for b in textract_response.get('Blocks', []) if b['BlockType'] not in dropped]
+    kept_ids = {b['Id'] for b in blocks}
+    for block in blocks:
+        if 'Relationships' in block:
+            block['Relationships'] = [
+                dict(r, Ids=[i for i in r.get('Ids', []) if i in kept_ids]) for r in block['Relationships']
+            ]
+            block['Relationships'] = [r for r in block['Relationships'] if r['Ids']]
+            if not block['Relationships']:
+                del block['Relationships']
+    return dict(textract_response, Blocks=blocks)
@@ -1,6 +1,7 @@
 # Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
+import hashlib
 import json
 import logging
 import os
@@ -11,16 +12,48 @@ import textractmanifest as tm
 
 from datetime import datetime
 from botocore.config import Config
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Optional, Tuple
+from adaptive_concurrency import AdaptiveConcurrencyLimiter, run_adaptive
+from rate_limiter import RATE_LIMITERS, DynamoDBWindowCounter, InMemoryTokenBucket, RateLimiter, parse_rate_limits
+from ocr_once import can_reuse, filter_to_features
+from result_encoding import OUTPUT_ENCODINGS, decode_body, encode_textract_response
+from s3_io import exists, get_bytes, pooled_client, split_s3_path_to_bucket_and_key
+from task_callback import task_callback
+from textract_async import (TEXTRACT_MODES, PollingScheduler, client_request_token, iter_pages,
+                            iter_result_responses)
+from textract_cache import (CACHE_STORES, DynamoDBCacheStore, LRUCacheStore, S3CacheStore, TextractResultCache,
+                            cache_key, document_version)
 
 
 logger = logging.getLogger(__name__)
 __version__ = "0.0.1"
-s3 = boto3.client('s3')
+# upper bound of the AIMD concurrency in batch mode, the connection pools are sized to match
+batch_max_workers = int(os.environ.get('BATCH_MAX_CONCURRENCY', 16))
+s3 = pooled_client(max_pool_connections=max(batch_max_workers, 10))
 step_functions_client = boto3.client(service_name='stepfunctions')
 
-config = Config(retries={'max_attempts': 0, 'mode': 'standard'})
+config = Config(retries={'max_attempts': 0, 'mode': 'standard'}, max_pool_connections=max(batch_max_workers, 10))
 textract = boto3.client("textract", config=config)
+dynamodb = None
+
+TEXTRACT_ERRORS = ('InvalidS3ObjectException', 'InvalidParameterException', 'InvalidKMSKeyException',
+                   'DocumentTooLargeException', 'BadDocumentException', 'AccessDeniedException',
+                   'IdempotentParameterMismatchException', 'ProvisionedThroughputExceededException',
+                   'InternalServerError', 'ThrottlingException', 'LimitExceededException',
+                   'UnsupportedDocumentException')
+THROTTLING_ERRORS = ('ThrottlingException', 'ProvisionedThroughputExceededException')
+
+# the in-memory token buckets are shared by all threads of the container
+memory_token_bucket = InMemoryTokenBucket()
+
+# ASYNC mode job completion, notify(job_id) cuts the current poll interval short
+polling_scheduler = PollingScheduler(interval_s=float(os.environ.get('ASYNC_POLL_INTERVAL_S', 1)),
+                                     max_interval_s=float(os.environ.get('ASYNC_MAX_POLL_INTERVAL_S', 10)))
+
+# one cache per TEXTRACT_CACHE setting, kept for the lifetime of the warm container
+textract_caches: Dict[str, TextractResultCache] = dict()
+# one rate limiter per RATE_LIMITER setting, kept for the lifetime of the warm container
+rate_limiters: Dict[str, RateLimiter] = dict()
 
 
 def call_textract(manifest: tm.IDPManifest) -> dict:
@@ -46,15 +79,264 @@ def call_textract(manifest: tm.IDPManifest) -> dict:
             raise ValueError("QUERIES feature requested but queries_config not passed in.")
         logger.debug(f"params: {params}")
 
+        acquire_rate_limit("AnalyzeDocument")
         textract_response: dict = textract.analyze_document(**params)
 
     else:
         logger.debug(f"params: {params}")
+        acquire_rate_limit("DetectDocumentText")
         textract_response: dict = textract.detect_document_text(**params)
 
     return textract_response
 
 
+def get_dynamodb():
+    # the DynamoDB resource is only needed by the DYNAMODB rate limiter and caches, creating it on first
+    # use keeps its service model out of the init phase of every other configuration
+    global dynamodb
+    if dynamodb is None:
+        dynamodb = boto3.resource('dynamodb')
+    return dynamodb
+
+
+def get_rate_limiter() -> RateLimiter:
+    rate_limiter = os.environ.get('RATE_LIMITER', 'NONE')
+    if rate_limiter not in RATE_LIMITERS:
+        raise ValueError(f"RATE_LIMITER must be one of {RATE_LIMITERS}")
+    if rate_limiter not in rate_limiters:
+        if rate_limiter == "DYNAMODB":
+            backend = DynamoDBWindowCounter(get_dynamodb().Table(os.environ['RATE_LIMITER_TABLE']))
+        else:
+            backend = memory_token_bucket
+        rate_limiters[rate_limiter] = RateLimiter(backend,
+                                                  parse_rate_limits(os.environ.get('RATE_LIMITS')),
+                                                  max_wait_s=float(os.environ.get('RATE_LIMITER_MAX_WAIT_S', 30)))
+    return rate_limiters[rate_limiter]
+
+
+def acquire_rate_limit(api: str):
+    # waits for the shared quota instead of bouncing off the service, raises for a Step Functions retry
+    if os.environ.get('RATE_LIMITER', 'NONE') != "NONE" and not get_rate_limiter().acquire(api):
+        raise ThrottlingException(f"RateLimiter: no {api} capacity")
+
+
+def get_textract_cache(cache_store: str, s3_output_bucket: str, s3_output_prefix: str) -> TextractResultCache:
+    if cache_store not in textract_caches:
+        if cache_store == "MEMORY":
+            store = LRUCacheStore(max_entries=int(os.environ.get('TEXTRACT_CACHE_MAX_ENTRIES', 1024)))
+        elif cache_store == "S3":
+            store = S3CacheStore(s3, s3_output_bucket,
+                                 os.environ.get('TEXTRACT_CACHE_PREFIX', s3_output_prefix + "/textract-cache"))
+        else:
+            store = DynamoDBCacheStore(get_dynamodb().Table(os.environ['TEXTRACT_CACHE_TABLE']))
+        textract_caches[cache_store] = TextractResultCache(store, exists=lambda s3_path: exists(s3, s3_path))
+    return textract_caches[cache_store]
+
+
+def reuse_ocr_result(manifest: tm.IDPManifest, ocr_result: dict, s3_output_bucket: str, output_bucket_key: str,
+                     output_encoding: str) -> str:
+    """Takes the result comprehend_sync stored in OCR_ONCE mode instead of calling Textract again.
+
+    Blocks of features that were read for classification but are not configured for the
+    document type are dropped into a new object, an exact feature match is used as is.
+    """
+    if set(manifest.textract_features or []) == set(ocr_result.get('TextractFeatures') or []):
+        return ocr_result['TextractOutputJsonPath']
+    textract_response = json.loads(decode_body(get_bytes(s3, ocr_result['TextractOutputJsonPath'])))
+    textract_response = filter_to_features(textract_response, manifest.textract_features,
+                                           ocr_result.get('TextractFeatures'))
+    body, encoding_args = encode_textract_response(textract_response, output_encoding)
+    s3.put_object(Body=body, Bucket=s3_output_bucket, Key=output_bucket_key, **encoding_args)
+    return f"s3://{s3_output_bucket}/{output_bucket_key}"
+
+
+def page_version(s3_path: str) -> str:
+    # a HEAD instead of downloading the page, the bytes are only hashed when S3 returns no ETag
+    s3_bucket, s3_key = split_s3_path_to_bucket_and_key(s3_path)
+    version = document_version(s3.head_object(Bucket=s3_bucket, Key=s3_key))
+    return version or "sha256:" + hashlib.sha256(get_bytes(s3, s3_path)).hexdigest()
+
+
+def process_manifest(manifest: tm.IDPManifest,
+                     s3_output_bucket: str,
+                     s3_output_prefix: str,
+                     textract_api: str,
+                     output_encoding: str,
+                     cache_store: str,
+                     ocr_result: Optional[dict] = None) -> str:
+    """Runs Textract for one page (or takes it from the cache), stores the response and returns its s3 path.
+
+    ocr_result is the classification output of comprehend_sync in OCR_ONCE mode, reused when
+    it covers the configured features.
+    """
+    return process_manifest_response(manifest, s3_output_bucket, s3_output_prefix, textract_api, output_encoding,
+                                     cache_store, ocr_result)[0]
+
+
+def process_manifest_response(manifest: tm.IDPManifest,
+                              s3_output_bucket: str,
+                              s3_output_prefix: str,
+                              textract_api: str,
+                              output_encoding: str,
+                              cache_store: str,
+                              ocr_result: Optional[dict] = None) -> Tuple[str, Optional[dict]]:
+    """process_manifest, also returns the Textract response when Textract was called (None for results taken
+    from the cache or the OCR_ONCE result), so the process_page Lambda does not read it back."""
+    start_time = round(time.time() * 1000)
+    s3_filename, _ = os.path.splitext(os.path.basename(manifest.s3_path))
+    if ocr_result and ocr_result.get('TextractOutputJsonPath') and can_reuse(manifest.textract_features,
+                                                                            ocr_result.get('TextractFeatures')):
+        output_bucket_key = s3_output_prefix + "/" + s3_filename + datetime.utcnow(
+        ).isoformat() + "/" + s3_filename + ".json"
+        textract_output_json_path = reuse_ocr_result(manifest, ocr_result, s3_output_bucket, output_bucket_key,
+                                                     output_encoding)
+        logger.info(f"textract_sync_{textract_api}_ocr_once_reuse: 1 \n \
+            textract_sync_{textract_api}_ocr_once_duration_in_ms: {round(time.time() * 1000) - start_time}")
+        return textract_output_json_path, None
+    textract_output_json_path = None
+    textract_response: Optional[dict] = None
+    if cache_store != "NONE":
+        textract_cache = get_textract_cache(cache_store, s3_output_bucket, s3_output_prefix)
+        key = cache_key(page_version(manifest.s3_path), manifest.textract_features, manifest.queries_config)
+        textract_output_json_path = textract_cache.get(key)
+        logger.info(f"textract_sync_{textract_api}_cache_{'hit' if textract_output_json_path else 'miss'}: 1 \n \
+            textract_sync_{textract_api}_cache_hit_ratio: {textract_cache.hit_ratio:.3f} \n \
+            textract_sync_{textract_api}_cache_lookup_duration_in_ms: {round(time.time() * 1000) - start_time}")
+
+    if not textract_output_json_path:
+        textract_response = call_textract(manifest)
+
+        call_duration = round(time.time() * 1000) - start_time
+        logger.info(
+            f"textract_sync_{textract_api}_call_duration_in_ms: {call_duration}"
+        )
+        output_bucket_key = s3_output_prefix + "/" + s3_filename + datetime.utcnow(
+        ).isoformat() + "/" + s3_filename + ".json"
+        body, encoding_args = encode_textract_response(textract_response, output_encoding)
+        s3.put_object(Body=body,
+                      Bucket=s3_output_bucket,
+                      Key=output_bucket_key,
+                      **encoding_args)
+        textract_output_json_path = f"s3://{s3_output_bucket}/{output_bucket_key}"
+        if cache_store != "NONE":
+            textract_cache.put(key, textract_output_json_path)  # type: ignore
+    return textract_output_json_path, textract_response
+
+
+def textract_error_name(e: Exception) -> str:
+    if isinstance(e, ThrottlingException):
+        return 'ThrottlingException'
+    for name in TEXTRACT_ERRORS:
+        if isinstance(e, getattr(textract.exceptions, name)):
+            return name
+    return "not_handled_exception"
+
+
+def process_batch(pages: List[dict], s3_output_bucket: str, s3_output_prefix: str, textract_api: str,
+                  output_encoding: str, cache_store: str) -> List[dict]:
+    """Processes the page manifests on a worker pool with AIMD concurrency.
+
+    Returns one entry per page, in the order of pages, with either TextractOutputJsonPath or
+    Error and Cause.
+    """
+    limiter = AdaptiveConcurrencyLimiter(initial=int(os.environ.get('BATCH_INITIAL_CONCURRENCY', 4)),
+                                         maximum=batch_max_workers)
+    start_time = round(time.time() * 1000)
+
+    def process(page: dict) -> str:
+        manifest: tm.IDPManifest = tm.IDPManifestSchema().load(page['manifest'])  # type: ignore
+        return process_manifest(manifest, s3_output_bucket, s3_output_prefix, textract_api, output_encoding,
+                                cache_store, page.get('classification'))
+
+    results = run_adaptive(pages,
+                           process,
+                           is_throttle=lambda e: textract_error_name(e) in THROTTLING_ERRORS,
+                           limiter=limiter,
+                           max_attempts=int(os.environ.get('BATCH_MAX_ATTEMPTS', 5)))
+    page_results: List[dict] = list()
+    for page, (textract_output_json_path, error) in zip(pages, results):
+        if error:
+            logger.error(f"{page['manifest'].get('s3_path')}: {error}")
+            page_results.append({
+                "s3_path": page['manifest'].get('s3_path'),
+                "Error": textract_error_name(error),
+                "Cause": str(error)[:250]
+            })
+        else:
+            page_results.append({
+                "s3_path": page['manifest'].get('s3_path'),
+                "TextractOutputJsonPath": textract_output_json_path
+            })
+    number_of_failures = len([r for r in page_results if "Error" in r])
+    logger.info(f"textract_sync_{textract_api}_batch_number_of_pages_processed: {len(pages) - number_of_failures} \n \
+        textract_sync_{textract_api}_batch_number_of_pages_failed: {number_of_failures} \n \
+        textract_sync_{textract_api}_batch_duration_in_ms: {round(time.time() * 1000) - start_time} \n \
+        textract_sync_{textract_api}_batch_max_concurrency: {limiter.max_in_flight} \n \
+        textract_sync_{textract_api}_batch_throttles: {limiter.throttles}")
+    return page_results
+
+
+def start_textract_job(manifest: tm.IDPManifest, request_token: str) -> Tuple[str, Callable[..., dict]]:
+    """Submits the multi-page document, returns the JobId and the matching Get* API."""
+    s3_bucket, s3_key = split_s3_path_to_bucket_and_key(manifest.s3_path)
+    params = {
+        "DocumentLocation": {
+            'S3Object': {
+                'Bucket': s3_bucket,
+                'Name': s3_key
+            }
+        },
+        "ClientRequestToken": request_token
+    }
+    if manifest.textract_features:
+        if "QUERIES" in manifest.textract_features and not manifest.queries_config:
+            raise ValueError("QUERIES feature requested but queries_config not passed in.")
+        if manifest.queries_config:
+            params["QueriesConfig"] = convert_manifest_queries_config_to_caller(manifest.queries_config)
+        params["FeatureTypes"] = manifest.textract_features
+        logger.debug(f"params: {params}")
+        return textract.start_document_analysis(**params)['JobId'], textract.get_document_analysis
+    logger.debug(f"params: {params}")
+    return textract.start_document_text_detection(**params)['JobId'], textract.get_document_text_detection
+
+
+def process_async(manifest: tm.IDPManifest, execution_id: str, s3_output_bucket: str, s3_output_prefix: str,
+                  textract_api: str, output_encoding: str, deadline: float) -> dict:
+    """Runs the whole document as one asynchronous job and writes one Textract result object per page.
+
+    Raises TextractJobInProgress when the job is not done before deadline; the retried invocation
+    gets the same JobId through the ClientRequestToken and continues polling. The CDK state machine
+    does not use this mode, see README "Asynchronous Textract for Multi-Page Documents".
+    """
+    start_time = round(time.time() * 1000)
+    job_id, get_results = start_textract_job(manifest, client_request_token(execution_id, manifest.s3_path))
+    logger.info(f"textract_async JobId: {job_id}")
+    status = polling_scheduler.wait(job_id, lambda: get_results(JobId=job_id, MaxResults=1)['JobStatus'], deadline)
+    if status == "IN_PROGRESS":
+        raise TextractJobInProgress(f"JobId {job_id} still IN_PROGRESS")
+    if status == "FAILED":
+        status_message = get_results(JobId=job_id, MaxResults=1).get('StatusMessage', '')
+        raise TextractJobFailed(f"JobId {job_id} FAILED: {status_message}")
+    if status == "PARTIAL_SUCCESS":
+        logger.warning(f"JobId {job_id} PARTIAL_SUCCESS, some pages have no results")
+    logger.info(f"textract_async_{textract_api}_job_duration_in_ms: {round(time.time() * 1000) - start_time}")
+
+    s3_filename, _ = os.path.splitext(os.path.basename(manifest.s3_path))
+    output_prefix = s3_output_prefix + "/" + s3_filename + datetime.utcnow().isoformat()
+    pages: List[dict] = list()
+    responses = iter_result_responses(get_results,
+                                      job_id,
+                                      is_throttle=lambda e: textract_error_name(e) in THROTTLING_ERRORS)
+    for page_number, page_response in iter_pages(responses):
+        output_bucket_key = f"{output_prefix}/{page_number}.json"
+        body, encoding_args = encode_textract_response(page_response, output_encoding)
+        s3.put_object(Body=body, Bucket=s3_output_bucket, Key=output_bucket_key, **encoding_args)
+        pages.append({"page": page_number, "TextractOutputJsonPath": f"s3://{s3_output_bucket}/{output_bucket_key}"})
+    logger.info(f"textract_async_{textract_api}_number_of_pages_processed: {len(pages)} \n \
+        textract_async_{textract_api}_duration_in_ms: {round(time.time() * 1000) - start_time}")
+    return {"JobId": job_id, "JobStatus": status, "Pages": pages}
+
+
 def convert_manifest_queries_config_to_caller(queries_config: tm.IDPManifest.queries_config) \
         -> Dict[str, List[Dict[str, str]]]:
     queries: Dict[str, List[Dict[str, str]]] = {'Queries': []}
@@ -66,16 +348,6 @@ def convert_manifest_queries_config_to_caller(queries_config: tm.IDPManifest.que
     return queries
 
 
-def split_s3_path_to_bucket_and_key(s3_path: str) -> Tuple[str, str]:
-    if len(s3_path) > 7 and s3_path.lower().startswith("s3://"):
-        s3_bucket, s3_key = s3_path.replace("s3://", "").split("/", 1)
-        return s3_bucket, s3_key
-    else:
-        raise ValueError(
-            f"s3_path: {s3_path} is no s3_path in the form of s3://bucket/key."
-        )
-
-
 class LimitExceededException(Exception):
     pass
 
@@ -92,7 +364,24 @@ class ProvisionedThroughputExceededException(Exception):
     pass
 
 
-def lambda_handler(event, _):
+class TextractJobInProgress(Exception):
+    pass
+
+
+class TextractJobFailed(Exception):
+    pass
+
+
+# the errors the state machine retries, raised from the Lambda instead of failing the task
+RETRYABLE_EXCEPTIONS = {
+    'LimitExceededException': LimitExceededException,
+    'ThrottlingException': ThrottlingException,
+    'InternalServerError': InternalServerError,
+    'ProvisionedThroughputExceededException': ProvisionedThroughputExceededException,
+}
+
+
+def process_event(event, context, callback, token):
     log_level = os.environ.get('LOG_LEVEL', 'DEBUG')
     logger.setLevel(log_level)
     logger.info(json.dumps(event))
@@ -104,22 +393,76 @@ def lambda_handler(event, _):
     s3_output_bucket = os.environ.get('S3_OUTPUT_BUCKET')
     s3_output_prefix = os.environ.get('S3_OUTPUT_PREFIX')
     textract_api = os.environ.get('TEXTRACT_API', 'GENERIC')
+    output_encoding = os.environ.get('OUTPUT_ENCODING', 'JSON_INDENT')
+    cache_store = os.environ.get('TEXTRACT_CACHE', 'NONE')
+    textract_mode = os.environ.get('TEXTRACT_MODE', 'SYNC')
 
     if not s3_output_bucket or not s3_output_prefix:
         raise ValueError(
             f"no s3_output_bucket: {s3_output_bucket} or s3_output_prefix: {s3_output_prefix} defined."
         )
+    if output_encoding not in OUTPUT_ENCODINGS:
+        raise ValueError(f"OUTPUT_ENCODING must be one of {OUTPUT_ENCODINGS}")
+    if cache_store not in CACHE_STORES:
+        raise ValueError(f"TEXTRACT_CACHE must be one of {CACHE_STORES}")
+    if cache_store == "DYNAMODB" and not os.environ.get('TEXTRACT_CACHE_TABLE'):
+        raise ValueError("TEXTRACT_CACHE DYNAMODB requires TEXTRACT_CACHE_TABLE")
+    if textract_mode not in TEXTRACT_MODES:
+        raise ValueError(f"TEXTRACT_MODE must be one of {TEXTRACT_MODES}")
     logger.debug(f"LOG_LEVEL: {log_level} \n \
                 S3_OUTPUT_BUCKET: {s3_output_bucket} \n \
                 S3_OUTPUT_PREFIX: {s3_output_prefix} \n \
-                TEXTRACT_API: {textract_api} \n  ")
+                TEXTRACT_API: {textract_api} \n \
+                OUTPUT_ENCODING: {output_encoding} \n \
+                TEXTRACT_CACHE: {cache_store} \n \
+                TEXTRACT_MODE: {textract_mode} \n  ")
 
-    token = event['Token']
     execution_id = event['ExecutionId']
 
     if "Payload" not in event:
         raise ValueError("Need Payload with manifest to process message.")
 
+    if textract_mode == "ASYNC":
+        # the manifest points to the original multi-page document, no DocumentSplitter needed
+        manifest: tm.IDPManifest = tm.IDPManifestSchema().load(event["Payload"]['manifest'])  # type: ignore
+        # stop polling early enough to write the results before the Lambda times out
+        remaining_s = context.get_remaining_time_in_millis() / 1000 if context else float(
+            os.environ.get('ASYNC_MAX_WAIT_S', 240))
+        deadline = time.monotonic() + remaining_s - float(os.environ.get('ASYNC_RESULT_WRITE_MARGIN_S', 60))
+        try:
+            output = process_async(manifest, execution_id, s3_output_bucket, s3_output_prefix, textract_api,
+                                   output_encoding, deadline)
+        except TextractJobInProgress:
+            logger.info(f"job for {manifest.s3_path} still in progress, raising TextractJobInProgress for a retry")
+            raise
+        except Exception as e:
+            name = textract_error_name(e)
+            if name in RETRYABLE_EXCEPTIONS:
+                logger.warning(f"textract.exceptions.{name}")
+                raise RETRYABLE_EXCEPTIONS[name](name)
+            error = "TextractJobFailed" if isinstance(e, TextractJobFailed) else name
+            logger.error(e)
+            callback.send_task_failure(taskToken=token, error=error, cause=str(e)[:250])
+            return
+        callback.send_task_success(taskToken=token, output=json.dumps(output))
+        return
+
+    if 'pages' in event["Payload"]:
+        # batch mode: Payload.pages is a list of {"manifest": {...}}, every page is reported individually
+        try:
+            page_results = process_batch(event["Payload"]['pages'], s3_output_bucket, s3_output_prefix,
+                                         textract_api, output_encoding, cache_store)
+            if page_results and all("Error" in r for r in page_results):
+                callback.send_task_failure(taskToken=token,
+                                           error="AllPagesFailed",
+                                           cause=json.dumps(page_results)[:250])
+            else:
+                callback.send_task_success(taskToken=token, output=json.dumps({"Pages": page_results}))
+        except Exception as e:
+            logger.error(e)
+            callback.send_task_failure(taskToken=token, error="not_handled_exception", cause=str(e)[:250])
+        return
+
     manifest: tm.IDPManifest = tm.IDPManifestSchema().load(
         event["Payload"]['manifest'])  # type: ignore
 
@@ -129,14 +472,14 @@ def lambda_handler(event, _):
 
     if number_of_pages > 1:
         logger.error("more than 1 page")
-        step_functions_client.send_task_failure(
+        callback.send_task_failure(
             taskToken=token,
             error='TooManyPagesForSync',
             cause=f'Document with > 1 page was sent to a Sync Textract API endpoint (number pages: {number_of_pages}'
         )
+        return
 
     try:
-        start_time = round(time.time() * 1000)
         logger.info(
             f"textract_sync_{textract_api}_number_of_pages_send_to_process: {number_of_pages}"
         )
@@ -144,41 +487,30 @@ def lambda_handler(event, _):
         logger.info(f"s3_path: {manifest.s3_path} \n \
                     token: {token} \n \
                     execution_id: {execution_id}")
-        s3_filename, _ = os.path.splitext(os.path.basename(manifest.s3_path))
         logger.debug(f"before call_textract\n \
             input_document: {manifest.s3_path} \n \
             features: {manifest.textract_features}\n \
             queries_config: {manifest.queries_config}")
 
-        textract_response: dict = call_textract(manifest)
-
-        call_duration = round(time.time() * 1000) - start_time
-        logger.info(
-            f"textract_sync_{textract_api}_call_duration_in_ms: {call_duration}"
-        )
-        output_bucket_key = s3_output_prefix + "/" + s3_filename + datetime.utcnow(
-        ).isoformat() + "/" + s3_filename + ".json"
-        s3.put_object(Body=bytes(
-            json.dumps(textract_response, indent=4).encode('UTF-8')),
-                      Bucket=s3_output_bucket,
-                      Key=output_bucket_key)
+        textract_output_json_path = process_manifest(manifest, s3_output_bucket, s3_output_prefix, textract_api,
+                                                     output_encoding, cache_store,
+                                                     event["Payload"].get('classification'))
         logger.info(
             f"textract_sync_{textract_api}_number_of_pages_processed: {number_of_pages}"
         )
         try:
-            step_functions_client.send_task_success(
+            callback.send_task_success(
                 taskToken=token,
                 output=json.dumps({
-                    "TextractOutputJsonPath":
-                    f"s3://{s3_output_bucket}/{output_bucket_key}"
+                    "TextractOutputJsonPath": textract_output_json_path
                 }))
-        except step_functions_client.exceptions.InvalidToken:
+        except callback.exceptions.InvalidToken:
             logger.error(f"InvalidToken for message: {event} ")
-        except step_functions_client.exceptions.TaskDoesNotExist:
+        except callback.exceptions.TaskDoesNotExist:
             logger.error(f"TaskDoesNotExist for message: {event} ")
-        except step_functions_client.exceptions.TaskTimedOut:
+        except callback.exceptions.TaskTimedOut:
             logger.error(f"TaskTimedOut for message: {event} ")
-        except step_functions_client.exceptions.InvalidOutput:
+        except callback.exceptions.InvalidOutput:
             # Not sure if to delete here or not, could be a bug in the code that a hot fix could solve,
             # but don't want to retry infinite, which can cause run-away-cost. For now, delete
             logger.error(f"InvalidOutput for message: {event} ")
@@ -187,53 +519,53 @@ def lambda_handler(event, _):
         cause = f"InvalidS3ObjectException for object: {manifest}"
         error = "InvalidS3ObjectException"
         logger.error(cause)
-        step_functions_client.send_task_failure(taskToken=token,
-                                                error=error,
-                                                cause=cause[:250])
+        callback.send_task_failure(taskToken=token,
+                                   error=error,
+                                   cause=cause[:250])
     except textract.exceptions.InvalidParameterException:
         error = f"InvalidParameterException"
         cause = f"textract.exceptions.InvalidParameterException: for manifest: {manifest}"
         logger.error(cause)
-        step_functions_client.send_task_failure(taskToken=token,
-                                                error=error,
-                                                cause=cause[:250])
+        callback.send_task_failure(taskToken=token,
+                                   error=error,
+                                   cause=cause[:250])
     except textract.exceptions.InvalidKMSKeyException:
         cause = f"textract.exceptions.InvalidKMSKeyException: for manifest: {manifest}"
         logger.error(cause)
         error = f"UnsupportedDocumentException",
         cause = f"textract.exceptions.UnsupportedDocumentException: for manifest: {manifest}"
         logger.error(cause)
-        step_functions_client.send_task_failure(taskToken=token,
-                                                error=error,
-                                                cause=cause[:250])
+        callback.send_task_failure(taskToken=token,
+                                   error=error,
+                                   cause=cause[:250])
     except textract.exceptions.DocumentTooLargeException:
         error = "DocumentTooLargeException"
         cause = f"textract.exceptions.DocumentTooLargeException: for manifest: {manifest}"
         logger.error(cause)
-        step_functions_client.send_task_failure(taskToken=token,
-                                                error=error,
-                                                cause=cause[:250])
+        callback.send_task_failure(taskToken=token,
+                                   error=error,
+                                   cause=cause[:250])
     except textract.exceptions.BadDocumentException:
         error = "BadDocumentException"
         cause = f"textract.exceptions.BadDocumentException: for manifest: {manifest}"
         logger.error(cause)
-        step_functions_client.send_task_failure(taskToken=token,
-                                                error=error,
-                                                cause=cause[:250])
+        callback.send_task_failure(taskToken=token,
+                                   error=error,
+                                   cause=cause[:250])
     except textract.exceptions.AccessDeniedException:
         error = "AccessDeniedException"
         cause = f"textract.exceptions.AccessDeniedException: for manifest: {manifest}"
         logger.error(cause)
-        step_functions_client.send_task_failure(taskToken=token,
-                                                error=error,
-                                                cause=cause[:250])
+        callback.send_task_failure(taskToken=token,
+                                   error=error,
+                                   cause=cause[:250])
     except textract.exceptions.IdempotentParameterMismatchException:
         error = "IdempotentParameterMismatchException"
         cause = f"textract.exceptions.IdempotentParameterMismatchException: for manifest: {manifest}"
         logger.error(cause)
-        step_functions_client.send_task_failure(taskToken=token,
-                                                error=error,
-                                                cause=cause[:250])
+        callback.send_task_failure(taskToken=token,
+                                   error=error,
+                                   cause=cause[:250])
     # these Exceptions we can retry, so we put them back on the queue
     except textract.exceptions.ProvisionedThroughputExceededException:
         logger.warning(
@@ -249,18 +581,28 @@ def lambda_handler(event, _):
     except textract.exceptions.LimitExceededException:
         logger.warning(f"textract.exceptions.LimitExceededException")
         raise LimitExceededException('LimitExceededException')
+    except ThrottlingException:
+        logger.warning("rate limiter ThrottlingException")
+        raise
     except Exception as e:
         error = "not_handled_exception"
         cause = str(e)
         try:
-            step_functions_client.send_task_failure(taskToken=token,
-                                                    error=error,
-                                                    cause=cause[:250])
-        except step_functions_client.exceptions.InvalidToken:
+            callback.send_task_failure(taskToken=token,
+                                       error=error,
+                                       cause=cause[:250])
+        except callback.exceptions.InvalidToken:
             logger.error(f"InvalidToken for message: {event} ")
-        except step_functions_client.exceptions.TaskDoesNotExist:
+        except callback.exceptions.TaskDoesNotExist:
             logger.error(f"TaskDoesNotExist for message: {event} ")
-        except step_functions_client.exceptions.TaskTimedOut:
+        except callback.exceptions.TaskTimedOut:
             logger.error(f"TaskTimedOut for message: {event} ")
             logger.error(cause)
             logger.error(e)
+
+
+def lambda_handler(event, context):
+    # without Token (request-response, e.g. from an Express workflow) the result is returned instead of sent
+    callback, token = task_callback(step_functions_client, event)
+    process_event(event, context, callback, token)
+    return None if token else callback.result()
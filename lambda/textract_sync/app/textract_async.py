@@ -0,0 +1,121 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import logging
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# SYNC calls AnalyzeDocument/DetectDocumentText per split page, ASYNC submits the whole document
+# with StartDocumentAnalysis/StartDocumentTextDetection and writes one result object per page
+TEXTRACT_MODES = ("SYNC", "ASYNC")
+
+JOB_DONE_STATUSES = ("SUCCEEDED", "FAILED", "PARTIAL_SUCCESS")
+
+
+def client_request_token(*parts: str) -> str:
+    # same token for the same execution and document, so a retried invocation gets the already started job
+    return hashlib.sha256("\x00".join(parts).encode('UTF-8')).hexdigest()
+
+
+class PollingScheduler():
+    """Polls get_status() with growing intervals until the job is done or the deadline passed.
+
+    on_complete is the hook for a notification channel: a notification handler (e.g. a subscriber
+    of a Textract NotificationChannel topic, which the CDK stack does not create, or the stand-in in
+    localpipeline) calls notify(job_id) and the waiting poll is cut short instead of sleeping the
+    full interval.
+    """
+
+    def __init__(self, interval_s: float = 1.0, max_interval_s: float = 10.0, backoff_rate: float = 1.5):
+        self.interval_s = interval_s
+        self.max_interval_s = max_interval_s
+        self.backoff_rate = backoff_rate
+        self.notified: Dict[str, bool] = dict()
+
+    def notify(self, job_id: str):
+        self.notified[job_id] = True
+
+    def _sleep(self, job_id: str, seconds: float):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end and not self.notified.get(job_id):
+            time.sleep(min(0.05, seconds))
+
+    def wait(self, job_id: str, get_status: Callable[[], str], deadline: float) -> str:
+        """Returns the final JobStatus, or IN_PROGRESS when time.monotonic() reached deadline first."""
+        interval = self.interval_s
+        polls = 0
+        while True:
+            status = get_status()
+            polls += 1
+            if status in JOB_DONE_STATUSES:
+                logger.info(f"textract_async_job_polls: {polls}")
+                return status
+            if time.monotonic() + interval > deadline:
+                return status
+            self._sleep(job_id, interval)
+            interval = min(self.max_interval_s, interval * self.backoff_rate)
+
+
+def iter_result_responses(get_results: Callable[..., dict],
+                          job_id: str,
+                          is_throttle: Callable[[Exception], bool] = lambda _: False,
+                          max_attempts: int = 5,
+                          backoff_s: float = 0.5) -> Iterator[dict]:
+    """Yields the GetDocumentAnalysis/GetDocumentTextDetection responses following NextToken."""
+    next_token: Optional[str] = None
+    while True:
+        params = {'JobId': job_id, 'MaxResults': 1000}
+        if next_token:
+            params['NextToken'] = next_token
+        for attempt in range(1, max_attempts + 1):
+            try:
+                response = get_results(**params)
+                break
+            except Exception as e:
+                if not is_throttle(e) or attempt == max_attempts:
+                    raise
+                time.sleep(backoff_s * 2**(attempt - 1))
+        yield response
+        next_token = response.get('NextToken')
+        if not next_token:
+            return
+
+
+def _page_response(page_number: int, blocks: List[dict], first_response: dict) -> dict:
+    # same shape as the response of a synchronous call on the split single page document
+    for block in blocks:
+        block['Page'] = 1
+    page_response = {'DocumentMetadata': {'Pages': 1}, 'Blocks': blocks}
+    for key in ('AnalyzeDocumentModelVersion', 'DetectDocumentTextModelVersion'):
+        if key in first_response:
+            page_response[key] = first_response[key]
+    return page_response
+
+
+def iter_pages(responses: Iterator[dict]) -> Iterator[Tuple[int, dict]]:
+    """Regroups the paginated job results into (page number, single page Textract response).
+
+    The results list the blocks in page order, so a page is complete and yielded as soon as a
+    block of a later page arrives; only one page is held in memory.
+    """
+    first_response: Optional[dict] = None
+    page_number = 0
+    blocks: List[dict] = list()
+    for response in responses:
+        if first_response is None:
+            first_response = response
+        for block in response.get('Blocks', []):
+            block_page = block.get('Page', 1)
+            if block_page < page_number:
+                raise ValueError(f"block {block.get('Id')} of page {block_page} after page {page_number}")
+            if block_page > page_number:
+                if blocks:
+                    yield page_number, _page_response(page_number, blocks, first_response)
+                page_number = block_page
+                blocks = list()
+            blocks.append(block)
+    if blocks:
+        yield page_number, _page_response(page_number, blocks, first_response)  # type: ignore
@@ -0,0 +1,149 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# NONE disables the cache, MEMORY only lives as long as the warm container,
+# S3 and DYNAMODB share the index across containers and executions
+CACHE_STORES = ("NONE", "MEMORY", "S3", "DYNAMODB")
+
+# bump to invalidate all existing entries, e.g. when the stored output layout changes
+CACHE_KEY_VERSION = "2"
+
+
+def normalize_features(textract_features: Optional[List[str]]) -> List[str]:
+    return sorted(set(textract_features or []))
+
+
+def normalize_queries(queries_config) -> List[List[str]]:
+    # queries_config is the IDPManifest list of Query(text, alias, pages)
+    return sorted([[q.text, q.alias or "", ",".join(getattr(q, 'pages', None) or [])] for q in (queries_config or [])])
+
+
+def document_version(head: dict) -> Optional[str]:
+    """ETag and size of a HeadObject response, None without ETag. The ETag of a single part upload is the MD5
+    of its bytes, so a page uploaded again gets the same version without being downloaded."""
+    etag = (head.get('ETag') or "").strip('"')
+    if not etag:
+        return None
+    return f"etag:{etag}:{head.get('ContentLength', '')}"
+
+
+def cache_key(document_version: str, textract_features: Optional[List[str]], queries_config) -> str:
+    """sha256 over the page version (document_version or a hash of the bytes) and the normalized Textract
+    configuration"""
+    configuration = json.dumps(
+        {
+            'version': CACHE_KEY_VERSION,
+            'features': normalize_features(textract_features),
+            'queries': normalize_queries(queries_config)
+        },
+        sort_keys=True,
+        separators=(',', ':'))
+    digest = hashlib.sha256(document_version.encode('UTF-8'))
+    digest.update(b'\x00')
+    digest.update(configuration.encode('UTF-8'))
+    return digest.hexdigest()
+
+
+class LRUCacheStore():
+    """cache key -> TextractOutputJsonPath, keeps the max_entries most recently used"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key: str, s3_path: str):
+        with self._lock:
+            self.entries[key] = s3_path
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class S3CacheStore():
+    """one small JSON object per cache key under s3://bucket/prefix/"""
+
+    def __init__(self, s3_client, bucket: str, prefix: str):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            o = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        return json.loads(o.get('Body').read()).get('TextractOutputJsonPath')
+
+    def put(self, key: str, s3_path: str):
+        self.s3_client.put_object(Body=json.dumps({'TextractOutputJsonPath': s3_path}).encode('UTF-8'),
+                                  Bucket=self.bucket,
+                                  Key=self._key(key),
+                                  ContentType='application/json')
+
+
+class DynamoDBCacheStore():
+    """items with the partition key CACHE_KEY in a DynamoDB table (boto3 resource Table)"""
+
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, key: str) -> Optional[str]:
+        item = self.table.get_item(Key={'CACHE_KEY': key}).get('Item')
+        return item['TextractOutputJsonPath'] if item else None
+
+    def put(self, key: str, s3_path: str):
+        self.table.put_item(Item={'CACHE_KEY': key, 'TextractOutputJsonPath': s3_path})
+
+
+class TextractResultCache():
+    """Looks up and records Textract results by cache_key().
+
+    exists(s3_path) is checked on a hit, so entries whose output object was removed (e.g. by an
+    S3 lifecycle rule) count as a miss and are overwritten by the next put().
+    hits and misses are counted for the lifetime of the container.
+    """
+
+    def __init__(self, store, exists=None):
+        self.store = store
+        self.exists = exists
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        s3_path = self.store.get(key)
+        if s3_path and self.exists and not self.exists(s3_path):
+            logger.warning(f"cached Textract output {s3_path} no longer exists")
+            s3_path = None
+        if s3_path:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return s3_path
+
+    def put(self, key: str, s3_path: str):
+        self.store.put(key, s3_path)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,92 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+offline evaluation of the comprehend_sync cascade (LOCAL_CLASSIFIER: CASCADE)
+
+Cross-validates the local classifier on comprehend_claims_dataset.csv. The labels stand in for
+the Comprehend endpoint answers (the endpoint is trained on the same dataset). Per confidence
+threshold it reports the fraction of ClassifyDocument calls avoided, the agreement of the local
+answers with the labels on those pages and the accuracy of the whole cascade, plus the local
+prediction latency.
+
+    python -m localpipeline.bench_cascade_classifier --folds 5 --thresholds 0.5,0.8,0.9,0.95
+"""
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+
+from localpipeline.handlers import LAMBDA_ROOT, load_app_module
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(LAMBDA_ROOT), 'comprehend_claims_dataset.csv')
+
+
+def cross_validate(texts: List[str], labels: List[str], folds: int) -> List[Dict]:
+    local_classifier = load_app_module('comprehend_sync', 'local_classifier')
+    # stratified: every fold gets every n-th row of each class
+    by_class: Dict[str, List[int]] = dict()
+    for row, label in enumerate(labels):
+        by_class.setdefault(label, list()).append(row)
+    fold_of = dict()
+    for rows in by_class.values():
+        for position, row in enumerate(rows):
+            fold_of[row] = position % folds
+
+    predictions: List[Dict] = list()
+    for fold in range(folds):
+        train = [row for row in range(len(texts)) if fold_of[row] != fold]
+        start_time = time.perf_counter()
+        classifier = local_classifier.LocalClassifier.train([texts[r] for r in train], [labels[r] for r in train])
+        train_ms = (time.perf_counter() - start_time) * 1000
+        for row in [row for row in range(len(texts)) if fold_of[row] == fold]:
+            start_time = time.perf_counter()
+            predicted, confidence = classifier.predict(texts[row])
+            predictions.append({
+                'label': labels[row],
+                'predicted': predicted,
+                'confidence': confidence,
+                'latency_ms': (time.perf_counter() - start_time) * 1000,
+                'train_ms': train_ms
+            })
+    return predictions
+
+
+def report(predictions: List[Dict], thresholds: List[float]) -> Dict:
+    latencies = sorted(p['latency_ms'] for p in predictions)
+    result = {
+        'pages': len(predictions),
+        'local_accuracy': round(sum(p['label'] == p['predicted'] for p in predictions) / len(predictions), 4),
+        'latency_ms_p50': round(latencies[len(latencies) // 2], 3),
+        'latency_ms_p99': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3),
+        'train_ms_per_fold': round(max(p['train_ms'] for p in predictions), 1),
+        'thresholds': list()
+    }
+    for threshold in thresholds:
+        local = [p for p in predictions if p['confidence'] >= threshold]
+        agreement = sum(p['label'] == p['predicted'] for p in local) / len(local) if local else 1.0
+        # deferred pages go to the endpoint, counted as correct
+        cascade = (sum(p['label'] == p['predicted'] for p in local) + len(predictions) - len(local)) / len(predictions)
+        result['thresholds'].append({
+            'threshold': threshold,
+            'endpoint_calls_avoided': round(len(local) / len(predictions), 4),
+            'agreement_rate': round(agreement, 4),
+            'cascade_accuracy': round(cascade, 4)
+        })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default=DEFAULT_DATASET)
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--thresholds', default='0.5,0.8,0.9,0.95,0.99')
+    args = parser.parse_args()
+    texts, labels = load_app_module('comprehend_sync', 'local_classifier').read_dataset(args.dataset)
+    predictions = cross_validate(texts, labels, args.folds)
+    print(json.dumps(report(predictions, [float(t) for t in args.thresholds.split(',')]), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+cold start profile of every lambda_handler module in localpipeline.handlers.HANDLERS
+
+Each handler module is imported in a fresh interpreter, like the init phase of a new Lambda
+container, with the DEFAULT_ENVIRONMENT of localpipeline.runner. Reported per handler: the init
+duration (module execution, including the boto3 clients created at module level), the time of each
+import the module triggers (python -X importtime, cumulative per top level package), the memory
+allocated during init per package (tracemalloc, in a second interpreter so tracing does not skew
+the timings) and the RSS growth. Modules imported by the interpreter before the handler (os, json,
+importlib, ...) are not counted, the Lambda runtime has those loaded as well.
+
+    python -m localpipeline.bench_cold_start --repeat 3 --output cold_start_report.md
+"""
+import argparse
+import json
+import os
+import resource
+import site
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from localpipeline.handlers import HANDLERS, SHARED_ROOT, load_handler_module
+
+REPORT_TOP_PACKAGES = 8
+IMPORTTIME_MARKER = "bench_cold_start: loading handler"
+
+
+def _package_of(traceback, search_paths: List[str]) -> str:
+    # top level package (or sibling module of the app directory) of the innermost frame outside the
+    # standard library, so json.loads of the botocore service models is counted for botocore
+    for frame in reversed(traceback):
+        for search_path in search_paths:
+            if frame.filename.startswith(search_path + os.sep):
+                top = os.path.relpath(frame.filename, search_path).split(os.sep)[0]
+                return top[:-3] if top.endswith('.py') else top
+    return "<stdlib>"
+
+
+def measure_child(name: str, trace_memory: bool) -> dict:
+    """Runs in the child interpreter: imports the handler module once and returns the measurements."""
+    if not trace_memory:
+        print(IMPORTTIME_MARKER, file=sys.stderr, flush=True)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start_time = time.perf_counter()
+        load_handler_module(name)
+        return {
+            'init_ms': round((time.perf_counter() - start_time) * 1000, 1),
+            'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before,
+            'modules': len(sys.modules)
+        }
+
+    import tracemalloc
+    tracemalloc.start(64)
+    module = load_handler_module(name)
+    snapshot = tracemalloc.take_snapshot()
+    traced_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    search_paths = [os.path.dirname(module.__file__), SHARED_ROOT]
+    search_paths += site.getsitepackages() + [site.getusersitepackages()]
+    package_bytes: Dict[str, int] = dict()
+    for statistic in snapshot.statistics('traceback'):
+        package = _package_of(statistic.traceback, search_paths)
+        package_bytes[package] = package_bytes.get(package, 0) + statistic.size
+    return {'traced_bytes': traced_bytes, 'peak_bytes': peak_bytes, 'package_bytes': package_bytes}
+
+
+def parse_importtime(stderr: str) -> Dict[str, float]:
+    """Cumulative import time in ms per top level package of the imports after the marker."""
+    package_ms: Dict[str, float] = dict()
+    lines = stderr.splitlines()
+    if IMPORTTIME_MARKER in lines:
+        lines = lines[lines.index(IMPORTTIME_MARKER) + 1:]
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, imported = line.split("|", 2)
+        # nested imports are indented, their time is part of the cumulative time of the top level entry
+        if not cumulative.strip().isdigit() or imported.startswith("  "):
+            continue
+        package = imported.strip().split(".")[0]
+        package_ms[package] = package_ms.get(package, 0.0) + int(cumulative) / 1000
+    return package_ms
+
+
+def _run_child(name: str, environment: Dict[str, str], trace_memory: bool) -> subprocess.CompletedProcess:
+    args = [sys.executable] + ([] if trace_memory else ['-X', 'importtime'])
+    args += ['-m', 'localpipeline.bench_cold_start', '--child', name] + (['--trace-memory'] if trace_memory else [])
+    return subprocess.run(args, env=environment, capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def profile(name: str, environment: Dict[str, str], repeat: int) -> dict:
+    """Best of repeat cold imports of one handler module plus one memory traced import."""
+    best: Optional[dict] = None
+    for _ in range(repeat):
+        completed = _run_child(name, environment, trace_memory=False)
+        if completed.returncode != 0:
+            return {'handler': name, 'error': completed.stderr.strip().splitlines()[-1]}
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result['package_ms'] = parse_importtime(completed.stderr)
+        if best is None or result['init_ms'] < best['init_ms']:
+            best = result
+    completed = _run_child(name, environment, trace_memory=True)
+    memory = json.loads(completed.stdout.strip().splitlines()[-1]) if completed.returncode == 0 else dict()
+    import_ms = sum(best['package_ms'].values())  # type: ignore
+    return dict(best, handler=name, import_ms=round(import_ms, 1),
+                other_init_ms=round(best['init_ms'] - import_ms, 1), **memory)  # type: ignore
+
+
+def _largest(values: Dict[str, float]) -> List[tuple]:
+    return sorted(values.items(), key=lambda item: item[1], reverse=True)[:REPORT_TOP_PACKAGES]
+
+
+def format_report(results: List[dict]) -> str:
+    lines = [
+        "# Cold Start Profile", "",
+        "| handler | init ms | imports ms | clients and other init ms | RSS growth MB | traced MB | modules |",
+        "|---|---:|---:|---:|---:|---:|---:|"
+    ]
+    for r in results:
+        if 'error' in r:
+            lines.append(f"| {r['handler']} | failed: {r['error']} | | | | | |")
+            continue
+        lines.append(f"| {r['handler']} | {r['init_ms']} | {r['import_ms']} | {r['other_init_ms']} | "
+                     f"{r['rss_kb'] / 1024:.1f} | {r.get('traced_bytes', 0) / 2**20:.1f} | {r['modules']} |")
+    for r in results:
+        if 'error' in r:
+            continue
+        lines += ["", f"## {r['handler']}", "", "| import | cumulative ms |", "|---|---:|"]
+        for package, ms in _largest(r['package_ms']):
+            lines.append(f"| {package} | {ms:.1f} |")
+        # allocations still held after init, by the package of the innermost non standard library frame
+        lines += ["", "| package | init memory KB |", "|---|---:|"]
+        package_bytes = r.get('package_bytes', dict())
+        for package, size in _largest(package_bytes):
+            lines.append(f"| {package} | {size / 1024:.0f} |")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('handlers', nargs='*', help=f"handlers to profile, default all of {sorted(HANDLERS)}")
+    parser.add_argument('--repeat', type=int, default=3, help="cold imports per handler, the fastest is reported")
+    parser.add_argument('--output', default='cold_start_report.md', help="markdown report file")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--trace-memory', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure_child(args.child, args.trace_memory)))
+        return
+
+    from localpipeline.runner import DEFAULT_ENVIRONMENT
+    environment = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'),
+                       **DEFAULT_ENVIRONMENT)
+    results = [profile(name, environment, args.repeat) for name in (args.handlers or HANDLERS)]
+    with open(args.output, 'w') as f:
+        f.write(format_report(results))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'handler':<28} {'init_ms':>8} {'imports_ms':>10} {'rss_mb':>7}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['handler']:<28} failed: {r['error']}")
+            continue
+        print(f"{r['handler']:<28} {r['init_ms']:>8} {r['import_ms']:>10} {r['rss_kb'] / 1024:>7.1f}")
+    print(f"report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
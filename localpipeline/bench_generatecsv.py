@@ -0,0 +1,143 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+micro-benchmarks for the hot paths of lambda/generatecsv/app/main.py
+
+Reports wall time, peak traced memory and blocks/second for the BlockStore the handler
+extracts FORMS, QUERIES, TABLES and SIGNATURES from, get_table_list and the whole
+lambda_handler (S3 and Step Functions stubbed, with PARSE_MODE DOCUMENT and STREAMING) on
+synthetic Textract responses. The trp2 path
+(TDocumentSchema().load, convert_form_to_list_trp2, convert_queries_to_list_trp2) is measured
+next to it for comparison.
+
+    python -m localpipeline.bench_generatecsv --scenario dense-200-tables --repeat 3
+"""
+import argparse
+import copy
+import json
+import os
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from localpipeline.handlers import inject_clients
+from localpipeline.stand_ins import InMemoryS3, StepFunctionsRecorder
+from localpipeline.synthetic_textract import generate_textract_response
+
+SCENARIOS: Dict[str, dict] = {
+    'baseline': dict(),
+    'forms': dict(key_values_per_page=200, tables_per_page=0, queries_per_page=0),
+    'queries': dict(key_values_per_page=0, tables_per_page=0, queries_per_page=30),
+    'signatures': dict(signatures_per_page=500),
+    'dense-50-tables': dict(tables_per_page=50),
+    'dense-200-tables': dict(tables_per_page=200),
+    'multi-page': dict(pages=20),
+}
+
+BUCKET = 'bench-bucket'
+
+
+def measure(func: Callable, setup: Callable[[], tuple], number_of_blocks: int, repeat: int) -> dict:
+    # setup runs outside of the measurement, it gives fresh arguments for functions that mutate them
+    durations: List[float] = list()
+    peak = 0
+    for _ in range(repeat):
+        args = setup()
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        func(*args)
+        durations.append(time.perf_counter() - start_time)
+        _, run_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak = max(peak, run_peak)
+    best = min(durations)
+    return {
+        'wall_ms': round(best * 1000, 2),
+        'peak_mib': round(peak / 2**20, 2),
+        'blocks_per_s': round(number_of_blocks / best) if best else 0
+    }
+
+
+def run_scenario(name: str, repeat: int) -> Dict[str, dict]:
+    main = inject_clients('generatecsv', {'s3': InMemoryS3(), 'stepfunctions': StepFunctionsRecorder()})
+    import trp.trp2 as t2
+    from textractprettyprinter.t_pretty_print import convert_form_to_list_trp2, convert_queries_to_list_trp2
+    file_json = generate_textract_response(**SCENARIOS[name])
+    number_of_blocks = len(file_json['Blocks'])
+    file_bytes = json.dumps(file_json).encode('utf-8')
+
+    trp2_doc = t2.TDocumentSchema().load(copy.deepcopy(file_json))
+    block_store = main.BlockStore.from_textract_json(file_json)
+
+    main.s3_client.put_object(Body=file_bytes, Bucket=BUCKET, Key='textract-output/1.json')
+    os.environ.update({
+        'LOG_LEVEL': 'WARNING',
+        'CSV_S3_OUTPUT_BUCKET': BUCKET,
+        'CSV_S3_OUTPUT_PREFIX': 'textract-csv-output',
+        'JOINED_S3_OUTPUT_PREFIX': 'textract-joined-output',
+        'OUTPUT_TYPE': 'CSV'
+    })
+    event = {
+        'Token': 'bench',
+        'ExecutionId': 'arn:aws:states:local:000000000000:execution:bench:bench',
+        'Payload': {
+            'textract_result': {
+                'TextractOutputJsonPath': f"s3://{BUCKET}/textract-output/1.json"
+            },
+            'classification': {
+                'documentType': 'claimform',
+                'documentTypeWithPageNum': 'claimform_page1'
+            }
+        }
+    }
+
+    def handler(parse_mode: str):
+        os.environ['PARSE_MODE'] = parse_mode
+        main.lambda_handler(copy.deepcopy(event), None)
+        status, body = main.step_functions_client.pop_result('bench')
+        if status != 'SUCCESS':
+            raise RuntimeError(body)
+
+    results = {
+        'BlockStore.from_textract_json': measure(main.BlockStore.from_textract_json, lambda: (file_json, ),
+                                                 number_of_blocks, repeat),
+        'BlockStore.forms': measure(lambda: block_store.forms(), lambda: (), number_of_blocks, repeat),
+        'BlockStore.queries': measure(lambda: block_store.queries(), lambda: (), number_of_blocks, repeat),
+        'get_table_list': measure(main.get_table_list, lambda: (block_store.blocks, block_store.table_blocks),
+                                  number_of_blocks, repeat),
+        'trp2 TDocumentSchema().load': measure(lambda d: t2.TDocumentSchema().load(d),
+                                               lambda: (copy.deepcopy(file_json), ), number_of_blocks, repeat),
+        'trp2 convert_form_to_list_trp2': measure(lambda d: convert_form_to_list_trp2(trp2_doc=d),
+                                                  lambda: (trp2_doc, ), number_of_blocks, repeat),
+        'trp2 convert_queries_to_list_trp2': measure(lambda d: convert_queries_to_list_trp2(trp2_doc=d),
+                                                     lambda: (trp2_doc, ), number_of_blocks, repeat),
+        'lambda_handler': measure(handler, lambda: ('DOCUMENT', ), number_of_blocks, repeat),
+        'lambda_handler PARSE_MODE=STREAMING': measure(handler, lambda: ('STREAMING', ), number_of_blocks, repeat),
+    }
+    return {'blocks': number_of_blocks, 'bytes': len(file_bytes), 'functions': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the generatecsv hot paths on synthetic Textract JSON")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="default: all")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per function, the fastest one is reported")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    report = dict()
+    for name in args.scenario or SCENARIOS:
+        result = run_scenario(name, args.repeat)
+        report[name] = result
+        print(f"\n{name}: {result['blocks']} blocks, {result['bytes'] / 2**20:.2f} MiB JSON")
+        print(f"{'function':36} {'wall ms':>10} {'peak MiB':>10} {'blocks/s':>12}")
+        for function, m in result['functions'].items():
+            print(f"{function:36} {m['wall_ms']:>10} {m['peak_mib']:>10} {m['blocks_per_s']:>12}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+compares the textract_sync OUTPUT_ENCODING options on synthetic Textract responses
+
+Reports the stored object size, the encode time in textract_sync and the decode + json.loads
+time the readers (generatecsv, comprehend_sync) pay per encoding.
+
+    python -m localpipeline.bench_result_encoding --pages 20 --repeat 3
+"""
+import argparse
+import json
+import time
+from typing import Callable, Dict, List
+
+from localpipeline.handlers import load_shared_module
+from localpipeline.synthetic_textract import generate_textract_response
+
+
+def best_ms(func: Callable, repeat: int) -> float:
+    durations: List[float] = list()
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start_time)
+    return round(min(durations) * 1000, 2)
+
+
+def run(textract_response: dict, repeat: int) -> List[Dict]:
+    result_encoding = load_shared_module('result_encoding')
+    results: List[Dict] = list()
+    for output_encoding in result_encoding.OUTPUT_ENCODINGS:
+        try:
+            body, put_kwargs = result_encoding.encode_textract_response(textract_response, output_encoding)
+        except ValueError as e:
+            print(f"skipping {output_encoding}: {e}")
+            continue
+        content_encoding = put_kwargs.get('ContentEncoding')
+        results.append({
+            'encoding': output_encoding,
+            'size_bytes': len(body),
+            'encode_ms': best_ms(lambda: result_encoding.encode_textract_response(textract_response, output_encoding),
+                                 repeat),
+            'decode_load_ms': best_ms(lambda: json.loads(result_encoding.decode_body(body, content_encoding)), repeat)
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=1)
+    parser.add_argument('--tables-per-page', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+    textract_response = generate_textract_response(pages=args.pages, tables_per_page=args.tables_per_page)
+    results = run(textract_response, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'encoding':<12} {'size_bytes':>12} {'encode_ms':>10} {'decode_load_ms':>15}")
+    for r in results:
+        print(f"{r['encoding']:<12} {r['size_bytes']:>12} {r['encode_ms']:>10} {r['decode_load_ms']:>15}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+loads the Lambda handler modules from lambda/<name>/app so they can be called in-process
+"""
+import glob
+import importlib.abc
+import importlib.util
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from types import ModuleType
+from typing import Dict, List, Optional
+
+LAMBDA_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda')
+# modules the Dockerfiles copy from lambda/shared/ next to the app modules of every image
+SHARED_ROOT = os.path.join(LAMBDA_ROOT, 'shared')
+
+
+class HandlerSpec():
+
+    def __init__(self, name: str, module: str, clients: Dict[str, str], modules: Optional[Dict[str, str]] = None):
+        # name: directory under lambda/, module: file name in app/ without .py,
+        # clients: service name -> module level attribute holding the boto3 client/resource,
+        # modules: import name -> handler, the handler modules the Dockerfile copies in under another name
+        self.name = name
+        self.module = module
+        self.clients = clients
+        self.modules = modules or dict()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(LAMBDA_ROOT, self.name, 'app', f"{self.module}.py")
+
+
+HANDLERS: Dict[str, HandlerSpec] = {
+    'comprehend_sync': HandlerSpec('comprehend_sync', 'sync_main', {
+        's3': 's3',
+        'stepfunctions': 'step_functions_client',
+        'comprehend': 'comprehend',
+        'textract': 'textract',
+        'dynamodb': 'dynamodb'
+    }),
+    'boundary_detection': HandlerSpec('boundary_detection', 'main', {'s3': 's3'}),
+    'enumerate_pages': HandlerSpec('enumerate_pages', 'main', {}),
+    'configurator': HandlerSpec('configurator', 'main', {'dynamodb': 'dynamodb'}),
+    'textract_sync': HandlerSpec('textract_sync', 'sync_main', {
+        's3': 's3',
+        'stepfunctions': 'step_functions_client',
+        'textract': 'textract',
+        'dynamodb': 'dynamodb'
+    }),
+    'generatecsv': HandlerSpec('generatecsv', 'main', {
+        's3': 's3_client',
+        'stepfunctions': 'step_functions_client'
+    }),
+    'map_classifications_lambda': HandlerSpec('map_classifications_lambda', 'main', {'s3': 's3_client'}),
+    'compile_paths': HandlerSpec('compile_paths', 'main', {'s3': 's3_client'}),
+    'join_csv': HandlerSpec('join_csv', 'sync_main', {'s3': 's3'}),
+    'process_page': HandlerSpec('process_page', 'process_page', {}, {
+        'configurator_main': 'configurator',
+        'sync_main': 'textract_sync',
+        'generatecsv_main': 'generatecsv',
+        'map_classifications_main': 'map_classifications_lambda'
+    }),
+    'startstepfunction': HandlerSpec('startstepfunction', 'start_execution', {
+        'stepfunctions': 'step_functions_client',
+        'dynamodb': 'dynamodb',
+        's3': 's3'
+    }),
+}
+
+# loaded modules by file path, every file of lambda/ is loaded once
+_modules: Dict[str, ModuleType] = dict()
+_lock = threading.RLock()
+
+
+def _module_name(path: str) -> str:
+    # lambda/<name>/app/<module>.py -> localpipeline_lambda_<name>_<module>
+    parts = os.path.relpath(path, LAMBDA_ROOT).split(os.sep)
+    return f"localpipeline_lambda_{parts[0]}_{os.path.splitext(parts[-1])[0]}"
+
+
+def _flat_modules(directory: str) -> Dict[str, str]:
+    # import name -> path of the modules in the task root of the image, the app modules are copied after
+    # (and over) the ones of lambda/shared
+    paths: Dict[str, str] = dict()
+    for root in (SHARED_ROOT, directory):
+        for file_name in sorted(os.listdir(root)):
+            if file_name.endswith('.py'):
+                paths[file_name[:-len('.py')]] = os.path.join(root, file_name)
+    return paths
+
+
+@contextmanager
+def _import_scope(directory: str, modules: Dict[str, ModuleType]):
+    """sys.path and sys.modules of the image of an app directory while one of its modules is loaded.
+
+    The app directory and lambda/shared are put in front of sys.path, the flat names of their modules
+    (and the renamed handler modules) are taken out of sys.modules or aliased to the modules loaded
+    before. Afterwards the modules imported in the scope are kept by path and sys.modules is restored,
+    so modules with the same name in other app directories (main, sync_main) do not clash.
+    """
+    flat_modules = _flat_modules(directory)
+    names = set(flat_modules) | set(modules)
+    saved = {name: sys.modules.pop(name) for name in names if name in sys.modules}
+    sys.modules.update({name: _modules[path] for name, path in flat_modules.items() if path in _modules})
+    sys.modules.update(modules)
+    sys.path[:0] = [directory, SHARED_ROOT]
+    try:
+        yield
+    finally:
+        sys.path.remove(directory)
+        sys.path.remove(SHARED_ROOT)
+        for name, path in flat_modules.items():
+            module = sys.modules.get(name)
+            if module is not None and getattr(module, '__file__', None) == path:
+                _modules.setdefault(path, module)
+        for name in names:
+            sys.modules.pop(name, None)
+        sys.modules.update(saved)
+
+
+@lru_cache(maxsize=None)
+def _unique_flat_modules() -> Dict[str, str]:
+    # import name -> path of the modules whose name is used once in lambda/*/app and lambda/shared
+    paths: Dict[str, List[str]] = dict()
+    for root in [SHARED_ROOT] + sorted(glob.glob(os.path.join(LAMBDA_ROOT, '*', 'app'))):
+        for path in sorted(glob.glob(os.path.join(root, '*.py'))):
+            paths.setdefault(os.path.splitext(os.path.basename(path))[0], list()).append(path)
+    return {name: candidates[0] for name, candidates in paths.items() if len(candidates) == 1}
+
+
+class _DeferredImportFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    """Imports deferred into functions (e.g. `from local_classifier import ...`) run after the scope of
+    their module's load, they are resolved to the loaded module when the name is unique in lambda/."""
+
+    def find_spec(self, fullname, path=None, target=None):
+        if path is None and fullname in _unique_flat_modules():
+            return importlib.util.spec_from_loader(fullname, self, origin=_unique_flat_modules()[fullname])
+        return None
+
+    def create_module(self, spec):
+        return _load_path(spec.origin)
+
+    def exec_module(self, module):
+        pass
+
+
+sys.meta_path.append(_DeferredImportFinder())
+
+
+def _load_path(path: str, modules: Optional[Dict[str, ModuleType]] = None) -> ModuleType:
+    with _lock:
+        if path not in _modules:
+            os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+            module_spec = importlib.util.spec_from_file_location(_module_name(path), path)
+            module = importlib.util.module_from_spec(module_spec)  # type: ignore
+            # registered before it runs, like sys.modules, so circular imports get the partial module
+            _modules[path] = module
+            try:
+                with _import_scope(os.path.dirname(path), modules or dict()):
+                    module_spec.loader.exec_module(module)  # type: ignore
+            except BaseException:
+                del _modules[path]
+                raise
+        return _modules[path]
+
+
+def load_handler_module(name: str) -> ModuleType:
+    """Import lambda/<name>/app/<module>.py once under a unique module name.
+
+    The flat sibling imports the Lambdas use (e.g. `from generate_csv import ...`) resolve to the
+    modules of their own app directory and lambda/shared, like they do in the image. boto3 clients
+    are created at import time, so a default region is set if none is configured. The handlers a
+    fused handler imports are loaded first and shared with it.
+    """
+    with _lock:
+        modules = {import_name: load_handler_module(handler)
+                   for import_name, handler in HANDLERS[name].modules.items()}
+        return _load_path(HANDLERS[name].path, modules)
+
+
+def load_app_module(name: str, module: str) -> ModuleType:
+    """Import any other module of lambda/<name>/app, e.g. load_app_module('generatecsv', 'block_store')."""
+    return _load_path(os.path.join(LAMBDA_ROOT, name, 'app', f"{module}.py"))
+
+
+def load_shared_module(module: str) -> ModuleType:
+    """Import a module of lambda/shared, e.g. load_shared_module('s3_io')."""
+    return _load_path(os.path.join(SHARED_ROOT, f"{module}.py"))
+
+
+def inject_clients(name: str, clients: Dict[str, object]) -> ModuleType:
+    """Replace the module level boto3 clients of a handler with the given stand-ins.
+
+    clients is keyed by service name ('s3', 'textract', 'comprehend', 'dynamodb', 'stepfunctions'),
+    services the handler does not use are ignored.
+    """
+    module = load_handler_module(name)
+    for service, attribute in HANDLERS[name].clients.items():
+        if service in clients:
+            setattr(module, attribute, clients[service])
+    # a fused handler calls into the modules of the handlers it imports
+    for handler in HANDLERS[name].modules.values():
+        inject_clients(handler, clients)
+    return module
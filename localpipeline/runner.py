@@ -0,0 +1,476 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+runs the DocumentSplitterWorkflow in one process
+
+Chains the same lambda_handler functions the Step Functions graph in
+docsplitter/document_split_workflow.py invokes, runs the per page Map states on a bounded
+thread pool and takes the AWS clients as parameters, so the whole flow can run against the
+stand-ins in localpipeline/stand_ins.py or against real services.
+
+    python -m localpipeline.runner sample-doc.pdf --document-type claimform --workers 16
+"""
+import argparse
+import io
+import json
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from localpipeline.handlers import LAMBDA_ROOT, inject_clients, load_app_module, load_shared_module
+from localpipeline.stand_ins import InMemoryDynamoDB, InMemoryS3, ReplayTextract, StaticComprehend, \
+    StepFunctionsRecorder, split_s3_path_to_bucket_and_key
+
+logger = logging.getLogger(__name__)
+__version__ = "0.0.1"
+
+THROTTLING_ERRORS = ('ThrottlingException', 'LimitExceededException', 'InternalServerError',
+                     'ProvisionedThroughputExceededException', 'TooManyRequestsException')
+
+# same defaults as the Lambda environments in document_split_workflow.py
+DEFAULT_ENVIRONMENT = {
+    "LOG_LEVEL": "INFO",
+    "COMPREHEND_CLASSIFIER_ARN": "arn:aws:comprehend:local:000000000000:document-classifier-endpoint/local",
+    "TEXT_OR_BYTES": "BYTES",
+    "DOCUMENT_READER_CONFIG": json.dumps({
+        "DocumentReadAction": "TEXTRACT_DETECT_DOCUMENT_TEXT",
+        "DocumentReadMode": "FORCE_DOCUMENT_READ_ACTION"
+    }),
+    "S3_OUTPUT_BUCKET": "local-pipeline",
+    "S3_OUTPUT_PREFIX": "textract-output",
+    "TEXTRACT_API": "GENERIC",
+    "OUTPUT_ENCODING": "JSON_INDENT",
+    "TEXTRACT_CACHE": "MEMORY",
+    "CSV_S3_OUTPUT_BUCKET": "local-pipeline",
+    "CSV_S3_OUTPUT_PREFIX": "textract-csv-output",
+    "JOINED_S3_OUTPUT_BUCKET": "local-pipeline",
+    "JOINED_S3_OUTPUT_PREFIX": "textract-joined-output",
+    "JOIN_MODE": "PANDAS",
+    "COLUMNAR_OUTPUT": "NONE",
+    "OUTPUT_TYPE": "CSV",
+    "PARSE_MODE": "DOCUMENT",
+    "CONFIGURATION_TABLE": "TextractConfigurationTable",
+    "CLAIM_CHECK_STORE": "NONE",
+    "CLAIM_CHECK_BUCKET": "local-pipeline",
+    "CLAIM_CHECK_PREFIX": "claim-check",
+}
+
+# FAST_PATH_MAX_BYTES of the startstepfunction Lambda
+SINGLE_PAGE_MAX_BYTES = 5 * 1024 * 1024
+
+DEFAULT_CONFIG_CSV = os.path.join(LAMBDA_ROOT, 'config_prefill', 'app', 'default_config.csv')
+
+
+class RetryPolicy():
+
+    def __init__(self, errors: Tuple[str, ...], max_attempts: int, interval: float, backoff_rate: float):
+        # same semantics as Step Functions Retry: max_attempts retries after the first call
+        self.errors = errors
+        self.max_attempts = max_attempts
+        self.interval = interval
+        self.backoff_rate = backoff_rate
+
+
+# the retries configured on the tasks in document_split_workflow.py
+CLASSIFICATION_RETRY = RetryPolicy(THROTTLING_ERRORS, max_attempts=100, interval=1, backoff_rate=1.1)
+TEXTRACT_RETRY = RetryPolicy(THROTTLING_ERRORS, max_attempts=1, interval=1, backoff_rate=1)
+NO_RETRY = RetryPolicy((), max_attempts=0, interval=0, backoff_rate=1)
+
+
+class StageFailed(Exception):
+
+    def __init__(self, stage: str, error: str, cause: str):
+        super().__init__(f"{stage} failed with {error}: {cause}")
+        self.stage = stage
+        self.error = error
+        self.cause = cause
+
+
+class PipelineResult():
+
+    def __init__(self, execution_id: str, outputs: List[dict], number_of_pages: int, duration_s: float,
+                 stage_durations_ms: Dict[str, List[float]]):
+        self.execution_id = execution_id
+        # same list the state machine returns, one entry per joined document
+        self.outputs = outputs
+        self.number_of_pages = number_of_pages
+        self.duration_s = duration_s
+        self.stage_durations_ms = stage_durations_ms
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.number_of_pages / self.duration_s if self.duration_s else 0.0
+
+    def summary(self) -> dict:
+        stages = dict()
+        for stage, durations in self.stage_durations_ms.items():
+            durations = sorted(durations)
+            stages[stage] = {
+                "count": len(durations),
+                "total_ms": round(sum(durations), 1),
+                "p50_ms": round(durations[len(durations) // 2], 1),
+                "max_ms": round(durations[-1], 1)
+            }
+        return {
+            "execution_id": self.execution_id,
+            "number_of_pages": self.number_of_pages,
+            "duration_s": round(self.duration_s, 3),
+            "pages_per_second": round(self.pages_per_second, 2),
+            "stages": stages
+        }
+
+
+def split_document(s3, s3_path: str, s3_output_bucket: str, s3_output_prefix: str) -> Tuple[str, str, List[str]]:
+    """Stand-in for TextractPOCDecider + DocumentSplitter.
+
+    Writes one object per page named <page number>.<ext> like the DocumentSplitter does and
+    returns (mime, output path, page file names). PDFs are split with PyPDF2, anything else is
+    treated as a single page image.
+    """
+    s3_bucket, s3_key = split_s3_path_to_bucket_and_key(s3_path)
+    file_bytes = s3.get_object(Bucket=s3_bucket, Key=s3_key)['Body'].read()
+    mime = mimetypes.guess_type(s3_key)[0] or 'application/octet-stream'
+    base_filename = os.path.basename(s3_key)
+    s3_output_path = f"{s3_output_prefix}/{base_filename}/{datetime.now(timezone.utc).isoformat()}"
+
+    pages: List[str] = list()
+    if mime == 'application/pdf':
+        from PyPDF2 import PdfReader, PdfWriter
+        reader = PdfReader(io.BytesIO(file_bytes))
+        for page_number, page in enumerate(reader.pages, start=1):
+            writer = PdfWriter()
+            writer.add_page(page)
+            page_bytes = io.BytesIO()
+            writer.write(page_bytes)
+            pages.append(f"{page_number}.pdf")
+            s3.put_object(Body=page_bytes.getvalue(), Bucket=s3_output_bucket, Key=f"{s3_output_path}/{page_number}.pdf")
+    else:
+        _, extension = os.path.splitext(base_filename)
+        pages.append(f"1{extension}")
+        s3.put_object(Body=file_bytes, Bucket=s3_output_bucket, Key=f"{s3_output_path}/1{extension}")
+    return mime, s3_output_path, pages
+
+
+class PipelineRunner():
+
+    def __init__(self,
+                 s3=None,
+                 textract=None,
+                 comprehend=None,
+                 dynamodb=None,
+                 step_functions: Optional[StepFunctionsRecorder] = None,
+                 environment: Optional[Dict[str, str]] = None,
+                 max_workers: int = 8,
+                 splitter: Callable[..., Tuple[str, str, List[str]]] = split_document,
+                 classification_mode: str = "EVERY_PAGE",
+                 single_page_fast_path: bool = False,
+                 fused_page_processor: bool = False,
+                 classification_retry: RetryPolicy = CLASSIFICATION_RETRY,
+                 textract_retry: RetryPolicy = TEXTRACT_RETRY):
+        """Any client left as None is replaced by its in-memory stand-in.
+
+        step_functions has to collect the task token callbacks, so it defaults to a
+        StepFunctionsRecorder. environment is applied to os.environ, which the handlers read on
+        every call, so it is shared by all runners in the process. classification_mode is EVERY_PAGE or
+        BOUNDARIES, like classification_mode in document_split_workflow.py. single_page_fast_path runs
+        single page documents like the Express state machine of single_page_fast_path does.
+        fused_page_processor runs the pages of ProcessPagesMapState with the process_page handler.
+        """
+        if classification_mode not in ("EVERY_PAGE", "BOUNDARIES"):
+            raise ValueError(f"classification_mode must be EVERY_PAGE or BOUNDARIES, got {classification_mode}")
+        self.classification_mode = classification_mode
+        self.single_page_fast_path = single_page_fast_path
+        self.fused_page_processor = fused_page_processor
+        self.environment = dict(DEFAULT_ENVIRONMENT, **(environment or {}))
+        os.environ.update(self.environment)
+
+        self.s3 = s3 if s3 is not None else InMemoryS3()
+        self.textract = textract if textract is not None else ReplayTextract()
+        self.comprehend = comprehend if comprehend is not None else StaticComprehend(lambda _: 'claimform')
+        if dynamodb is None:
+            dynamodb = InMemoryDynamoDB()
+            dynamodb.load_config_csv(self.environment['CONFIGURATION_TABLE'], DEFAULT_CONFIG_CSV)
+        self.dynamodb = dynamodb
+        self.step_functions = step_functions if step_functions is not None else StepFunctionsRecorder()
+        self.max_workers = max_workers
+        self.splitter = splitter
+        self.retry_policies = {
+            'comprehend_sync': classification_retry,
+            'textract_sync': textract_retry,
+            'process_page': textract_retry,
+        }
+
+        clients = {
+            's3': self.s3,
+            'textract': self.textract,
+            'comprehend': self.comprehend,
+            'dynamodb': self.dynamodb,
+            'stepfunctions': self.step_functions
+        }
+        self.handlers = {
+            name: inject_clients(name, clients).lambda_handler
+            for name in ('comprehend_sync', 'boundary_detection', 'enumerate_pages', 'configurator', 'textract_sync', 'generatecsv',
+                         'map_classifications_lambda', 'compile_paths', 'join_csv', 'process_page')
+        }
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='page')
+        self._durations: Dict[str, Dict[str, List[float]]] = dict()
+        self._durations_lock = threading.Lock()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _timed(self, execution_id: str, stage: str, func: Callable, *args):
+        start_time = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            duration = (time.perf_counter() - start_time) * 1000
+            with self._durations_lock:
+                self._durations[execution_id].setdefault(stage, list()).append(duration)
+
+    def _invoke(self, stage: str, event):
+        return self.handlers[stage](event, None)
+
+    def _retry(self, stage: str, call: Callable):
+        policy = self.retry_policies.get(stage, NO_RETRY)
+        interval = policy.interval
+        attempt = 0
+        while True:
+            try:
+                return call()
+            except Exception as e:
+                if type(e).__name__ not in policy.errors or attempt >= policy.max_attempts:
+                    raise StageFailed(stage, type(e).__name__, str(e)) from e
+                attempt += 1
+                logger.warning(f"{stage} {type(e).__name__}, retry {attempt}/{policy.max_attempts} in {interval}s")
+                time.sleep(interval)
+                interval *= policy.backoff_rate
+
+    def _invoke_with_callback(self, stage: str, payload: dict, execution_id: str) -> dict:
+        """WAIT_FOR_TASK_TOKEN: the handler reports its result through send_task_success/failure."""
+        tokens: List[str] = list()
+
+        def call():
+            tokens.append(uuid.uuid4().hex)
+            try:
+                self._invoke(stage, {"Token": tokens[-1], "ExecutionId": execution_id, "Payload": payload})
+            except Exception:
+                self.step_functions.pop_result(tokens[-1])
+                raise
+
+        self._retry(stage, call)
+        result = self.step_functions.pop_result(tokens[-1])
+        if not result:
+            raise StageFailed(stage, 'NoTaskCallback', f"no send_task_success/failure for payload: {payload}")
+        status, body = result
+        if status == 'FAILURE':
+            raise StageFailed(stage, body['error'], body['cause'])
+        return json.loads(body['output'])
+
+    def _invoke_request_response(self, stage: str, payload: dict, execution_id: str) -> dict:
+        """Express workflow: the callback handlers are invoked without Token and return their result."""
+        return self._retry(stage, lambda: self._invoke(stage, {"ExecutionId": execution_id, "Payload": payload}))
+
+    def _classify_page(self, execution_id: str, item: dict) -> dict:
+        item['classification'] = self._invoke_with_callback('comprehend_sync', item, execution_id)
+        if item['classification']['documentType'] == 'NONE':
+            raise StageFailed('RouteDocType', 'DocumentTypeNotImplemented', item['manifest']['s3Path'])
+        return item
+
+    def _process_page(self, execution_id: str, item: dict) -> dict:
+        if self.fused_page_processor:
+            return self._timed(execution_id, 'process_page', self._invoke_request_response, 'process_page', item,
+                               execution_id)
+        item = self._timed(execution_id, 'configurator', self._invoke, 'configurator', item)
+        item['textract_result'] = self._timed(execution_id, 'textract_sync', self._invoke_with_callback,
+                                              'textract_sync', item, execution_id)
+        item['csv_output_location'] = self._timed(execution_id, 'generatecsv', self._invoke_with_callback,
+                                                  'generatecsv', item, execution_id)
+        return self._timed(execution_id, 'map_classifications_lambda', self._invoke, 'map_classifications_lambda',
+                           item)
+
+    def _join(self, execution_id: str, document: dict) -> dict:
+        return self._invoke('join_csv', {"ExecutionId": execution_id, "Payload": document})
+
+    def _map(self, func: Callable, execution_id: str, items: List) -> List:
+        # Map state: results keep the order of the items, the first failure fails the execution
+        return list(self._pool.map(lambda item: func(execution_id, item), items))
+
+    def _is_single_page(self, s3_path: str) -> bool:
+        s3_bucket, s3_key = split_s3_path_to_bucket_and_key(s3_path)
+        page_count = load_app_module('startstepfunction', 'page_count')
+        return page_count.is_single_page(self.s3, s3_bucket, s3_key, SINGLE_PAGE_MAX_BYTES)
+
+    def _run_single_page(self, execution_id: str, s3_path: str) -> List[dict]:
+        """The Express state machine of single_page_fast_path, startstepfunction copies the upload to
+        where the DocumentSplitter puts page 1."""
+        s3_bucket, s3_key = split_s3_path_to_bucket_and_key(s3_path)
+        s3_output_bucket = self.environment['S3_OUTPUT_BUCKET']
+        base_filename = os.path.basename(s3_key)
+        page_key = f"{self.environment['S3_OUTPUT_PREFIX']}/{base_filename}/{datetime.now(timezone.utc).isoformat()}/" \
+            f"1{os.path.splitext(base_filename)[1]}"
+        self.s3.copy_object(Bucket=s3_output_bucket, Key=page_key, CopySource={'Bucket': s3_bucket, 'Key': s3_key})
+        item = {
+            "manifest": {
+                "s3Path": f"s3://{s3_output_bucket}/{page_key}"
+            },
+            "mime": mimetypes.guess_type(base_filename)[0] or 'application/octet-stream',
+            "numberOfPages": 1
+        }
+        classification = self._timed(execution_id, 'comprehend_sync', self._invoke_request_response, 'comprehend_sync',
+                                     item, execution_id)
+        if classification['documentType'] == 'NONE':
+            raise StageFailed('FastPathRouteDocType', 'DocumentTypeNotImplemented', item['manifest']['s3Path'])
+        item['classification'] = dict(classification,
+                                      documentTypeWithPageNum=f"{classification['documentType']}_page1")
+        item = self._timed(execution_id, 'configurator', self._invoke, 'configurator', item)
+        for stage, result_path in (('textract_sync', 'textract_result'), ('generatecsv', 'csv_output_location')):
+            item[result_path] = self._timed(execution_id, stage, self._invoke_request_response, stage, item,
+                                            execution_id)
+        record = self._timed(execution_id, 'map_classifications_lambda', self._invoke, 'map_classifications_lambda',
+                             item)
+        documents = self._timed(execution_id, 'compile_paths', self._invoke, 'compile_paths', [record])
+        return [self._timed(execution_id, 'join_csv', self._join, execution_id, documents[0])]
+
+    def run(self, s3_path: str, execution_name: Optional[str] = None) -> PipelineResult:
+        if not execution_name:
+            execution_name = re.sub(r'[^A-Za-z0-9-_]', '',
+                                    os.path.basename(s3_path) + datetime.now(timezone.utc).isoformat())[:80]
+        start_time = time.perf_counter()
+        fast_path = self.single_page_fast_path and self._is_single_page(s3_path)
+        # executions of the Express state machine of the single page fast path
+        execution_type, workflow = ("express", "DocumentSplitterWorkflowSinglePage") if fast_path else \
+            ("execution", "DocumentSplitterWorkflow")
+        execution_id = f"arn:aws:states:local:000000000000:{execution_type}:{workflow}:{execution_name}"
+        with self._durations_lock:
+            self._durations[execution_id] = dict()
+
+        if fast_path:
+            outputs = self._run_single_page(execution_id, s3_path)
+            with self._durations_lock:
+                durations = self._durations.pop(execution_id)
+            result = PipelineResult(execution_id, outputs, 1, time.perf_counter() - start_time, durations)
+            logger.info(json.dumps(result.summary()))
+            return result
+
+        s3_output_bucket = self.environment['S3_OUTPUT_BUCKET']
+        mime, s3_output_path, pages = self._timed(execution_id, 'split', self.splitter, self.s3, s3_path,
+                                                  s3_output_bucket, self.environment['S3_OUTPUT_PREFIX'])
+        state = {
+            "documentSplitterS3OutputBucket": s3_output_bucket,
+            "documentSplitterS3OutputPath": s3_output_path,
+            "pages": pages,
+            "mime": mime
+        }
+        if self.classification_mode == "BOUNDARIES":
+            state['boundaries'] = self._timed(execution_id, 'boundary_detection', self._invoke, 'boundary_detection',
+                                              state)
+            classify_pages = state['boundaries']['boundaryPages']
+        else:
+            classify_pages = pages
+        items = [{
+            "manifest": {
+                "s3Path": f"s3://{s3_output_bucket}/{s3_output_path}/{page}"
+            },
+            "mime": mime,
+            "numberOfPages": 1
+        } for page in classify_pages]
+
+        items = self._map(lambda e, item: self._timed(e, 'comprehend_sync', self._classify_page, e, item),
+                          execution_id, items)
+        if self.classification_mode == "BOUNDARIES":
+            state['classifiedPages'] = items
+            items = self._timed(execution_id, 'boundary_expand', self._invoke, 'boundary_detection', state)
+        items = self._timed(execution_id, 'enumerate_pages', self._invoke, 'enumerate_pages', items)
+        page_results = self._map(self._process_page, execution_id, items)
+        if self.environment['CLAIM_CHECK_STORE'] != "NONE":
+            # ProcessPagesMapState discards its results, compile_paths reads them from the claim check store
+            page_results = {"Payload": items}
+        documents = self._timed(execution_id, 'compile_paths', self._invoke, 'compile_paths', page_results)
+        outputs = self._map(lambda e, document: self._timed(e, 'join_csv', self._join, e, document),
+                            execution_id, documents)
+        duration = time.perf_counter() - start_time
+
+        with self._durations_lock:
+            durations = self._durations.pop(execution_id)
+        result = PipelineResult(execution_id, outputs, len(pages), duration, durations)
+        logger.info(json.dumps(result.summary()))
+        return result
+
+    def run_batch(self, s3_paths: List[str], max_documents: int = 4) -> List[PipelineResult]:
+        """Backfill mode: runs several documents at once, their pages share the page pool."""
+        with ThreadPoolExecutor(max_workers=max_documents, thread_name_prefix='document') as documents_pool:
+            return list(documents_pool.map(self.run, s3_paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run the document splitter workflow in-process against stand-ins")
+    parser.add_argument('files', nargs='+', help="local documents to process")
+    parser.add_argument('--workers', type=int, default=8, help="size of the page pool")
+    parser.add_argument('--documents', type=int, default=1, help="documents processed at the same time")
+    parser.add_argument('--document-type', default='claimform', help="classification every page gets")
+    parser.add_argument('--textract-response', help="Textract JSON returned for every page")
+    parser.add_argument('--classification-mode', choices=['EVERY_PAGE', 'BOUNDARIES'], default='EVERY_PAGE',
+                        help="BOUNDARIES classifies only the pages that start a new document")
+    parser.add_argument('--single-page-fast-path', action='store_true',
+                        help="run single page documents like the Express state machine of the single page fast path")
+    parser.add_argument('--fused-page-processor', action='store_true',
+                        help="process each page with the process_page handler instead of four handlers")
+    parser.add_argument('--s3-directory',
+                        help="keep the objects in <DIR>/<bucket>/<key> (LocalFileSystemS3) instead of in memory")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+
+    textract = ReplayTextract()
+    if args.textract_response:
+        with open(args.textract_response) as f:
+            textract_response = json.load(f)
+        textract = ReplayTextract(response_factory=lambda _: textract_response)
+
+    if args.s3_directory:
+        s3 = load_shared_module('s3_io').LocalFileSystemS3(args.s3_directory)
+    else:
+        s3 = InMemoryS3()
+    s3_paths = list()
+    for file_name in args.files:
+        with open(file_name, 'rb') as f:
+            s3_path = f"s3://local-pipeline/uploads/{os.path.basename(file_name)}"
+            s3.put_object(Body=f.read(), Bucket='local-pipeline', Key=f"uploads/{os.path.basename(file_name)}")
+            s3_paths.append(s3_path)
+
+    with PipelineRunner(s3=s3,
+                        textract=textract,
+                        comprehend=StaticComprehend(lambda _: args.document_type),
+                        environment={"LOG_LEVEL": args.log_level},
+                        max_workers=args.workers,
+                        classification_mode=args.classification_mode,
+                        single_page_fast_path=args.single_page_fast_path,
+                        fused_page_processor=args.fused_page_processor) as runner:
+        start_time = time.perf_counter()
+        results = runner.run_batch(s3_paths, max_documents=args.documents)
+        duration = time.perf_counter() - start_time
+
+    for result in results:
+        print(json.dumps(result.summary(), indent=4))
+        print(json.dumps(result.outputs, indent=4))
+    number_of_pages = sum(r.number_of_pages for r in results)
+    print(f"{number_of_pages} pages in {duration:.3f}s: {number_of_pages / duration:.2f} pages/s")
+
+
+if __name__ == "__main__":
+    main()
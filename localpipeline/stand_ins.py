@@ -0,0 +1,370 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+in-memory stand-ins for the AWS clients the Lambdas use, so the pipeline can run offline
+"""
+import csv
+import hashlib
+import json
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from botocore.exceptions import ClientError
+
+
+def _exceptions(*names: str) -> SimpleNamespace:
+    # mirrors client.exceptions.<Name> of boto3 clients
+    return SimpleNamespace(**{name: type(name, (Exception, ), {}) for name in names})
+
+
+def split_s3_path_to_bucket_and_key(s3_path: str) -> Tuple[str, str]:
+    if len(s3_path) > 7 and s3_path.lower().startswith("s3://"):
+        s3_bucket, s3_key = s3_path.replace("s3://", "").split("/", 1)
+        return s3_bucket, s3_key
+    else:
+        raise ValueError(
+            f"s3_path: {s3_path} is no s3_path in the form of s3://bucket/key."
+        )
+
+
+class StreamingBody():
+
+    def __init__(self, data: bytes):
+        self._data = data
+        self._position = 0
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        if amt is None:
+            amt = len(self._data) - self._position
+        chunk = self._data[self._position:self._position + amt]
+        self._position += len(chunk)
+        return chunk
+
+    def close(self):
+        pass
+
+
+class InMemoryS3():
+
+    def __init__(self):
+        self.objects: Dict[Tuple[str, str], dict] = dict()
+        self.uploads: Dict[str, dict] = dict()
+        self.exceptions = _exceptions('NoSuchKey', 'NoSuchBucket')
+        self._lock = threading.Lock()
+
+    def put_object(self, Body: Union[bytes, str], Bucket: str, Key: str, **kwargs) -> dict:
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif not isinstance(Body, bytes):
+            Body = Body.read()
+        # like S3 for single part uploads, the ETag is the MD5 of the bytes
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'
+        with self._lock:
+            self.objects[(Bucket, Key)] = dict(kwargs, Body=bytes(Body), ETag=etag)
+        return {'ETag': etag}
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        with self._lock:
+            if (Bucket, Key) not in self.objects:
+                raise self.exceptions.NoSuchKey(f"s3://{Bucket}/{Key}")
+            stored = self.objects[(Bucket, Key)]
+        response = {k: v for k, v in stored.items() if k != 'Body'}
+        response['ContentLength'] = len(stored['Body'])
+        response['Body'] = StreamingBody(stored['Body'])
+        return response
+
+    def copy_object(self, Bucket: str, Key: str, CopySource: Dict[str, str], **kwargs) -> dict:
+        with self._lock:
+            if (CopySource['Bucket'], CopySource['Key']) not in self.objects:
+                raise self.exceptions.NoSuchKey(f"s3://{CopySource['Bucket']}/{CopySource['Key']}")
+            self.objects[(Bucket, Key)] = dict(self.objects[(CopySource['Bucket'], CopySource['Key'])])
+        return {'CopyObjectResult': {}}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        with self._lock:
+            if (Bucket, Key) not in self.objects:
+                raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+            stored = self.objects[(Bucket, Key)]
+        response = {k: v for k, v in stored.items() if k != 'Body'}
+        response['ContentLength'] = len(stored['Body'])
+        return response
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> dict:
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {'Bucket': Bucket, 'Key': Key, 'kwargs': kwargs, 'parts': dict()}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Body: bytes, Bucket: str, Key: str, UploadId: str, PartNumber: int, **kwargs) -> dict:
+        etag = f'"{uuid.uuid4().hex}"'
+        with self._lock:
+            self.uploads[UploadId]['parts'][PartNumber] = (etag, bytes(Body))
+        return {'ETag': etag}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict) -> dict:
+        with self._lock:
+            upload = self.uploads.pop(UploadId)
+        parts = [upload['parts'][p['PartNumber']] for p in MultipartUpload['Parts']]
+        if any(etag != p['ETag'] for (etag, _), p in zip(parts, MultipartUpload['Parts'])):
+            raise ValueError(f"ETag mismatch for upload {UploadId}")
+        return self.put_object(Body=b''.join(data for _, data in parts), Bucket=Bucket, Key=Key, **upload['kwargs'])
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str) -> dict:
+        with self._lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def put_s3_path(self, s3_path: str, body: Union[bytes, str]):
+        s3_bucket, s3_key = split_s3_path_to_bucket_and_key(s3_path)
+        self.put_object(Body=body, Bucket=s3_bucket, Key=s3_key)
+
+    def get_s3_path(self, s3_path: str) -> bytes:
+        s3_bucket, s3_key = split_s3_path_to_bucket_and_key(s3_path)
+        return self.get_object(Bucket=s3_bucket, Key=s3_key)['Body'].read()
+
+
+class StepFunctionsRecorder():
+    """Collects the task token callbacks the WAIT_FOR_TASK_TOKEN Lambdas send."""
+
+    def __init__(self):
+        self.results: Dict[str, Tuple[str, dict]] = dict()
+        self.executions: List[dict] = list()
+        self.exceptions = _exceptions('InvalidToken', 'TaskDoesNotExist', 'TaskTimedOut', 'InvalidOutput',
+                                      'ExecutionAlreadyExists')
+        self._lock = threading.Lock()
+
+    def send_task_success(self, taskToken: str, output: str) -> dict:
+        json.loads(output)
+        with self._lock:
+            self.results[taskToken] = ('SUCCESS', {'output': output})
+        return {}
+
+    def send_task_failure(self, taskToken: str, error: str = "", cause: str = "") -> dict:
+        with self._lock:
+            self.results[taskToken] = ('FAILURE', {'error': error, 'cause': cause})
+        return {}
+
+    def start_execution(self, stateMachineArn: str, name: str, input: str) -> dict:
+        with self._lock:
+            self.executions.append({'stateMachineArn': stateMachineArn, 'name': name, 'input': input})
+        return {'executionArn': f"{stateMachineArn.replace(':stateMachine:', ':execution:')}:{name}"}
+
+    def pop_result(self, token: str) -> Optional[Tuple[str, dict]]:
+        with self._lock:
+            return self.results.pop(token, None)
+
+
+def default_textract_response() -> dict:
+    # a blank page, enough for generatecsv to produce a CSV with only the SIGNATURES row
+    return {
+        'DocumentMetadata': {
+            'Pages': 1
+        },
+        'Blocks': [{
+            'BlockType': 'PAGE',
+            'Id': str(uuid.uuid4()),
+            'Page': 1,
+            'Geometry': {
+                'BoundingBox': {
+                    'Width': 1.0,
+                    'Height': 1.0,
+                    'Left': 0.0,
+                    'Top': 0.0
+                },
+                'Polygon': [{'X': 0.0, 'Y': 0.0}, {'X': 1.0, 'Y': 0.0}, {'X': 1.0, 'Y': 1.0}, {'X': 0.0, 'Y': 1.0}]
+            },
+            'Relationships': [{
+                'Type': 'CHILD',
+                'Ids': []
+            }]
+        }],
+        'AnalyzeDocumentModelVersion': '1.0'
+    }
+
+
+class ReplayTextract():
+    """Answers AnalyzeDocument/DetectDocumentText from canned responses.
+
+    responses maps the s3://bucket/key of the page to the Textract response, anything not
+    found is answered by response_factory(params).
+
+    The asynchronous Start*/Get* APIs answer from the same responses: a job is IN_PROGRESS for
+    async_delay_s, then the blocks are paged out 1000 at a time with NextToken. The notification
+    stand-in for the NotificationChannel calls every on_job_complete(job_id) callback when a job
+    finishes.
+    """
+
+    def __init__(self,
+                 responses: Optional[Dict[str, dict]] = None,
+                 response_factory: Callable[[dict], dict] = lambda _: default_textract_response(),
+                 async_delay_s: float = 0.0):
+        self.responses = responses if responses is not None else dict()
+        self.response_factory = response_factory
+        self.async_delay_s = async_delay_s
+        self.jobs: Dict[str, dict] = dict()
+        self.on_job_complete: List[Callable[[str], None]] = list()
+        self.calls: List[Tuple[str, dict]] = list()
+        self.exceptions = _exceptions('InvalidS3ObjectException', 'InvalidParameterException',
+                                      'InvalidKMSKeyException', 'DocumentTooLargeException',
+                                      'BadDocumentException', 'AccessDeniedException',
+                                      'IdempotentParameterMismatchException',
+                                      'ProvisionedThroughputExceededException', 'InternalServerError',
+                                      'ThrottlingException', 'LimitExceededException',
+                                      'UnsupportedDocumentException')
+        self._lock = threading.Lock()
+
+    def _respond(self, api: str, params: dict) -> dict:
+        with self._lock:
+            self.calls.append((api, params))
+        return self._lookup(params['Document']['S3Object'], params)
+
+    def _lookup(self, s3_object: dict, params: dict) -> dict:
+        s3_path = f"s3://{s3_object['Bucket']}/{s3_object['Name']}"
+        if s3_path in self.responses:
+            return self.responses[s3_path]
+        return self.response_factory(params)
+
+    def analyze_document(self, **params) -> dict:
+        return self._respond('AnalyzeDocument', params)
+
+    def detect_document_text(self, **params) -> dict:
+        return self._respond('DetectDocumentText', params)
+
+    def _start(self, api: str, params: dict) -> dict:
+        with self._lock:
+            self.calls.append((api, params))
+            for job_id, job in self.jobs.items():
+                if job['token'] and job['token'] == params.get('ClientRequestToken'):
+                    return {'JobId': job_id}
+        response = self._lookup(params['DocumentLocation']['S3Object'], params)
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self.jobs[job_id] = {
+                'token': params.get('ClientRequestToken'),
+                'done_at': time.monotonic() + self.async_delay_s,
+                'response': response
+            }
+        timer = threading.Timer(self.async_delay_s, lambda: [callback(job_id) for callback in self.on_job_complete])
+        timer.daemon = True
+        timer.start()
+        return {'JobId': job_id}
+
+    def _get(self, api: str, JobId: str, MaxResults: int = 1000, NextToken: Optional[str] = None) -> dict:
+        with self._lock:
+            self.calls.append((api, {'JobId': JobId, 'NextToken': NextToken}))
+            job = self.jobs[JobId]
+        if time.monotonic() < job['done_at']:
+            return {'JobStatus': 'IN_PROGRESS'}
+        blocks = job['response'].get('Blocks', [])
+        start = int(NextToken or 0)
+        page = {k: v for k, v in job['response'].items() if k != 'Blocks'}
+        page.update({'JobStatus': 'SUCCEEDED', 'Blocks': blocks[start:start + MaxResults]})
+        if start + MaxResults < len(blocks):
+            page['NextToken'] = str(start + MaxResults)
+        return page
+
+    def start_document_analysis(self, **params) -> dict:
+        return self._start('StartDocumentAnalysis', params)
+
+    def start_document_text_detection(self, **params) -> dict:
+        return self._start('StartDocumentTextDetection', params)
+
+    def get_document_analysis(self, **params) -> dict:
+        return self._get('GetDocumentAnalysis', **params)
+
+    def get_document_text_detection(self, **params) -> dict:
+        return self._get('GetDocumentTextDetection', **params)
+
+
+class StaticComprehend():
+    """Answers ClassifyDocument with classifier(params) -> document type."""
+
+    def __init__(self, classifier: Callable[[dict], str]):
+        self.classifier = classifier
+        self.calls: List[dict] = list()
+        self.exceptions = _exceptions('TextSizeLimitExceededException', 'InvalidRequestException',
+                                      'TooManyRequestsException', 'ResourceUnavailableException')
+        self._lock = threading.Lock()
+
+    def classify_document(self, **params) -> dict:
+        with self._lock:
+            self.calls.append(params)
+        return {'Classes': [{'Name': self.classifier(params), 'Score': 1.0}]}
+
+
+class InMemoryTable():
+
+    def __init__(self, name: str, key_name: str = 'DOCUMENT_TYPE'):
+        # key_name is the partition key, the configuration table uses DOCUMENT_TYPE
+        self.name = name
+        self.key_name = key_name
+        self.items: Dict[str, dict] = dict()
+        self._lock = threading.Lock()
+
+    def get_item(self, Key: Dict[str, str], **kwargs) -> dict:
+        with self._lock:
+            item = self.items.get(Key[self.key_name])
+        return {'Item': dict(item)} if item else {}
+
+    def put_item(self, Item: dict, **kwargs) -> dict:
+        with self._lock:
+            self.items[Item[self.key_name]] = dict(Item)
+        return {}
+
+    def delete_item(self, Key: Dict[str, str], **kwargs) -> dict:
+        with self._lock:
+            self.items.pop(Key[self.key_name], None)
+        return {}
+
+    def scan(self, **kwargs) -> dict:
+        # one page with all items, ProjectionExpression and filters are ignored
+        with self._lock:
+            return {'Items': [dict(item) for item in self.items.values()]}
+
+
+class InMemoryDynamoDB():
+    """Stand-in for boto3.resource('dynamodb') covering the configuration table."""
+
+    def __init__(self):
+        self.tables: Dict[str, InMemoryTable] = dict()
+        self._lock = threading.Lock()
+
+    def Table(self, name: str) -> InMemoryTable:
+        with self._lock:
+            if name not in self.tables:
+                self.tables[name] = InMemoryTable(name)
+            return self.tables[name]
+
+    def create_table(self, name: str, key_name: str) -> InMemoryTable:
+        with self._lock:
+            self.tables[name] = InMemoryTable(name, key_name)
+            return self.tables[name]
+
+    def batch_get_item(self, RequestItems: Dict[str, dict], **kwargs) -> dict:
+        responses: Dict[str, List[dict]] = dict()
+        for table_name, request in RequestItems.items():
+            table = self.Table(table_name)
+            responses[table_name] = [r['Item'] for r in (table.get_item(Key=key) for key in request['Keys']) if r]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems: Dict[str, List[dict]], **kwargs) -> dict:
+        for table_name, requests in RequestItems.items():
+            table = self.Table(table_name)
+            for request in requests:
+                if 'PutRequest' in request:
+                    table.put_item(Item=request['PutRequest']['Item'])
+                else:
+                    table.delete_item(Key=request['DeleteRequest']['Key'])
+        return {'UnprocessedItems': {}}
+
+    def load_config_csv(self, table_name: str, csv_path: str):
+        # same layout as lambda/config_prefill/app/default_config.csv: DOCUMENT_TYPE,CONFIG
+        table = self.Table(table_name)
+        with open(csv_path, newline='') as f:
+            for row in csv.reader(f):
+                if row:
+                    table.put_item(Item={'DOCUMENT_TYPE': row[0], 'CONFIG': row[1]})
@@ -0,0 +1,220 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+generates synthetic Textract AnalyzeDocument responses
+
+The block graph follows the real responses: PAGE -> LINE -> WORD, KEY_VALUE_SET KEY -> VALUE,
+TABLE -> CELL -> WORD, QUERY -> QUERY_RESULT and SIGNATURE blocks, all with Geometry and
+Confidence, so it can be fed to trp, trp2 and the generatecsv handler.
+
+    python -m localpipeline.synthetic_textract --pages 1 --tables-per-page 200 > dense.json
+"""
+import argparse
+import json
+import random
+import uuid
+from typing import List, Optional
+
+WORDS = ["patient", "name", "date", "claim", "insured", "address", "provider", "amount", "charges", "diagnosis",
+         "service", "code", "total", "paid", "balance", "phone", "city", "state", "zip", "signature", "Doe",
+         "John", "Jane", "11-2234-10190", "$1,250.00", "05/12/2022", "Seattle", "WA", "98109", "X"]
+
+
+class SyntheticTextractResponse():
+
+    def __init__(self,
+                 pages: int = 1,
+                 lines_per_page: int = 40,
+                 words_per_line: int = 6,
+                 key_values_per_page: int = 20,
+                 tables_per_page: int = 2,
+                 table_rows: int = 8,
+                 table_columns: int = 5,
+                 queries_per_page: int = 5,
+                 signatures_per_page: int = 1,
+                 seed: Optional[int] = 0):
+        self.pages = pages
+        self.lines_per_page = lines_per_page
+        self.words_per_line = words_per_line
+        self.key_values_per_page = key_values_per_page
+        self.tables_per_page = tables_per_page
+        self.table_rows = table_rows
+        self.table_columns = table_columns
+        self.queries_per_page = queries_per_page
+        self.signatures_per_page = signatures_per_page
+        self.random = random.Random(seed)
+        self.blocks: List[dict] = list()
+
+    def _id(self) -> str:
+        return str(uuid.UUID(int=self.random.getrandbits(128), version=4))
+
+    def _geometry(self) -> dict:
+        left = round(self.random.random() * 0.8, 6)
+        top = round(self.random.random() * 0.9, 6)
+        width = round(0.01 + self.random.random() * 0.19, 6)
+        height = round(0.005 + self.random.random() * 0.02, 6)
+        return {
+            'BoundingBox': {
+                'Width': width,
+                'Height': height,
+                'Left': left,
+                'Top': top
+            },
+            'Polygon': [{
+                'X': left,
+                'Y': top
+            }, {
+                'X': left + width,
+                'Y': top
+            }, {
+                'X': left + width,
+                'Y': top + height
+            }, {
+                'X': left,
+                'Y': top + height
+            }]
+        }
+
+    def _block(self, block_type: str, page: int, **kwargs) -> dict:
+        block = {
+            'BlockType': block_type,
+            'Confidence': round(90 + self.random.random() * 10, 6),
+            'Geometry': self._geometry(),
+            'Id': self._id(),
+            'Page': page
+        }
+        block.update(kwargs)
+        self.blocks.append(block)
+        return block
+
+    def _words(self, page: int, count: int) -> List[dict]:
+        return [self._block('WORD', page, Text=self.random.choice(WORDS), TextType='PRINTED') for _ in range(count)]
+
+    def _line(self, page: int, count: int) -> dict:
+        words = self._words(page, count)
+        return self._block('LINE',
+                           page,
+                           Text=" ".join(w['Text'] for w in words),
+                           Relationships=[{
+                               'Type': 'CHILD',
+                               'Ids': [w['Id'] for w in words]
+                           }])
+
+    def _page(self, page: int) -> List[str]:
+        # returns the ids of the PAGE children
+        children: List[str] = list()
+        for _ in range(self.lines_per_page):
+            children.append(self._line(page, self.words_per_line)['Id'])
+
+        for _ in range(self.key_values_per_page):
+            value_line = self._line(page, 2)
+            key_line = self._line(page, 2)
+            children.extend([key_line['Id'], value_line['Id']])
+            value = self._block('KEY_VALUE_SET',
+                                page,
+                                EntityTypes=['VALUE'],
+                                Relationships=[{
+                                    'Type': 'CHILD',
+                                    'Ids': value_line['Relationships'][0]['Ids']
+                                }])
+            key = self._block('KEY_VALUE_SET',
+                              page,
+                              EntityTypes=['KEY'],
+                              Relationships=[{
+                                  'Type': 'VALUE',
+                                  'Ids': [value['Id']]
+                              }, {
+                                  'Type': 'CHILD',
+                                  'Ids': key_line['Relationships'][0]['Ids']
+                              }])
+            children.extend([key['Id'], value['Id']])
+
+        for _ in range(self.tables_per_page):
+            cell_ids: List[str] = list()
+            for row in range(1, self.table_rows + 1):
+                for column in range(1, self.table_columns + 1):
+                    line = self._line(page, 1)
+                    children.append(line['Id'])
+                    cell = self._block('CELL',
+                                       page,
+                                       RowIndex=row,
+                                       ColumnIndex=column,
+                                       RowSpan=1,
+                                       ColumnSpan=1,
+                                       Relationships=[{
+                                           'Type': 'CHILD',
+                                           'Ids': line['Relationships'][0]['Ids']
+                                       }])
+                    cell_ids.append(cell['Id'])
+            table = self._block('TABLE', page, Relationships=[{'Type': 'CHILD', 'Ids': cell_ids}])
+            children.append(table['Id'])
+
+        for q in range(self.queries_per_page):
+            result = self._block('QUERY_RESULT', page, Text=" ".join(self.random.choice(WORDS) for _ in range(2)))
+            query = {
+                'BlockType': 'QUERY',
+                'Id': self._id(),
+                'Page': page,
+                'Query': {
+                    'Text': f"What is field {q}?",
+                    'Alias': f"FIELD_{q}"
+                },
+                'Relationships': [{
+                    'Type': 'ANSWER',
+                    'Ids': [result['Id']]
+                }]
+            }
+            self.blocks.append(query)
+            children.append(query['Id'])
+
+        for _ in range(self.signatures_per_page):
+            children.append(self._block('SIGNATURE', page)['Id'])
+        return children
+
+    def generate(self) -> dict:
+        self.blocks = list()
+        for page in range(1, self.pages + 1):
+            page_block = self._block('PAGE', page)
+            page_block['Geometry'] = {
+                'BoundingBox': {
+                    'Width': 1.0,
+                    'Height': 1.0,
+                    'Left': 0.0,
+                    'Top': 0.0
+                },
+                'Polygon': [{'X': 0.0, 'Y': 0.0}, {'X': 1.0, 'Y': 0.0}, {'X': 1.0, 'Y': 1.0}, {'X': 0.0, 'Y': 1.0}]
+            }
+            del page_block['Confidence']
+            page_block['Relationships'] = [{'Type': 'CHILD', 'Ids': self._page(page)}]
+        return {
+            'DocumentMetadata': {
+                'Pages': self.pages
+            },
+            'Blocks': self.blocks,
+            'AnalyzeDocumentModelVersion': '1.0'
+        }
+
+
+def generate_textract_response(**kwargs) -> dict:
+    return SyntheticTextractResponse(**kwargs).generate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="write a synthetic Textract AnalyzeDocument response to stdout")
+    parser.add_argument('--pages', type=int, default=1)
+    parser.add_argument('--lines-per-page', type=int, default=40)
+    parser.add_argument('--words-per-line', type=int, default=6)
+    parser.add_argument('--key-values-per-page', type=int, default=20)
+    parser.add_argument('--tables-per-page', type=int, default=2)
+    parser.add_argument('--table-rows', type=int, default=8)
+    parser.add_argument('--table-columns', type=int, default=5)
+    parser.add_argument('--queries-per-page', type=int, default=5)
+    parser.add_argument('--signatures-per-page', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(generate_textract_response(**vars(args))))
+
+
+if __name__ == "__main__":
+    main()
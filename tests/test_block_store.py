@@ -0,0 +1,53 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+BlockStore (lambda/generatecsv/app/block_store.py) against the trp2 conversions of the original
+generatecsv, on the columns the page CSV is written from
+"""
+import pytest
+
+from localpipeline.handlers import load_app_module
+from localpipeline.synthetic_textract import generate_textract_response
+
+t2 = pytest.importorskip("trp.trp2")
+t_pretty_print = pytest.importorskip("textractprettyprinter.t_pretty_print")
+
+
+def csv_columns(page_list):
+    # generatecsv writes x[1] (key name, query alias) and x[3] (value, query answer), trp2 takes the blocks
+    # of a page from a set, so the rows of a page are compared in any order
+    return [sorted([x[1], x[3]] for x in page) for page in page_list]
+
+
+@pytest.fixture
+def textract_response():
+    response = generate_textract_response(pages=3, queries_per_page=6)
+    # queries without alias are written with their text
+    for block in response['Blocks'][::2]:
+        if block['BlockType'] == 'QUERY':
+            del block['Query']['Alias']
+    return response
+
+
+def test_forms_match_trp2(textract_response):
+    block_store = load_app_module('generatecsv', 'block_store').BlockStore.from_textract_json(textract_response)
+    trp2_doc = t2.TDocumentSchema().load(textract_response)
+    assert csv_columns(block_store.forms()) == csv_columns(t_pretty_print.convert_form_to_list_trp2(trp2_doc))
+
+
+def test_queries_match_trp2(textract_response):
+    block_store = load_app_module('generatecsv', 'block_store').BlockStore.from_textract_json(textract_response)
+    trp2_doc = t2.TDocumentSchema().load(textract_response)
+    expected = csv_columns(t_pretty_print.convert_queries_to_list_trp2(trp2_doc))
+    assert csv_columns(block_store.queries()) == expected
+    assert any(row[0].startswith("What is field") for page in expected for row in page)
+
+
+def test_queries_without_answer_match_trp2(textract_response):
+    for block in textract_response['Blocks']:
+        if block['BlockType'] == 'QUERY':
+            del block['Relationships']
+    block_store = load_app_module('generatecsv', 'block_store').BlockStore.from_textract_json(textract_response)
+    trp2_doc = t2.TDocumentSchema().load(textract_response)
+    assert csv_columns(block_store.queries()) == csv_columns(t_pretty_print.convert_queries_to_list_trp2(trp2_doc))
@@ -0,0 +1,37 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Flat imports of the Lambda modules loaded by localpipeline/handlers.py, which resolve like in their images
+"""
+import importlib
+import sys
+
+from localpipeline.handlers import load_app_module, load_handler_module, load_shared_module
+
+
+def test_process_page_imports_the_renamed_handlers():
+    process_page = load_handler_module('process_page')
+    assert process_page.configurator is load_handler_module('configurator')
+    assert process_page.textract_sync is load_handler_module('textract_sync')
+    assert process_page.generatecsv is load_handler_module('generatecsv')
+    assert process_page.map_classifications is load_handler_module('map_classifications_lambda')
+    assert process_page.task_failed is load_shared_module('task_callback').task_failed
+
+
+def test_handlers_with_the_same_module_name_stay_apart():
+    textract_sync = load_handler_module('textract_sync')
+    comprehend_sync = load_handler_module('comprehend_sync')
+    join_csv = load_handler_module('join_csv')
+    assert len({textract_sync.__file__, comprehend_sync.__file__, join_csv.__file__}) == 3
+    # sibling and shared modules are loaded once
+    assert textract_sync.TextractResultCache is load_app_module('textract_sync', 'textract_cache').TextractResultCache
+    assert textract_sync.RateLimiter is comprehend_sync.RateLimiter
+    # the flat names are not left in sys.modules, where the first loaded module would win
+    assert not {'main', 'sync_main', 'configurator_main', 'textract_cache'} & set(sys.modules)
+
+
+def test_deferred_imports_resolve_to_the_loaded_modules(monkeypatch):
+    # imports in functions run after the load, e.g. `from columnar_output import ...` of join_csv
+    monkeypatch.delitem(sys.modules, 'page_count', raising=False)
+    assert importlib.import_module('page_count') is load_app_module('startstepfunction', 'page_count')
@@ -0,0 +1,98 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Page counting of the single page fast path (lambda/startstepfunction/app/page_count.py) on sample-doc.pdf
+and small hand-built PDF and TIFF files
+"""
+import io
+import os
+import struct
+
+import pytest
+
+from localpipeline.handlers import load_app_module
+
+SAMPLE_DOC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample-doc.pdf')
+
+ONE_PAGE_PDF = (b"%PDF-1.4\n"
+                b"1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n"
+                b"2 0 obj << /Type /Pages /Kids [3 0 R] /Count 1 >> endobj\n"
+                b"3 0 obj << /Type /Page /Parent 2 0 R >> endobj\n"
+                b"%%EOF\n")
+
+
+@pytest.fixture
+def page_count():
+    return load_app_module('startstepfunction', 'page_count')
+
+
+def tiff(next_offsets, endian="<", entries=1):
+    """TIFF header and one IFD of `entries` entries per next offset, the IFDs follow each other from offset 8."""
+    header = (b"II*\x00" if endian == "<" else b"MM\x00*") + struct.pack(endian + "I", 8)
+    ifds = b"".join(struct.pack(endian + "H", entries) + b"\x00" * 12 * entries + struct.pack(endian + "I", offset)
+                    for offset in next_offsets)
+    return header + ifds
+
+
+def ifd_offset(index, entries=1):
+    return 8 + index * (2 + 12 * entries + 4)
+
+
+class RangeS3():
+    """get_object with the inclusive byte Range of s3_io.get_bytes"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.ranges = []
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.ranges.append(Range)
+        start, end = Range[len("bytes="):].split("-")
+        return {'Body': io.BytesIO(self.body[int(start):int(end) + 1])}
+
+
+def test_count_pdf_pages(page_count):
+    with open(SAMPLE_DOC, 'rb') as f:
+        assert page_count.count_pdf_pages(f.read()) == 3
+    # /Type /Pages of the page tree node is not a page
+    assert page_count.count_pdf_pages(ONE_PAGE_PDF) == 1
+    assert page_count.count_pdf_pages(ONE_PAGE_PDF.replace(b"/Type /Page ", b"/Type /Font ")) is None
+    assert page_count.count_pdf_pages(b"GIF89a" + ONE_PAGE_PDF) is None
+
+
+def test_count_pdf_pages_with_object_streams(page_count):
+    # pages compressed in an object stream can not be counted
+    object_stream = b"4 0 obj << /Type /ObjStm /N 1 /First 4 /Length 0 >> stream\nendstream endobj\n"
+    assert page_count.count_pdf_pages(ONE_PAGE_PDF.replace(b"%%EOF", object_stream + b"%%EOF")) is None
+
+
+def test_count_tiff_pages(page_count):
+    assert page_count.count_tiff_pages(tiff([0])) == 1
+    assert page_count.count_tiff_pages(tiff([ifd_offset(1), 0])) == 2
+    assert page_count.count_tiff_pages(tiff([ifd_offset(1), ifd_offset(2), 0], endian=">")) == 3
+    assert page_count.count_tiff_pages(ONE_PAGE_PDF) is None
+
+
+def test_count_tiff_pages_loop_and_truncation(page_count):
+    assert page_count.count_tiff_pages(tiff([ifd_offset(1), ifd_offset(0)])) is None
+    assert page_count.count_tiff_pages(tiff([0])[:-1]) is None
+    assert page_count.count_tiff_pages(tiff([ifd_offset(1)])) is None
+
+
+def test_is_single_page_reads_one_byte_more_than_max_bytes(page_count):
+    s3 = RangeS3(ONE_PAGE_PDF)
+    assert page_count.is_single_page(s3, "bucket", "uploads/doc.pdf", max_bytes=len(ONE_PAGE_PDF))
+    assert s3.ranges == [f"bytes=0-{len(ONE_PAGE_PDF)}"]
+    assert not page_count.is_single_page(s3, "bucket", "uploads/doc.pdf", max_bytes=len(ONE_PAGE_PDF) - 1)
+    assert page_count.is_single_page(RangeS3(tiff([0])), "bucket", "uploads/doc.TIF", max_bytes=1024)
+    assert not page_count.is_single_page(RangeS3(tiff([ifd_offset(1), 0])), "bucket", "uploads/doc.tiff",
+                                         max_bytes=1024)
+
+
+def test_is_single_page_by_extension(page_count):
+    s3 = RangeS3(b"")
+    assert page_count.is_single_page(s3, "bucket", "uploads/scan.JPG", max_bytes=1024)
+    assert page_count.is_single_page(s3, "bucket", "uploads/scan.png", max_bytes=1024)
+    assert not page_count.is_single_page(s3, "bucket", "uploads/letter.docx", max_bytes=1024)
+    assert s3.ranges == []
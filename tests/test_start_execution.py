@@ -0,0 +1,106 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Duplicate suppression of the start Lambda (lambda/startstepfunction/app/dedup_store.py and
+start_execution.start) with the in-memory store and a Step Functions stand-in
+"""
+import json
+
+import pytest
+
+from localpipeline.handlers import load_app_module, load_handler_module
+
+STATE_MACHINE_ARN = "arn:aws:states:us-east-1:123456789012:stateMachine:DocumentSplitter"
+
+
+class StepFunctions():
+    """start_execution that records its calls and raises the first `failures` times"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.executions = []
+
+    def start_execution(self, stateMachineArn, name, input):
+        if self.failures:
+            self.failures -= 1
+            raise Exception("ServiceUnavailable")
+        self.executions.append({'stateMachineArn': stateMachineArn, 'name': name, 'input': json.loads(input)})
+        return {'executionArn': f"{stateMachineArn}:{name}"}
+
+
+@pytest.fixture
+def dedup_store():
+    return load_app_module('startstepfunction', 'dedup_store')
+
+
+@pytest.fixture
+def start_execution(monkeypatch):
+    module = load_handler_module('startstepfunction')
+    monkeypatch.setattr(module, 'dedup_stores', dict())
+    monkeypatch.setenv('FAST_PATH', "NONE")
+    return module
+
+
+def test_dedup_key(dedup_store):
+    assert dedup_store.dedup_key("bucket", "uploads/doc.pdf", '"abc"') == "bucket/uploads/doc.pdf#abc"
+    assert dedup_store.dedup_key("bucket", "uploads/doc.pdf", None) is None
+
+
+def test_in_memory_claim(dedup_store):
+    store = dedup_store.InMemoryDedupStore(window_s=3600, max_entries=2)
+    assert store.claim("a")
+    assert not store.claim("a")
+    store.release("a")
+    assert store.claim("a")
+    # the oldest claims are dropped beyond max_entries
+    assert store.claim("b") and store.claim("c")
+    assert store.claim("a")
+    # expired claims can be claimed again
+    expired = dedup_store.InMemoryDedupStore(window_s=-1)
+    assert expired.claim("a") and expired.claim("a")
+
+
+def test_start_suppresses_duplicates(start_execution, monkeypatch):
+    step_functions = StepFunctions()
+    monkeypatch.setattr(start_execution, 'step_functions_client', step_functions)
+    assert start_execution.start(STATE_MACHINE_ARN, "bucket", "uploads/doc.pdf", '"v1"', None, "MEMORY") == "STARTED"
+    assert start_execution.start(STATE_MACHINE_ARN, "bucket", "uploads/doc.pdf", '"v1"', None, "MEMORY") == "DUPLICATE"
+    # an overwritten object has a new ETag
+    assert start_execution.start(STATE_MACHINE_ARN, "bucket", "uploads/doc.pdf", '"v2"', None, "MEMORY") == "STARTED"
+    assert [e['input']['s3Path'] for e in step_functions.executions] == ["s3://bucket/uploads/doc.pdf"] * 2
+    assert len({e['name'] for e in step_functions.executions}) == 2
+
+
+def test_start_without_dedup_store(start_execution, monkeypatch):
+    step_functions = StepFunctions()
+    monkeypatch.setattr(start_execution, 'step_functions_client', step_functions)
+    for _ in range(2):
+        assert start_execution.start(STATE_MACHINE_ARN, "bucket", "uploads/doc.pdf", '"v1"', None, "NONE") == "STARTED"
+    assert len(step_functions.executions) == 2
+    assert start_execution.dedup_stores == dict()
+
+
+def test_failed_start_releases_the_claim(start_execution, monkeypatch):
+    step_functions = StepFunctions(failures=1)
+    monkeypatch.setattr(start_execution, 'step_functions_client', step_functions)
+    with pytest.raises(Exception, match="ServiceUnavailable"):
+        start_execution.start(STATE_MACHINE_ARN, "bucket", "uploads/doc.pdf", '"v1"', None, "MEMORY")
+    assert start_execution.dedup_stores["MEMORY"].entries == dict()
+    # the retried event is started, not suppressed as duplicate
+    assert start_execution.start(STATE_MACHINE_ARN, "bucket", "uploads/doc.pdf", '"v1"', None, "MEMORY") == "STARTED"
+    assert len(step_functions.executions) == 1
+
+
+def test_sqs_batch_reports_failed_records(start_execution, monkeypatch):
+    step_functions = StepFunctions(failures=1)
+    monkeypatch.setattr(start_execution, 'step_functions_client', step_functions)
+    monkeypatch.setenv('STATE_MACHINE_ARN', STATE_MACHINE_ARN)
+    monkeypatch.setenv('DEDUP_STORE', "MEMORY")
+    monkeypatch.setenv('START_WORKERS', "1")
+    event = {'Records': [{'eventSource': "aws:sqs", 'messageId': "m1",
+                          'body': json.dumps({'bucket': "bucket", 'key': "uploads/doc.pdf", 'etag': "v1"})}]}
+    assert start_execution.lambda_handler(event, None) == {"batchItemFailures": [{"itemIdentifier": "m1"}]}
+    assert start_execution.lambda_handler(event, None) == {"batchItemFailures": []}
+    assert start_execution.lambda_handler(event, None) == {"batchItemFailures": []}
+    assert len(step_functions.executions) == 1
@@ -0,0 +1,47 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+StreamingBlockResolver (lambda/generatecsv/app/streaming.py) against the trp2 conversions of the original
+generatecsv for PARSE_MODE STREAMING
+"""
+import pytest
+
+from localpipeline.handlers import load_app_module
+from localpipeline.synthetic_textract import generate_textract_response
+
+t2 = pytest.importorskip("trp.trp2")
+t_pretty_print = pytest.importorskip("textractprettyprinter.t_pretty_print")
+
+
+@pytest.fixture
+def textract_response():
+    response = generate_textract_response(pages=3, queries_per_page=6)
+    for block in response['Blocks']:
+        # trp2 follows the PAGE's CHILD order, not the order of the Blocks array
+        if block['BlockType'] == 'PAGE':
+            block['Relationships'][0]['Ids'].reverse()
+    for block in response['Blocks'][::2]:
+        if block['BlockType'] == 'QUERY':
+            del block['Query']['Alias']
+    return response
+
+
+def resolve(textract_response, **kwargs):
+    streaming = load_app_module('generatecsv', 'streaming')
+    resolver = streaming.StreamingBlockResolver(**kwargs)
+    return list(streaming.resolve_blocks(textract_response['Blocks'], resolver))
+
+
+def test_lines_match_trp2(textract_response):
+    trp2_doc = t2.TDocumentSchema().load(textract_response)
+    expected = "".join(t2.TDocument.get_text_for_tblocks(trp2_doc.lines(page=page)) for page in trp2_doc.pages)
+    events = resolve(textract_response, emit_lines=True, emit_fields=False)
+    assert "".join(value[1] for kind, value in events if kind == "LINES") == expected
+
+
+def test_queries_match_trp2(textract_response):
+    trp2_doc = t2.TDocumentSchema().load(textract_response)
+    expected = sorted([x[1], x[3]] for page in t_pretty_print.convert_queries_to_list_trp2(trp2_doc) for x in page)
+    events = resolve(textract_response)
+    assert sorted([row[1], row[3]] for kind, row in events if kind == "QUERIES") == expected